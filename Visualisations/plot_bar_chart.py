@@ -36,39 +36,40 @@ def plot_custom_bar_chart(
         st.error("Data is missing or incorrect column names provided.")
         logger.error("Data is missing or incorrect column names provided.")
         return
-    
-    # CRITICAL: Normalize string columns to prevent LargeUTF8 errors
-    from data.data_file_defs import normalize_string_columns_for_streamlit
-    graph_df = normalize_string_columns_for_streamlit(graph_df.copy())
 
     # Aggregate Data
     if agg_func == "sum":
         df_agg = (
-            graph_df.groupby([XValues] + ([group_column] if group_column else []))
+            graph_df.groupby([XValues] + ([group_column] if group_column else []),
+                             observed=True)
             .agg({YValues: "sum"})
             .reset_index()
         )
     elif agg_func == "avg":
         df_agg = (
-            graph_df.groupby([XValues] + ([group_column] if group_column else []))
+            graph_df.groupby([XValues] + ([group_column] if group_column else []),
+                             observed=True)
             .agg({YValues: "mean"})
             .reset_index()
         )
     elif agg_func == "count":
         df_agg = (
-            graph_df.groupby([XValues] + ([group_column] if group_column else []))
+            graph_df.groupby([XValues] + ([group_column] if group_column else []),
+                             observed=True)
             .agg({YValues: "count"})
             .reset_index()
         )
     elif agg_func == "max":
         df_agg = (
-            graph_df.groupby([XValues] + ([group_column] if group_column else []))
+            graph_df.groupby([XValues] + ([group_column] if group_column else []),
+                             observed=True)
             .agg({YValues: "max"})
             .reset_index()
         )
     elif agg_func == "min":
         df_agg = (
-            graph_df.groupby([XValues] + ([group_column] if group_column else []))
+            graph_df.groupby([XValues] + ([group_column] if group_column else []),
+                             observed=True)
             .agg({YValues: "min"})
             .reset_index()
         )
@@ -33,10 +33,6 @@ def plot_bar_line_by_year(
     if graph_df is None or graph_df.empty:
         st.warning("No data available to plot.")
         return
-    
-    # CRITICAL: Normalize string columns to prevent LargeUTF8 errors
-    from data.data_file_defs import normalize_string_columns_for_streamlit
-    graph_df = normalize_string_columns_for_streamlit(graph_df.copy())
 
     required_columns = [XValues, GroupData, YValues]
     missing_columns = [col for col in required_columns if col not in graph_df]
@@ -57,10 +57,6 @@ def plot_pie_chart(
     if graph_df is None or XValues not in graph_df:
         st.error("Data is missing or incorrect column name provided.")
         return
-    
-    # CRITICAL: Normalize string columns to prevent LargeUTF8 errors
-    from data.data_file_defs import normalize_string_columns_for_streamlit
-    graph_df = normalize_string_columns_for_streamlit(graph_df.copy())
 
     # Define custom color mapping (Adjust colors as needed)
     color_mapping = political_colors
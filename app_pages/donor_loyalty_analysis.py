@@ -6,7 +6,8 @@ import streamlit as st
 import pandas as pd
 # import numpy as np
 from utils.logger import log_function_call
-from data.data_file_defs import normalize_string_columns_for_streamlit
+from components.render_adapter import display_dataframe
+from data.shared_dataset import get_session_frame
 from Visualisations import plot_bar_chart
 # from components.calculations import calculate_agg_by_variable
 # from utils.logger import logger
@@ -52,11 +53,11 @@ def mod_donor_loyalty():
     """)
 
     # Get the cleaned data
-    if st.session_state.get("data_clean") is None:
+    if get_session_frame("data_clean") is None:
         st.warning("Data not loaded. Please go to the main page first.")
         return
 
-    df = st.session_state.get("data_clean")
+    df = get_session_frame("data_clean")
 
     # Filter to only parties (exclude individuals and other entities)
     # Focus on RegulatedEntityName that are actual parties
@@ -118,7 +119,8 @@ def display_donor_distribution(donor_df, parties_list):
     """)
 
     # Count parties donated to per donor
-    donor_party_counts = donor_df.groupby('DonorName')['PartyName'].nunique()
+    donor_party_counts = donor_df.groupby(
+        'DonorName', observed=True)['PartyName'].nunique()
 
     col1, col2, col3, col4 = st.columns(4)
     with col1:
@@ -255,10 +257,7 @@ def display_government_period_analysis(donor_df, parties_list):
                 values='Donations',
                 aggfunc='sum'
             )
-            pivot_display = normalize_string_columns_for_streamlit(
-                pivot_display.fillna(0).astype(int)
-            )
-            st.dataframe(pivot_display)
+            display_dataframe(pivot_display.fillna(0).astype(int))
         else:
             st.info("No donation data available for major parties")
 
@@ -287,11 +286,10 @@ def display_government_period_analysis(donor_df, parties_list):
 
         if value_data:
             value_df = pd.DataFrame(value_data)
-            value_df = normalize_string_columns_for_streamlit(value_df)
-            st.dataframe(value_df.style.format({
+            display_dataframe(value_df, formats={
                 'Avg Donation': '${:,.2f}',
                 'Total': '${:,.0f}'
-            }))
+            })
         else:
             st.info("No value data available")
 
@@ -314,7 +312,8 @@ def display_loyalty_metrics(donor_df, parties_list):
     # Calculate loyalty for each donor
     loyalty_list = []
     donor_party_donations = donor_df.groupby(
-        ['DonorName', 'PartyName']).size().reset_index(name='count')
+        ['DonorName', 'PartyName'], observed=True
+    ).size().reset_index(name='count')
 
     for donor in donor_df['DonorName'].unique():
         donor_donations = donor_party_donations[
@@ -418,8 +417,7 @@ def display_loyalty_metrics(donor_df, parties_list):
             top_loyal = loyalty_df.nlargest(10, 'Loyalty_Score')[
                 ['Donor', 'Loyalty_Score', 'Parties_Count', 'Top_Party']
             ]
-            top_loyal = normalize_string_columns_for_streamlit(top_loyal)
-            st.dataframe(top_loyal.style.format({'Loyalty_Score': '{:.2%}'}))
+            display_dataframe(top_loyal, formats={'Loyalty_Score': '{:.2%}'})
 
         # Power followers analysis
         st.write("---")
@@ -448,9 +446,5 @@ def display_loyalty_metrics(donor_df, parties_list):
                 "Sample power followers (donors giving to "
                 "multiple parties):"
             )
-            power_followers_display = normalize_string_columns_for_streamlit(
-                power_followers.head(10)
-            )
-            st.dataframe(power_followers_display.style.format(
-                {'Loyalty_Score': '{:.2%}'}
-            ))
+            display_dataframe(power_followers.head(10),
+                              formats={'Loyalty_Score': '{:.2%}'})
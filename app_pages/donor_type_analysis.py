@@ -2,7 +2,11 @@ import streamlit as st
 from components.modular_page_blocks import load_and_filter_data
 from Visualisations.plot_stacked_bar_chart import plot_stacked_bar_chart
 from utils.logger import log_function_call
-from data.data_file_defs import normalize_string_columns_for_streamlit
+from components.render_adapter import display_dataframe
+
+# Columns of the cleaned data used by this page
+DONOR_TYPE_COLUMNS = ["ReceivedDate", "parliamentary_sitting", "Party_Group",
+                      "DonorStatus", "Value"]
 
 
 @log_function_call
@@ -19,7 +23,8 @@ def mod_donor_type():
     # Load and filter data
     cleaned_df, filtered_df = load_and_filter_data(
         filter_key=None,
-        pagereflabel="donor_type_analysis"
+        pagereflabel="donor_type_analysis",
+        columns=DONOR_TYPE_COLUMNS
     )
 
     if cleaned_df is None or filtered_df is None:
@@ -206,8 +211,7 @@ def mod_donor_type():
                 lambda x: f"{x:,.0f}"
             )
 
-    grouped_data = normalize_string_columns_for_streamlit(grouped_data)
-    st.dataframe(
+    display_dataframe(
         grouped_data,
         use_container_width=True
     )
@@ -5,7 +5,7 @@ from Visualisations import (
     plot_bar_chart
 )
 from utils.logger import log_function_call, logger
-from data.data_file_defs import normalize_string_columns_for_streamlit
+from components.render_adapter import display_dataframe
 from components.calculations import (
     format_number,
     calculate_percentage,
@@ -16,8 +16,14 @@ from components.calculations import (
 from components.modular_page_blocks import (
     load_and_filter_data,
     display_summary_statistics,
+    SUMMARY_COLUMNS,
     )
 
+# Columns of the cleaned data used by the headline figures tabs
+HEADLINE_COLUMNS = SUMMARY_COLUMNS + ["DonationType", "RegulatedEntityType",
+                                      "Party_Group", "YearReceived",
+                                      "DubiousData"]
+
 
 @log_function_call
 def hlf_body():
@@ -38,7 +44,8 @@ def hlf_body():
     with tab1:
         cleaned_df, filtered_df = (
             load_and_filter_data(filter_key=filter_key,
-                                 pagereflabel="headlinefigures"))
+                                 pagereflabel="headlinefigures",
+                                 columns=HEADLINE_COLUMNS))
         if cleaned_df is None or filtered_df is None:
             logger.error("Data not loaded or filtered")
             return
@@ -326,10 +333,7 @@ def hlf_body():
             avg_donation_sorted["Average Donation"] = (
                 avg_donation_sorted["Average Donation"]
                 .apply(lambda x: f"£{format_number(x)}"))
-            avg_donation_sorted = normalize_string_columns_for_streamlit(
-                avg_donation_sorted
-            )
-            st.dataframe(avg_donation_sorted)
+            display_dataframe(avg_donation_sorted)
         st.write("---")
 # End of hlf_body function
 # Path: app_pages/headlinefigures.py
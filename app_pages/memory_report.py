@@ -0,0 +1,41 @@
+import streamlit as st
+from components.render_adapter import display_dataframe
+from data.data_loader import PAGE_FRAMES
+from data.memory_report import (load_memory_reports, memory_report_frame,
+                                session_memory_frame)
+from utils.logger import log_function_call
+
+
+@log_function_call
+def mod_memory_report():
+    """
+    Admin page showing the memory of each artifact before and after the
+    compact dtype plan, per column, and the frames held by this session
+    """
+    st.title("Memory Report")
+    if not st.session_state.get("security", {}).get("is_admin", False):
+        st.warning("Log in as admin to view the memory report.")
+        return
+
+    st.subheader("Frames in this session")
+    session_df = session_memory_frame(PAGE_FRAMES)
+    if session_df.empty:
+        st.info("No frames loaded.")
+    else:
+        display_dataframe(session_df)
+
+    st.subheader("Artifacts")
+    reports = load_memory_reports()
+    if not reports:
+        st.info("No memory reports yet, they are written when the data is"
+                " next rebuilt.")
+        return
+    for report in reports:
+        before_mb = report["bytes_before"] / 1e6
+        after_mb = report["bytes_after"] / 1e6
+        with st.expander(f"{report['artifact']}: {before_mb:.1f} MB to"
+                         f" {after_mb:.1f} MB"
+                         f" ({before_mb / max(after_mb, 1e-6):.1f}x),"
+                         f" {report['rows']:,} rows"):
+            st.caption(f"Built {report['created_at']}")
+            display_dataframe(memory_report_frame(report))
@@ -5,6 +5,8 @@ from components.modular_page_blocks import (
     display_textual_insights_custom,
     display_visualizations,
     load_and_filter_data,
+    SUMMARY_COLUMNS,
+    VISUALIZATION_COLUMNS,
 )
 from components.text_management import manage_text_elements
 # from utils.logger import logger
@@ -21,8 +23,10 @@ def display_data_page(functionname, filter_key, target_label):
     with tab1:
         pageref_label = filter_key + target_label
         (cleaned_df,
-         cleaned_c_d_df) = load_and_filter_data(filter_key,
-                                                pageref_label)
+         cleaned_c_d_df) = load_and_filter_data(
+             filter_key,
+             pageref_label,
+             columns=SUMMARY_COLUMNS + VISUALIZATION_COLUMNS)
         if cleaned_df is None:
             return
         (min_date,
@@ -5,6 +5,8 @@ from components.modular_page_blocks import (
     display_textual_insights_predefined,
     display_textual_insights_custom,
     display_visualizations,
+    SUMMARY_COLUMNS,
+    VISUALIZATION_COLUMNS,
 )
 # from utils.logger import logger
 from utils.logger import log_function_call  # Import decorator
@@ -32,7 +34,8 @@ def display_per_group_data_page(
         filter_key=filter_key,
         pageref_label=pageref_label,
         functionname=functionname,
-        tab_name=tab_name
+        tab_name=tab_name,
+        columns=SUMMARY_COLUMNS + VISUALIZATION_COLUMNS,
     )
 
     if cleaned_df is None:
@@ -1,9 +1,10 @@
 import streamlit as st
 import components.calculations as ppcalc
+from data.shared_dataset import get_session_frame
 
 
 def notesondataprep_body():
-    df = st.session_state.get("data_clean", None)
+    df = get_session_frame("data_clean")
     # set filters to None and filtered_df to the original dataset
     filters = None
     filtered_df = df
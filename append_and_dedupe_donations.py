@@ -1,138 +1,149 @@
 """
-Script to append new donations data and remove duplicates
-Appends Donations_accepted_by_political_parties_20260116.csv to 
-Donations_accepted_by_political_parties.csv and removes duplicates based on ECRef
+Script to append new donations data to the partitioned source store
+Appends an Electoral Commission export (e.g.
+Donations_accepted_by_political_parties_20260116.csv) to the source store
+kept next to Donations_accepted_by_political_parties.zip, matching records
+on ECRef. Only the year partitions that receive new or changed records are
+rewritten, so a weekly delta does not rewrite the whole register.
 Works with both CSV and ZIP formats (automatically uses ZIP if available)
+
+Before an append the store is backed up to its content-addressed backup
+store, which keeps only the chunks of records no earlier backup holds.
+
+Usage:
+    python append_and_dedupe_donations.py --init    # build the store once
+    python append_and_dedupe_donations.py [new_file ...]
+    python append_and_dedupe_donations.py --list-backups
+    python append_and_dedupe_donations.py --restore BACKUP_ID
 """
 
-import pandas as pd
+import argparse
 import os
-import zipfile
-from datetime import datetime
+import sys
+import config
+from data.source_store import (append_export, build_store,
+                               load_store_manifest, store_dir)
+from data.source_backup import list_backups, restore_backup
 
 # Define file paths
 SOURCE_DIR = "source"
-MAIN_FILE = os.path.join(SOURCE_DIR, "Donations_accepted_by_political_parties.csv")
+MAIN_FILE = os.path.join(SOURCE_DIR, config.FILENAMES["source_dir"]["source_data_fname"])
 NEW_FILE = os.path.join(SOURCE_DIR, "Donations_accepted_by_political_parties_20260116.csv")
-BACKUP_FILE = os.path.join(SOURCE_DIR, f"Donations_accepted_by_political_parties_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
-
-def read_csv_or_zip(filepath):
-    """Read CSV from either ZIP file or regular CSV"""
-    zip_path = filepath.replace('.csv', '.zip')
-    if os.path.exists(zip_path):
-        print(f"Reading from ZIP: {zip_path}")
-        with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-            csv_filename = os.path.basename(filepath)
-            with zip_ref.open(csv_filename) as f:
-                return pd.read_csv(f)
-    elif os.path.exists(filepath):
-        print(f"Reading from CSV: {filepath}")
-        return pd.read_csv(filepath)
-    else:
-        return None
-
-def save_to_zip(df, csv_filepath):
-    """Save DataFrame to ZIP file"""
-    zip_filepath = csv_filepath.replace('.csv', '.zip')
-    csv_filename = os.path.basename(csv_filepath)
-    
-    with zipfile.ZipFile(zip_filepath, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
-        csv_string = df.to_csv(index=False)
-        zip_ref.writestr(csv_filename, csv_string)
-    
-    return zip_filepath
-
-
-def append_and_dedupe():
+
+
+def file_exists(filepath):
+    """True if the CSV or ZIP version of the file exists"""
+    base = os.path.splitext(filepath)[0]
+    return any(os.path.exists(base + ext) for ext in ('.csv', '.zip'))
+
+
+def init_store():
     """
-    Append new donations data and remove duplicates
+    Build the partitioned store from the current main file
     """
-    # Check if files exist (either CSV or ZIP)
-    main_exists = os.path.exists(MAIN_FILE) or os.path.exists(MAIN_FILE.replace('.csv', '.zip'))
-    new_exists = os.path.exists(NEW_FILE) or os.path.exists(NEW_FILE.replace('.csv', '.zip'))
-    
-    if not main_exists:
-        print(f"Error: Main file not found: {MAIN_FILE} or .zip version")
+    if load_store_manifest(store_dir(MAIN_FILE)) is not None:
+        print(f"Store already exists: {store_dir(MAIN_FILE)}")
+        return True
+    if not file_exists(MAIN_FILE):
+        print(f"Error: Main file not found: {MAIN_FILE} or .csv version")
         return False
+    print(f"Building source store from: {MAIN_FILE}")
+    rows = build_store(MAIN_FILE)
+    store_manifest = load_store_manifest(store_dir(MAIN_FILE))
+    print(f"Stored {rows:,} records in"
+          f" {len(store_manifest['partitions'])} partitions"
+          f" at {store_dir(MAIN_FILE)}")
+    return True
 
-    if not new_exists:
-        print(f"Error: New file not found: {NEW_FILE} or .zip version")
-        return False
 
-    print(f"Loading main file: {MAIN_FILE}")
-    df_main = read_csv_or_zip(MAIN_FILE)
-    if df_main is None:
-        print(f"Error: Could not read main file")
+def append_and_dedupe(new_file=NEW_FILE):
+    """
+    Append new donations data, replacing changed records and skipping
+    duplicates based on ECRef
+    """
+    if load_store_manifest(store_dir(MAIN_FILE)) is None:
+        print(f"Error: Source store not found: {store_dir(MAIN_FILE)}")
+        print("Run with --init to build it from the main file first")
         return False
-    initial_count = len(df_main)
-    print(f"Main file has {initial_count:,} records")
 
-    print(f"\nLoading new file: {NEW_FILE}")
-    df_new = read_csv_or_zip(NEW_FILE)
-    if df_new is None:
-        print(f"Error: Could not read new file")
+    if not file_exists(new_file):
+        print(f"Error: New file not found: {new_file} or .zip version")
         return False
-    new_count = len(df_new)
-    print(f"New file has {new_count:,} records")
-
-    # Create backup of main file (as ZIP)
-    print(f"\nCreating backup ZIP: {BACKUP_FILE.replace('.csv', '.zip')}")
-    save_to_zip(df_main, BACKUP_FILE)
-
-    # Append new data
-    print("\nAppending new data...")
-    df_combined = pd.concat([df_main, df_new], ignore_index=True)
-    combined_count = len(df_combined)
-    print(f"Combined data has {combined_count:,} records")
-
-    # Remove duplicates based on ECRef (unique donation reference)
-    print("\nRemoving duplicates based on ECRef...")
-    df_deduplicated = df_combined.drop_duplicates(subset=['ECRef'], keep='first')
-    final_count = len(df_deduplicated)
-    duplicates_removed = combined_count - final_count
-    print(f"Removed {duplicates_removed:,} duplicate records")
-    print(f"Final dataset has {final_count:,} records")
-
-    # Reset index
-    df_deduplicated = df_deduplicated.reset_index(drop=True)
-    df_deduplicated['index'] = df_deduplicated.index
-
-    # Reorder columns to match original (index first)
-    cols = df_deduplicated.columns.tolist()
-    if 'index' in cols:
-        cols.remove('index')
-        cols = ['index'] + cols
-        df_deduplicated = df_deduplicated[cols]
-
-    # Save the deduplicated data back to main file as ZIP
-    zip_file = MAIN_FILE.replace('.csv', '.zip')
-    print(f"\nSaving deduplicated data to: {zip_file}")
-    save_to_zip(df_deduplicated, MAIN_FILE)
-    
-    # Remove old CSV if it exists
-    if os.path.exists(MAIN_FILE):
-        os.remove(MAIN_FILE)
-        print(f"Removed old CSV file: {MAIN_FILE}")
+
+    print(f"Appending: {new_file}")
+    counts = append_export(MAIN_FILE, new_file)
+    store_manifest = load_store_manifest(store_dir(MAIN_FILE))
 
     print("\n" + "="*60)
     print("SUMMARY:")
-    print(f"  Initial records:      {initial_count:,}")
-    print(f"  New records added:    {new_count:,}")
-    print(f"  Duplicates removed:   {duplicates_removed:,}")
-    print(f"  Final record count:   {final_count:,}")
-    print(f"  Net new records:      {final_count - initial_count:,}")
+    print(f"  Records in file:      {counts['received']:,}")
+    print(f"  Inserted:             {counts['inserted']:,}")
+    print(f"  Updated:              {counts['updated']:,}")
+    print(f"  Duplicates:           {counts['duplicates']:,}")
+    print(f"  Rejected (no ECRef):  {counts['rejected']:,}")
+    print(f"  Partitions rewritten: {', '.join(counts['partitions']) or 'none'}")
+    print(f"  Final record count:   {store_manifest['rows']:,}")
     print("="*60)
-    print(f"\nBackup saved to: {BACKUP_FILE.replace('.csv', '.zip')}")
-    print(f"Main file saved as: {zip_file}")
     print("Process completed successfully!")
 
     return True
 
 
+def show_backups():
+    """
+    List the backups of the store
+    """
+    backups = list_backups(MAIN_FILE)
+    if not backups:
+        print(f"No backups of {store_dir(MAIN_FILE)}")
+        return True
+    print(f"{'Backup':<20} {'Created':<20} {'Records':>9} {'New MB':>7}  Note")
+    for backup in backups:
+        print(f"{backup['backup_id']:<20} {backup['created_at']:<20}"
+              f" {backup['rows']:>9,} {backup['new_bytes'] / 1e6:>7.2f}"
+              f"  {backup['note'] or ''}")
+    return True
+
+
+def restore(backup_id):
+    """
+    Restore the store to a backup
+    """
+    if load_store_manifest(store_dir(MAIN_FILE)) is None:
+        print(f"Error: Source store not found: {store_dir(MAIN_FILE)}")
+        return False
+    print(f"Restoring {store_dir(MAIN_FILE)} to backup {backup_id}")
+    rewritten = restore_backup(MAIN_FILE, backup_id)
+    store_manifest = load_store_manifest(store_dir(MAIN_FILE))
+    print(f"  Partitions rewritten: {', '.join(rewritten) or 'none'}")
+    print(f"  Final record count:   {store_manifest['rows']:,}")
+    return True
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("new_files", nargs="*", default=[NEW_FILE],
+                        help="Electoral Commission export(s) to append")
+    parser.add_argument("--init", action="store_true",
+                        help="build the store from the main file")
+    parser.add_argument("--list-backups", action="store_true",
+                        help="list the backups of the store")
+    parser.add_argument("--restore", metavar="BACKUP_ID",
+                        help="restore the store to a backup")
+    args = parser.parse_args()
     try:
-        append_and_dedupe()
+        if args.init:
+            ok = init_store()
+        elif args.list_backups:
+            ok = show_backups()
+        elif args.restore:
+            ok = restore(args.restore)
+        else:
+            ok = all([append_and_dedupe(new_file)
+                      for new_file in args.new_files])
+        sys.exit(0 if ok else 1)
     except Exception as e:
         print(f"\nError occurred: {e}")
         import traceback
-        traceback.print_exc()
\ No newline at end of file
+        traceback.print_exc()
+        sys.exit(1)
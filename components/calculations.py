@@ -1,6 +1,12 @@
+import numpy as np
 import pandas as pd
 import streamlit as st
-from components.filters import apply_filters
+from components.filters import apply_filters, filter_by_date
+from data.shared_dataset import get_session_frame
+from data.analytics_store import (VIEW_NAME, analytics_store_available,
+                                  query, where_clause)
+from data.out_of_core import fact_partitions, out_of_core_enabled
+from components.render_adapter import display_table
 from utils.logger import logger
 
 
@@ -8,6 +14,31 @@ from utils.logger import logger
 PLACEHOLDER_DATE = st.session_state.get("PLACEHOLDER_DATE")
 PLACEHOLDER_ID = st.session_state.get("PLACEHOLDER_ID")
 
+# Summary statistics of an empty selection
+EMPTY_SUMMARY_STATISTICS = {
+    "unique_reg_entities": 0,
+    "unique_donors": 0,
+    "unique_donations": 0,
+    "total_value": 0.0,
+    "mean_value": 0.0,
+    "avg_donations_per_entity": 0.0,
+    "avg_value_per_entity": 0.0,
+    "avg_donors_per_entity": 0.0,
+    "donors_stdev": 0.0,
+    "value_stdev": 0.0,
+    "noofdonors_per_ent_stdev": 0.0,
+    "most_common_entity": ("", 0.0),
+    "most_valuable_entity": ("", 0.0),
+    "least_common_entity": ("", 0.0),
+    "least_valuable_entity": ("", 0.0),
+    "most_common_donor": ("", 0.0),
+    "most_valuable_donor": ("", 0.0),
+}
+
+# Columns of the cleaned data the summary statistics read
+SUMMARY_STATISTICS_COLUMNS = ["ReceivedDate", "Value", "EventCount",
+                              "DonorId", "DonorName", "PartyId", "PartyName"]
+
 
 def count_unique_records(df, column, filters=None):
     """Counts unique donors based on a specific DonationType."""
@@ -145,7 +176,7 @@ def display_thresholds_table():
     )
 
     st.write("### Threshold Logic Table")
-    st.table(thresholds_df)
+    display_table(thresholds_df)
 
 
 def get_returned_donations_ct(df, filters=None):
@@ -163,14 +194,32 @@ def get_returned_donations_value(df, filters=None):
 
 def get_datamindate():
     """Earliest date from full data"""
-    df = st.session_state.get("data_clean", None)
+    if analytics_store_available():
+        result = query(f"SELECT MIN(ReceivedDate) FROM {VIEW_NAME}"
+                       " WHERE ReceivedDate <> ?",
+                       [pd.to_datetime(PLACEHOLDER_DATE)])
+        return pd.to_datetime(result.iloc[0, 0])
+    if out_of_core_enabled():
+        # earliest date of each partition, then of those
+        placeholder = pd.to_datetime(PLACEHOLDER_DATE)
+        dates = [df.loc[df["ReceivedDate"] != placeholder, "ReceivedDate"].min()
+                 for df in fact_partitions(["ReceivedDate"])]
+        return pd.Series(dates, dtype="datetime64[ns]").min()
+    df = get_session_frame("data_clean", columns=["ReceivedDate"])
     df = df[df["ReceivedDate"] != pd.to_datetime(PLACEHOLDER_DATE)]
     return df["ReceivedDate"].min()
 
 
 def get_datamaxdate():
     """Most recent date from full data"""
-    df = st.session_state.get("data_clean", None)
+    if analytics_store_available():
+        result = query(f"SELECT MAX(ReceivedDate) FROM {VIEW_NAME}")
+        return pd.to_datetime(result.iloc[0, 0])
+    if out_of_core_enabled():
+        dates = [df["ReceivedDate"].max()
+                 for df in fact_partitions(["ReceivedDate"])]
+        return pd.Series(dates, dtype="datetime64[ns]").max()
+    df = get_session_frame("data_clean", columns=["ReceivedDate"])
     return df["ReceivedDate"].max()
 
 
@@ -183,7 +232,7 @@ def get_donationtype_ct(df, filters=None):
 def get_donationtype_value(df, filters=None):
     """Calculates the total value of all returned donations."""
     df = apply_filters(df, filters)
-    return df.groupby("DonationType")["Value"].sum()
+    return df.groupby("DonationType", observed=True)["Value"].sum()
 
 
 def get_donation_isanaggregate_ct(df, filters=None):
@@ -221,7 +270,7 @@ def get_top_or_bottom_entity_by_column(df,
         tuple: (EntityName, Value)
     """
     df = apply_filters(df, filters)
-    grouped = df.groupby(column)[value_column].sum()
+    grouped = df.groupby(column, observed=True)[value_column].sum()
     if top:
         entity = grouped.idxmax()
         value = grouped.max()
@@ -299,49 +348,13 @@ def compute_summary_statistics(df, filters):
         df = apply_filters(df, filters)
     except Exception as e:
         logger.error(f"Error applying filters: {e}")
-        return {
-            "unique_reg_entities": 0,
-            "unique_donors": 0,
-            "unique_donations": 0,
-            "total_value": 0.0,
-            "mean_value": 0.0,
-            "avg_donations_per_entity": 0.0,
-            "avg_value_per_entity": 0.0,
-            "avg_donors_per_entity": 0.0,
-            "donors_stdev": 0.0,
-            "value_stdev": 0.0,
-            "noofdonors_per_ent_stdev": 0.0,
-            "most_common_entity": ("", 0.0),
-            "most_valuable_entity": ("", 0.0),
-            "least_common_entity": ("", 0.0),
-            "least_valuable_entity": ("", 0.0),
-            "most_common_donor": ("", 0.0),
-            "most_valuable_donor": ("", 0.0)
-            }
+        return dict(EMPTY_SUMMARY_STATISTICS)
 
     if not isinstance(df, pd.DataFrame):
         raise ValueError("Filtered result is not a DataFrame")
 
     if df is None or df.empty:
-        return {
-            "unique_reg_entities": 0,
-            "unique_donors": 0,
-            "unique_donations": 0,
-            "total_value": 0.0,
-            "mean_value": 0.0,
-            "avg_donations_per_entity": 0.0,
-            "avg_value_per_entity": 0.0,
-            "avg_donors_per_entity": 0.0,
-            "donors_stdev": 0.0,
-            "value_stdev": 0.0,
-            "noofdonors_per_ent_stdev": 0.0,
-            "most_common_entity": ("", 0.0),
-            "most_valuable_entity": ("", 0.0),
-            "least_common_entity": ("", 0.0),
-            "least_valuable_entity": ("", 0.0),
-            "most_common_donor": ("", 0.0),
-            "most_valuable_donor": ("", 0.0),
-        }
+        return dict(EMPTY_SUMMARY_STATISTICS)
 
     regentity_ct = get_regentity_ct(df, filters)
     donors_ct = get_donors_ct(df, filters)
@@ -405,102 +418,139 @@ def compute_summary_statistics(df, filters):
     }
 
 
-def determine_groups_optimized(df, entity, measure, thresholds_dict, exception_dict=None, groupby_column=None):
-    """
-    Optimized version of group determination.
-
-    Parameters:
-        df (pd.DataFrame): DataFrame containing entity and measure columns.
-        entity (str): Column name representing the entity.
-        measure (str): Column name representing the numeric measure.
-        thresholds_dict (dict): Dictionary mapping (low, high)
-        tuples to group labels.
-        exception_dict(dict): Dictionary mapping entity values to exception groups.
-        groupby_column (str): Optional column to group by (e.g., 'parliamentary_sitting')
-                             to calculate thresholds per group instead of lifetime totals.
-    Returns:
-        pd.Series: A Series containing assigned groups for each row.
-    """
-    # Step 1: Compute total measure per entity (and optionally per groupby_column)
-    if groupby_column and groupby_column in df.columns:
-        entity_totals = df.groupby([entity, groupby_column], as_index=False)[measure].sum()
-        merge_columns = [entity, groupby_column]
-    else:
-        entity_totals = df.groupby(entity, as_index=False)[measure].sum()
-        merge_columns = [entity]
-    
-    entity_totals.rename(columns={measure: "total_measure"}, inplace=True)
-
-    # Step 2: Assign groups based on thresholds or (exceptions)
-    # if exception_dict is provided, use assign_group_with_exceptions
-    # other wise use assign_group
-    if exception_dict:
-        #logger to show exception dict being used
-        logger.debug(f"Group assignment with exceptions: {exception_dict}")
-        entity_totals["group"] = entity_totals.apply(
-            lambda row: assign_group_with_exceptions(
-                row,
-                thresholds_dict,
-                row[entity],
-                exception_dict
-            ), axis=1
-        )
-    else:
-        entity_totals["group"] = entity_totals.apply(
-                                    lambda row: assign_group(row["total_measure"],
-                                                            thresholds_dict,
-                                                            row[entity]), axis=1
-            )
-
-    # Step 3: Merge back into the original DataFrame
-    merge_cols = merge_columns + ["group"]
-    df = df.merge(entity_totals[merge_cols], on=merge_columns, how="left")
-    logger.debug(f"Group assignment: {df['group'].value_counts()}")
-    logger.debug(f"Group assignment: {entity_totals['group'].value_counts()}")
-
-    # Step 4: Validate row count consistency
-    if len(df) != len(df):
-        st.error(f"Length mismatch: original {len(df)}, merged {len(df)}")
-        logger.error(f"Length mismatch: original {len(df)}, merged {len(df)}")
-        df.drop_duplicates(inplace=True)
-
-        if len(df) != len(df):
-            st.error(f"Mismatch after deduplication: original {len(df)},"
-                     f" merged {len(df)}")
-            logger.critical(f"Mismatch after deduplication: original"
-                            f" {len(df)}, merged {len(df)}")
-            return None
-
-    # Step 5: Return the group column
-    return df["group"]
-
-
-def assign_group(total, thresholds_dict, entity_value):
+def query_summary_statistics(filters=None, logical_operator="or",
+                             date_range=None):
     """
-    Assigns a group based on thresholds.
-    If above the max threshold, returns the entity name.
+    compute_summary_statistics for the rows of the analytics store
+    selected by filters and date_range (see analytics_store.where_clause).
+    The aggregation runs in the store, only the per entity totals are
+    returned to pandas.
     """
-    for (low, high), group_name in thresholds_dict.items():
-        if low <= total <= high:
-            return group_name
-    return entity_value  # Assign entity name if above max threshold
-
-def assign_group_with_exceptions(row,
-                                 thresholds_dict,
-                                 entity_value,
-                                 exception_dict):
+    where, params = where_clause(filters, logical_operator, date_range)
+    totals = query(
+        "SELECT COUNT(*) AS row_ct,"
+        " COUNT(DISTINCT PartyName) AS regentity_ct,"
+        " COUNT(DISTINCT DonorId) AS donors_ct,"
+        " SUM(EventCount) AS donations_ct,"
+        " SUM(Value) AS value_total, AVG(Value) AS value_mean"
+        f" FROM {VIEW_NAME} {where}", params).iloc[0]
+    if not totals["row_ct"]:
+        return dict(EMPTY_SUMMARY_STATISTICS)
+
+    # per entity measures, as the groupby("PartyId") functions above
+    party_where = (f"{where} AND PartyId IS NOT NULL" if where
+                   else "WHERE PartyId IS NOT NULL")
+    per_party = query(
+        "SELECT PartyId, COUNT(*) AS donations, AVG(Value) AS mean_value,"
+        " COUNT(DISTINCT DonorId) AS donors"
+        f" FROM {VIEW_NAME} {party_where} GROUP BY PartyId", params)
+
+    def top_or_bottom(column):
+        # totals per name, chosen as get_top_or_bottom_entity_by_column
+        grouped = query(
+            f"SELECT {column}, SUM(EventCount) AS EventCount,"
+            f" SUM(Value) AS Value FROM {VIEW_NAME} {where}"
+            f" GROUP BY {column} HAVING {column} IS NOT NULL"
+            f" ORDER BY {column}", params).set_index(column).fillna(0)
+        return {(value_column, top): (
+                    (grouped[value_column].idxmax(), grouped[value_column].max())
+                    if top else
+                    (grouped[value_column].idxmin(), grouped[value_column].min()))
+                for value_column in ["EventCount", "Value"]
+                for top in [True, False]}
+
+    entity = top_or_bottom("PartyName")
+    donor = top_or_bottom("DonorName")
+    return {
+        "unique_reg_entities": totals["regentity_ct"],
+        "unique_donors": totals["donors_ct"],
+        "unique_donations": totals["donations_ct"] or 0,
+        "total_value": totals["value_total"] or 0.0,
+        "mean_value": totals["value_mean"],
+        "avg_donations_per_entity": per_party["donations"].mean(),
+        "avg_value_per_entity": per_party["mean_value"].mean(),
+        "avg_donors_per_entity": per_party["donors"].mean(),
+        "donors_stdev": per_party["donations"].std(),
+        "value_stdev": per_party["mean_value"].std(),
+        "noofdonors_per_ent_stdev": per_party["donors"].std(),
+        "most_common_entity": entity[("EventCount", True)],
+        "most_valuable_entity": entity[("Value", True)],
+        "least_common_entity": entity[("EventCount", False)],
+        "least_valuable_entity": entity[("Value", False)],
+        "most_common_donor": donor[("EventCount", True)],
+        "most_valuable_donor": donor[("Value", True)],
+    }
+
+
+def partitioned_summary_statistics(filters=None, logical_operator="or",
+                                   date_range=None):
     """
-    Assigns a group based on thresholds and exceptions.
-    If entity_value is a key in exception_dict, return the entity name
-    instead of a threshold category (party exception).
+    compute_summary_statistics for the rows of the cleaned data selected
+    by filters and date_range, a (start, end) tuple, computed one
+    partition at a time (out-of-core mode, see data.out_of_core). Each
+    partition contributes partial counts, sums and distinct values, which
+    are combined into the figures for the whole selection.
     """
-    # Check if this entity is in the exception dict (exact match)
-    if exception_dict and entity_value in exception_dict:
-        return entity_value
-
-    # Otherwise, use threshold-based grouping
-    return assign_group(row["total_measure"], thresholds_dict, entity_value)
+    columns = list(SUMMARY_STATISTICS_COLUMNS)
+    columns += [column for column in (filters or {}) if column not in columns]
+    row_ct = 0
+    partials = {"names": [], "donors": [], "totals": [], "party": [],
+                "party_donors": [], "PartyName": [], "DonorName": []}
+    for partition_df in fact_partitions(columns):
+        partition_df = apply_filters(partition_df, filters, logical_operator)
+        if date_range is not None:
+            partition_df = filter_by_date(partition_df, *date_range)
+        if partition_df.empty:
+            continue
+        row_ct += len(partition_df)
+        partials["names"].append(partition_df["PartyName"].dropna().unique())
+        partials["donors"].append(partition_df["DonorId"].dropna().unique())
+        partials["totals"].append(partition_df[["EventCount", "Value"]].agg(
+            ["sum", "count"]))
+        partials["party"].append(partition_df.groupby("PartyId")["Value"].agg(
+            ["size", "sum", "count"]))
+        partials["party_donors"].append(
+            partition_df[["PartyId", "DonorId"]].drop_duplicates())
+        for column in ["PartyName", "DonorName"]:
+            partials[column].append(partition_df.groupby(
+                column, observed=True)[["EventCount", "Value"]].sum())
+    if not row_ct:
+        return dict(EMPTY_SUMMARY_STATISTICS)
+
+    totals = sum(partials["totals"])
+    per_party = pd.concat(partials["party"]).groupby(level=0).sum()
+    party_donors = pd.concat(partials["party_donors"], ignore_index=True)
+    party_donors = party_donors.groupby("PartyId")["DonorId"].nunique()
+    party_mean = per_party["sum"] / per_party["count"]
+
+    def top_or_bottom(column, value_column, top):
+        # totals per name, chosen as get_top_or_bottom_entity_by_column
+        grouped = pd.concat(partials[column]).groupby(
+            level=0, observed=True)[value_column].sum()
+        if top:
+            return grouped.idxmax(), grouped.max()
+        return grouped.idxmin(), grouped.min()
 
+    return {
+        "unique_reg_entities": len(pd.unique(np.concatenate(
+            partials["names"]))),
+        "unique_donors": len(pd.unique(np.concatenate(partials["donors"]))),
+        "unique_donations": totals.loc["sum", "EventCount"],
+        "total_value": totals.loc["sum", "Value"],
+        "mean_value": totals.loc["sum", "Value"] / totals.loc["count", "Value"],
+        "avg_donations_per_entity": per_party["size"].mean(),
+        "avg_value_per_entity": party_mean.mean(),
+        "avg_donors_per_entity": party_donors.mean(),
+        "donors_stdev": per_party["size"].std(),
+        "value_stdev": party_mean.std(),
+        "noofdonors_per_ent_stdev": party_donors.std(),
+        "most_common_entity": top_or_bottom("PartyName", "EventCount", True),
+        "most_valuable_entity": top_or_bottom("PartyName", "Value", True),
+        "least_common_entity": top_or_bottom("PartyName", "EventCount", False),
+        "least_valuable_entity": top_or_bottom("PartyName", "Value", False),
+        "most_common_donor": top_or_bottom("DonorName", "EventCount", True),
+        "most_valuable_donor": top_or_bottom("DonorName", "Value", True),
+    }
 
 
 def calculate_agg_by_variable(
@@ -530,16 +580,16 @@ def calculate_agg_by_variable(
     # Calculate aggregate measures by allocated entity
     if agg_type == "mean":
         agg_df = datafile.groupby(groupby_variable,
-                                  as_index=False)[agg_variable].mean()
+                                  as_index=False, observed=True)[agg_variable].mean()
     elif agg_type == "sum":
         agg_df = datafile.groupby(groupby_variable,
-                                  as_index=False)[agg_variable].sum()
+                                  as_index=False, observed=True)[agg_variable].sum()
     elif agg_type == "count":
         agg_df = datafile.groupby(groupby_variable,
-                                  as_index=False)[agg_variable].count()
+                                  as_index=False, observed=True)[agg_variable].count()
     elif agg_type == "nunique":
         agg_df = datafile.groupby(groupby_variable,
-                                  as_index=False)[agg_variable].nunique()
+                                  as_index=False, observed=True)[agg_variable].nunique()
     else:
         raise ValueError(f"Unsupported aggregation type: {agg_type}")
 
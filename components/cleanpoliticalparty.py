@@ -1,9 +1,9 @@
 import pandas as pd
 import re
 import pdpy
-import streamlit as st
 from utils.logger import logger
 from utils.logger import log_function_call  # Import decorator
+from utils.pipeline_state import pipeline_state
 
 
 @log_function_call
@@ -11,14 +11,14 @@ def load_mppartymemb_pypd():
     """Load MP party memberships data into session state."""
     try:
         # Load MP party memberships data
-        mppartymemb_df = pd.read_csv(st.session_state.mppartymemb_fname)
+        mppartymemb_df = pd.read_csv(pipeline_state().mppartymemb_fname)
         logger.debug(f"Loaded MP Party Memberships data: {mppartymemb_df}")
         # Store MP party memberships data in session state
-        st.session_state.mppartymemb_pypd = mppartymemb_df
+        pipeline_state().mppartymemb_pypd = mppartymemb_df
         logger.info("MP Party Memberships Data Loaded Successfully.")
     except Exception as e:
         logger.error(f"Failed to load MP Party Memberships data: {e}")
-        st.session_state.mppartymemb_pypd = pd.DataFrame()
+        pipeline_state().mppartymemb_pypd = pd.DataFrame()
 
 
 # Function to extract status and clean names
@@ -114,7 +114,7 @@ def get_party_df_from_pdpy(
                                  "family_name",
                                  "party_name"]].head())
     # Save final dataset
-    mppartymemb_df.to_csv(st.session_state.mppartymemb_fname, index=False)
+    mppartymemb_df.to_csv(pipeline_state().mppartymemb_fname, index=False)
     return mppartymemb_df
 
 
@@ -147,7 +147,7 @@ def clean_political_party_data():
     # Load MP party memberships data
     load_mppartymemb_pypd()
     # Load original file
-    df = pd.read_csv(st.session_state.original_data_fname)
+    df = pd.read_csv(pipeline_state().original_data_fname)
     # Clean names and extract status
     df[["CleanedName", "Status"]] = df["RegulatedEntityName"].apply(
         lambda x: pd.Series(extract_status_and_clean_name(x))
@@ -184,7 +184,7 @@ def clean_political_party_data():
     logger.debug("count of records by party"
                  f" {df['PoliticalParty_pdpy'].value_counts()} ")
     # Save final dataset
-    final_file_path = st.session_state.mp_party_memberships_file_path
+    final_file_path = pipeline_state().mp_party_memberships_file_path
     df.to_csv(final_file_path, index=False)
     # feedback
     logger.info("Political Party Data Cleaned Successfully.")
@@ -1,28 +1,99 @@
 """
 File to store all the mappings for the project
 1. Mappings for the data cleansing
+
+Derived columns are computed from declarative rules
+(config.DERIVED_COLUMN_RULES): each rule's conditions are evaluated as a
+mask over every row at once, and the rules are combined with np.select
+(for a "select" column) or by adding their points (for a "score" column).
 """
 
+import string
+import numpy as np
 import pandas as pd
 from utils.logger import logger
-from utils.logger import log_function_call  # Import decorator
-
-
-def map_nature_of_donation(row):
-    if pd.notna(row["NatureOfDonation"]):
-        return row["NatureOfDonation"]
-    if str(row["IsBequest"]).lower() == "true":
-        return "IsABequest"
-    if str(row["IsAggregation"]).lower() == "true":
-        return "IsAggregatedDonation"
-    if str(row["IsSponsorship"]).lower() == "true":
-        return "IsSponsorship"
-    if pd.notna(row["RegulatedDoneeType"]) and row["RegulatedDoneeType"] != "":
-        return f"Donation to {row['RegulatedDoneeType']}"
-    if pd.notna(row["RegulatedEntityType"]) and row["RegulatedEntityType"] != "":
-        return f"Donation to {row['RegulatedEntityType']}"
-    if pd.notna(row["DonationAction"]):
-        return row["DonationAction"]
-    if pd.notna(row["DonationType"]):
-        return row["DonationType"]
-    return "Other"
+
+
+def condition_mask(df, condition, filters):
+    """
+    Rows of df passing a (column, test, argument) condition, as a boolean
+    array. filters, the filter definitions (config.FILTER_DEF), holds the
+    lists the "in_filter" test reads.
+    """
+    column, test, argument = (tuple(condition) + (None,))[:3]
+    values = df[column]
+    if test == "notna":
+        mask = values.notna()
+    elif test == "present":
+        mask = values.notna() & values.ne("")
+    elif test == "true":
+        mask = values.astype(str).str.lower().eq("true")
+    elif test == "eq":
+        mask = values.eq(argument)
+    elif test == "isin":
+        mask = values.isin(argument)
+    elif test == "in_filter":
+        mask = values.isin(filters[argument][column])
+    else:
+        logger.error(f"Unknown rule test {test} on {column}")
+        raise ValueError(f"Unknown rule test {test} on {column}")
+    return np.asarray(mask.to_numpy(dtype=bool, na_value=False))
+
+
+def rule_mask(df, rule, filters):
+    """
+    Rows of df a rule holds for: all of its "when" conditions and at least
+    one of its "any" conditions
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for condition in rule.get("when", []):
+        mask &= condition_mask(df, condition, filters)
+    if rule.get("any"):
+        any_mask = np.zeros(len(df), dtype=bool)
+        for condition in rule["any"]:
+            any_mask |= condition_mask(df, condition, filters)
+        mask &= any_mask
+    return mask
+
+
+def rule_value(df, value):
+    """
+    The value a rule gives the rows of df: the value itself, or for text
+    with {column} placeholders the text filled from each row
+    """
+    if not isinstance(value, str) or "{" not in value:
+        return value
+    parts = list(string.Formatter().parse(value))
+    if len(parts) == 1 and not parts[0][0] and parts[0][1]:
+        return df[parts[0][1]].to_numpy(dtype=object)
+    filled = pd.Series("", index=df.index, dtype=object)
+    for literal, column, _, _ in parts:
+        filled = filled + literal
+        if column:
+            filled = filled + df[column].astype(object).astype(str)
+    return filled.to_numpy(dtype=object)
+
+
+def derive_column(df, rules, filters):
+    """
+    A derived column of df from its rules (config.DERIVED_COLUMN_RULES),
+    as a Series aligned with df's index
+    """
+    if "select" in rules:
+        values = np.select(
+            [rule_mask(df, rule, filters) for rule in rules["select"]],
+            [rule_value(df, rule["value"]) for rule in rules["select"]],
+            default=rules.get("default"))
+        derived = pd.Series(values, index=df.index)
+        if rules.get("remap"):
+            derived = derived.replace(rules["remap"])
+        return derived
+    if "base" in rules:
+        values = df[rules["base"]].to_numpy(dtype="int64", copy=True)
+    else:
+        values = np.zeros(len(df), dtype="int64")
+    for rule in rules["score"]:
+        values += rule_mask(df, rule, filters) * rule.get("points", 1)
+    if "min" in rules:
+        values = np.maximum(values, rules["min"])
+    return pd.Series(values, index=df.index)
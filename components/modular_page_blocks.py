@@ -3,6 +3,8 @@ import datetime as dt
 from components.filters import filter_by_date, apply_filters
 from components.calculations import (
     compute_summary_statistics,
+    query_summary_statistics,
+    partitioned_summary_statistics,
     get_mindate,
     get_maxdate,
     calculate_percentage,
@@ -17,12 +19,52 @@ from components.text_management import (
     manage_text_elements
     )
 from utils.logger import log_function_call, logger
+from data.shared_dataset import get_session_frame
+from data.analytics_store import analytics_store_available
+from data.out_of_core import out_of_core_enabled
+
+# Columns of the cleaned data each block reads. A page loads only the
+# columns of the blocks it shows plus those its filter refers to.
+SUMMARY_COLUMNS = ["ReceivedDate", "Value", "EventCount", "DonorId",
+                   "DonorName", "PartyId", "PartyName"]
+VISUALIZATION_COLUMNS = ["parliamentary_sitting", "Value", "EventCount",
+                         "Party_Group"]
+
+# Friendly titles of the group entities and their name and id columns
+GROUP_ENTITY_OPTIONS = {
+    "Donor": ("DonorName", "DonorId"),
+    "Donor Classification": ("DonorStatus", "DonorStatusInt"),
+    "Regulated Entity": ("RegulatedEntityName", "RegulatedEntityId"),
+    "Recipients Classification": ("RegulatedDoneeType", None),
+    "Nature of Donation": ("NatureOfDonation", "NatureOfDonationInt"),
+    "Reporting Period": ("ReportingPeriodName", None),
+    "Party Affiliation": ("PartyName", None),
+    "Regulated Entity Group": ("Party_Group", None),
+    "Parliament Election Year": ("parliamentary_sitting", None),
+}
+GROUP_ENTITY_COLUMNS = [column for columns in GROUP_ENTITY_OPTIONS.values()
+                        for column in columns if column is not None]
+
+
+def page_columns(columns, filter_key=None):
+    """
+    Columns of the cleaned data a page needs: those it declares plus the
+    columns its filter definition refers to. None loads every column.
+    """
+    if columns is None:
+        return None
+    current_target = st.session_state["filter_def"].get(filter_key) or {}
+    return list(dict.fromkeys([*columns, *current_target]))
 
 
 @log_function_call
-def load_and_filter_data(filter_key, pagereflabel):
-    """Loads and filters dataset based on filter_key from session state."""
-    cleaned_df = st.session_state.data_clean
+def load_and_filter_data(filter_key, pagereflabel, columns=None):
+    """
+    Loads and filters dataset based on filter_key from session state,
+    holding only the given columns (and those the filter needs) if any.
+    """
+    cleaned_df = get_session_frame("data_clean",
+                                   page_columns(columns, filter_key))
     if cleaned_df is None:
         st.error("No data found. Please upload a dataset.")
         return None, None
@@ -71,7 +113,15 @@ def display_summary_statistics(filtered_df, overall_df, target_label,
     min_date_df = get_mindate(filtered_df).date()
     max_date_df = get_maxdate(filtered_df).date()
     tstats = compute_summary_statistics(filtered_df, {})
-    ostats = compute_summary_statistics(overall_df, {})
+    # the overall figures cover every row, so can be queried from the
+    # analytics store, or computed partition by partition out of core,
+    # rather than computed from the session's frame
+    if analytics_store_available():
+        ostats = query_summary_statistics()
+    elif out_of_core_enabled():
+        ostats = partitioned_summary_statistics()
+    else:
+        ostats = compute_summary_statistics(overall_df, {})
     perc_target = calculate_percentage(
         tstats["unique_donations"], ostats["unique_donations"]
     )
@@ -220,7 +270,7 @@ def display_textual_insights_custom(pageref_label, target_label):
 
 def load_and_filter_pergroup(group_entity, filter_key, pageref_label,
                              functionname=None, tab_name=None,
-                             widget_key=None):
+                             widget_key=None, columns=None):
     """Loads and filters dataset based on filter_key from session state.
 
     Parameters:
@@ -230,6 +280,8 @@ def load_and_filter_pergroup(group_entity, filter_key, pageref_label,
         functionname (str, optional): Function name for uniqueness.
         tab_name (str, optional): Tab name for distinguishing tabs.
         widget_key (str, optional): Explicit widget key. If None, auto-gen.
+        columns (list, optional): Columns the page needs besides the
+            group entity columns. If None, every column is loaded.
     """
     # Generate unique widget key if not provided
     if widget_key is None:
@@ -241,7 +293,10 @@ def load_and_filter_pergroup(group_entity, filter_key, pageref_label,
         key_parts.append(pageref_label)
         widget_key = "_".join(key_parts)
 
-    cleaned_df = st.session_state["data_clean"]
+    cleaned_df = get_session_frame(
+        "data_clean",
+        page_columns(None if columns is None
+                     else [*columns, *GROUP_ENTITY_COLUMNS], filter_key))
     if cleaned_df is None:
         st.error(f"No data found. Please upload a dataset. {__name__}")
         logger.error(f"No data found. Please upload a dataset. {__name__}")
@@ -267,25 +322,13 @@ def load_and_filter_pergroup(group_entity, filter_key, pageref_label,
     start_date = dt.datetime.combine(start_date, dt.datetime.min.time())
     end_date = dt.datetime.combine(end_date, dt.datetime.max.time())
 
-    # Dictionary to hold friendly titles and relevant numeric reference fields
-    group_entity_options = {
-        "Donor": ("DonorName", "DonorId"),
-        "Donor Classification": ("DonorStatus", "DonorStatusInt"),
-        "Regulated Entity": ("RegulatedEntityName", "RegulatedEntityId"),
-        "Recipients Classification": ("RegulatedDoneeType", None),
-        "Nature of Donation": ("NatureOfDonation", "NatureOfDonationInt"),
-        "Reporting Period": ("ReportingPeriodName", None),
-        "Party Affiliation": ("PartyName", None),
-        "Regulated Entity Group": ("Party_Group", None),
-        "Parliament Election Year": ("parliamentary_sitting", None),
-    }
 
     prev_selected_group = st.session_state.get("selected_group_entity", None)
 
     selected_group_entity = st.selectbox(
         "Select Group Entity",
-        options=list(group_entity_options.keys()),
-        format_func=lambda x: group_entity_options[x][0],
+        options=list(GROUP_ENTITY_OPTIONS.keys()),
+        format_func=lambda x: GROUP_ENTITY_OPTIONS[x][0],
         key=f"{functionname}_{tab_name}_{pageref_label}_group_entity_select"
     )
 
@@ -297,7 +340,7 @@ def load_and_filter_pergroup(group_entity, filter_key, pageref_label,
         st.session_state["selected_entity_name"] = "All"
 
     # Get corresponding column names
-    group_entity_col, group_entity_id_col = group_entity_options[selected_group_entity]
+    group_entity_col, group_entity_id_col = GROUP_ENTITY_OPTIONS[selected_group_entity]
 
     # Apply initial filtering
     date_filter = (cleaned_df["ReceivedDate"] >= start_date) & (cleaned_df["ReceivedDate"] <= end_date)
@@ -0,0 +1,62 @@
+"""
+Render adapter for tables.
+
+Frames are held with Arrow-backed string columns, which Streamlit 1.19
+cannot render (it fails on the Arrow LargeUtf8 type). The frame passed to
+st.dataframe or st.table is converted here, just before it is shown, so
+only the rows and columns displayed are converted and the frames in
+session state keep their Arrow strings.
+"""
+import pandas as pd
+import streamlit as st
+
+
+def _is_arrow_string(dtype):
+    return (isinstance(dtype, pd.StringDtype)
+            or (isinstance(dtype, pd.ArrowDtype)
+                and dtype.kind in ("O", "U")))
+
+
+def _displayable(values):
+    """A column or index with Arrow strings, or categories of them, as object"""
+    if _is_arrow_string(values.dtype):
+        return values.astype("object")
+    if (isinstance(values.dtype, pd.CategoricalDtype)
+            and _is_arrow_string(values.dtype.categories.dtype)):
+        return values.astype(pd.CategoricalDtype(
+            values.dtype.categories.astype("object"), values.dtype.ordered))
+    return values
+
+
+def streamlit_frame(df):
+    """
+    A copy of df Streamlit 1.19 can render: Arrow string columns, and
+    categoricals and an index holding them, converted to object. Other
+    columns are not copied.
+    """
+    if df is None:
+        return df
+    display_df = df.copy(deep=False)
+    for position in range(display_df.shape[1]):
+        column = display_df.iloc[:, position]
+        converted = _displayable(column)
+        if converted is not column:
+            display_df.isetitem(position, converted)
+    display_df.index = _displayable(display_df.index)
+    return display_df
+
+
+def display_dataframe(df, formats=None, **kwargs):
+    """
+    st.dataframe for a frame, converted by streamlit_frame. formats, a
+    dict of column to format string, is applied with Styler.format.
+    """
+    display_df = streamlit_frame(df)
+    if formats:
+        display_df = display_df.style.format(formats)
+    return st.dataframe(display_df, **kwargs)
+
+
+def display_table(df):
+    """st.table for a frame, converted by streamlit_frame"""
+    return st.table(streamlit_frame(df))
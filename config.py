@@ -25,6 +25,9 @@ DIRECTORIES = {  # "directory_name": "directory_path"
     "utils_dir": os.path.join(str(BASE_DIR), "utils"),
     "source_dir": os.path.join(str(BASE_DIR), "source"),
     "tests_dir": os.path.join(str(BASE_DIR), "tests"),
+    "shared_dir": os.path.join(str(BASE_DIR), "output", "shared"),
+    "map_cache_dir": os.path.join(str(BASE_DIR), "output", "map_cache"),
+    "snapshots_dir": os.path.join(str(BASE_DIR), "output", "snapshots"),
 }
 
 DIRECTORIES_original = {  # "directory_name": "directory_path"
@@ -53,15 +56,20 @@ FILENAMES = {  # "directory" : {"file_name": "file_path"}
         "CREDENTIALS_FILE": "admin_credentials.json",
         "TEXT_FILE": "admin_text.json",
         "ELECTION_DATES": "elections.csv",
-        "LAST_MODIFIED_DATES": "last_modified_dates.json",
+        "ARTIFACT_MANIFEST": "artifact_manifest.json",
     },
     "output_dir": {
         "cleaned_data_fname": "cleaned_data.zip",
+        "cleaned_data_rows_fname": "cleaned_data_rows.zip",
         "cleaned_donations_fname": "cleaned_donations.zip",
         "cleaned_donorlist_fname": "cleaned_donorlist.zip",
         "cleaned_regentity_fname": "cleaned_regentity.zip",
         "party_summary_fname": "party_summary.zip",
         "imported_raw_fname": "imported_raw.zip",
+        "dim_donor_fname": "dim_donor.zip",
+        "dim_regentity_fname": "dim_regentity.zip",
+        "dim_party_fname": "dim_party.zip",
+        "analytics_store_fname": "analytics_store.db",
     },
 
     "source_dir": {
@@ -69,6 +77,116 @@ FILENAMES = {  # "directory" : {"file_name": "file_path"}
     },
 }
 
+# Storage format for pipeline artifacts written to output_dir
+# "parquet" keeps column dtypes so artifacts load without re-parsing,
+# "zip" stores a deflated CSV inside a ZIP file
+ARTIFACT_FORMAT = "parquet"
+PARQUET_COMPRESSION = "snappy"
+
+# Compression codec per artifact, overriding the defaults above. Parquet
+# accepts "snappy", "zstd", "lz4", "gzip" or None; ZIP accepts "deflate",
+# "deflate-fast", "bzip2", "lzma" or None and uses deflate-fast for the
+# fast codecs it cannot hold. ZIP artifacts are written in blocks of
+# ARTIFACT_WRITE_BLOCK_ROWS rows.
+ARTIFACT_CODECS = {
+    "imported_raw": "lz4",
+    "cleaned_donations": "zstd",
+    "cleaned_data": "zstd",
+}
+ARTIFACT_WRITE_BLOCK_ROWS = 20000
+
+# Partitioned source store kept by append_and_dedupe_donations.py: the
+# source records split into one CSV-in-ZIP partition per year received,
+# with an ECRef index so an append only rewrites the partitions it
+# changes. The store sits next to the source file (its name plus suffix)
+# and when it exists it is read in place of the source file.
+SOURCE_STORE = {
+    "suffix": "_store",
+    "manifest_file": "store_manifest.json",
+    "index_file": "ecref_index.parquet",
+    "backup_dir": "backups",
+    # rows of the register per backup chunk, see data/source_backup.py
+    "backup_chunk_rows": 1000,
+}
+
+# Streaming ingestion: when True the source file is read, cleaned and
+# written to the cleaned donations artifact in blocks of INGEST_CHUNKSIZE
+# rows, so peak memory during import depends on the block size rather
+# than the size of the source file
+STREAMING_INGEST = False
+INGEST_CHUNKSIZE = 20000
+
+# Out-of-core mode: when enabled the build streams the source file through
+# the raw cleanup and builds the cleaned data and the donor and regulated
+# entity lists one partition of partition_rows rows at a time, so the
+# cleaned donations and the cleaned data are only held whole on disk (see
+# data/out_of_core.py). Partitions a second pass needs are spilled to
+# spill_dir (the system temporary directory if None). The built data is the
+# same in either mode, but for floating point rounding of the list totals.
+# Fuzzy deduplication still loads the raw data whole when a dedupe mapping
+# file is missing, and the analytics store is built from the whole cleaned
+# frame. The data date range and the overall summary
+# statistics are then also computed partition by partition, but the pages
+# still load the whole cleaned frame for their filtered views and charts:
+# this bounds the memory of the build, not of a page session.
+OUT_OF_CORE = {
+    "enabled": False,
+    "partition_rows": 20000,
+    "spill_dir": None,
+}
+
+# Incremental cleaning: when enabled and only the cleaned donations have
+# changed since the cleaned data was built, only the new and changed rows
+# (matched by ECRef) are cleaned and spliced into the previous cleaned
+# data, unless more than max_changed_fraction of the rows changed. The
+# result is the same as cleaning every row. Not used out of core.
+INCREMENTAL_CLEANING = {
+    "enabled": True,
+    "max_changed_fraction": 0.25,
+}
+
+# Shared dataset: when True the loaded frames are published once per host
+# as memory-mapped Arrow files in DIRECTORIES["shared_dir"] and every
+# session holds a handle to the shared read-only frame instead of a copy
+SHARED_DATASET = True
+
+# firstload loads frames whose inputs are ready concurrently on up to
+# FIRSTLOAD_WORKERS threads (1 loads them one after another)
+FIRSTLOAD_WORKERS = 4
+
+# Analytics store: when enabled the cleaned data (fact and dimension
+# tables) is also written to a file-based SQL database in output_dir,
+# indexed on the columns in indexes, and the summary statistics are
+# queried from it instead of computed in pandas. backend is "sqlite" or
+# "duckdb" (needs the duckdb package, falls back to sqlite without it)
+ANALYTICS_STORE = {
+    "enabled": False,
+    "backend": "sqlite",
+    "indexes": ["ReceivedDate", "PartyId", "DonorId",
+                "parliamentary_sitting"],
+}
+
+# Snapshots: every build publishes the page artifacts as an immutable
+# snapshot in DIRECTORIES["snapshots_dir"]; the newest keep snapshots are
+# kept for sessions pinned to them
+SNAPSHOTS = {
+    "keep": 5,
+}
+
+# Build coordination: one session at a time checks and rebuilds the
+# artifacts while holding lock_file in output_dir. Other sessions "wait"
+# for it to finish (up to timeout seconds, None waits indefinitely) or,
+# with "serve_previous", are given the previous artifacts while it runs.
+# With app_builds False the app never builds: the artifacts are built
+# offline by python -m data.build and sessions read the current snapshot
+BUILD_COORDINATION = {
+    "lock_file": ".build.lock",
+    "status_file": "build_status.json",
+    "wait_policy": "wait",
+    "timeout": 1800,
+    "app_builds": True,
+}
+
 
 # Threshold for donations per parliamentary sitting
 # Based on percentile analysis to ensure even distribution of entities
@@ -224,6 +342,74 @@ FILTER_DEF = {  # "filter_name": {"column_name": "value"}
                                               "Sponsorship",]},
 }
 
+# Derived donation columns, computed for all the rows at once from these
+# rules (components/mappings.py). A rule holds for a row when all of its
+# "when" conditions and at least one of its "any" conditions hold. Each
+# condition is a (column, test, argument) tuple, the test one of:
+#   "notna"      the value is not missing
+#   "present"    the value is not missing or blank
+#   "true"       the value reads "true", in any case
+#   "eq"         the value equals the argument
+#   "isin"       the value is in the argument list
+#   "in_filter"  the value is in the column's list in the FILTER_DEF
+#                filter named by the argument
+# A "select" column takes the value of the first rule that holds, or
+# "default"; {column} in a value is filled from the row and "remap"
+# replaces values afterwards. A "score" column adds up the points of the
+# rules that hold, to its "base" column if given, floored at "min".
+DERIVED_COLUMN_RULES = {
+    "NatureOfDonation": {
+        "select": [
+            {"when": [("NatureOfDonation", "notna")],
+             "value": "{NatureOfDonation}"},
+            {"when": [("IsBequest", "true")], "value": "IsABequest"},
+            {"when": [("IsAggregation", "true")],
+             "value": "IsAggregatedDonation"},
+            {"when": [("IsSponsorship", "true")], "value": "IsSponsorship"},
+            {"when": [("RegulatedDoneeType", "present")],
+             "value": "Donation to {RegulatedDoneeType}"},
+            {"when": [("RegulatedEntityType", "present")],
+             "value": "Donation to {RegulatedEntityType}"},
+            {"when": [("DonationAction", "notna")],
+             "value": "{DonationAction}"},
+            {"when": [("DonationType", "notna")], "value": "{DonationType}"},
+        ],
+        "default": "Other",
+        "remap": {"Donation to nan": "Other", "Other Payment": "Other"},
+    },
+    "DubiousDonor": {
+        "score": [
+            {"when": [(column, "in_filter", "DubiousDonorTypes_ftr")],
+             "points": 1}
+            for column in ["DonorId", "DonorName", "DonationType",
+                           "DonorStatus", "NatureOfDonation"]
+        ],
+    },
+    "DubiousData": {
+        "base": "DubiousDonor",
+        "score": [
+            {"when": [(column, "in_filter", "DubiousDonationType_ftr")],
+             "points": 1}
+            for column in ["DonationType", "DonationAction", "IsAggregation",
+                           "NatureOfDonation", "ReceivedDate",
+                           "RegulatedEntityId", "RegulatedEntityName"]
+        ] + [
+            # aggregated donations from safe donors are not dubious
+            {"any": [("IsAggregation", "eq", True),
+                     ("DonationType", "eq", "Aggregated Donation"),
+                     ("NatureOfDonation", "eq", "Aggregated Donation")],
+             "when": [("DonorStatus", "in_filter", "SafeDonors_ftr")],
+             "points": -1},
+        ],
+        "min": 0,
+    },
+    "PublicFundsInt": {
+        "select": [{"when": [("DonationType", "eq", "Public Funds")],
+                    "value": 1}],
+        "default": 0,
+    },
+}
+
 SECURITY = {  # "security_variable": "security_value"
     "is_admin": False,
     "is_authenticated": False,
@@ -232,9 +418,8 @@ SECURITY = {  # "security_variable": "security_value"
 }
 
 # Electoral cycle phase definitions
-# Each entry is a tuple: (min_days_since_last, max_days_since_last,
-#                         min_days_till_next, max_days_till_next)
-# Use None to represent open-ended ranges.
+# Each entry is (min_days_till_next, max_days_till_next): phase, checked in
+# order; donations in none of the ranges are "Unclassified"
 ELECTORAL_CYCLE_RULES = {
     (0, 30): "Final Campaign Period",
     (31, 90): "Campaign Build-Up",
@@ -1,11 +1,26 @@
 """
 Utility script to convert existing CSV files to ZIP format
 Run this once to compress large CSV files and save disk space
+
+The bytes of each CSV (or of the CSV member of an existing ZIP, with
+--recompress) are copied into the new archive in fixed-size blocks, so
+the data is stored exactly as it was and memory use does not depend on
+the file size. Files are compressed in parallel with the chosen codec,
+and each archive is checked against the CRC-32 and size of the source
+bytes before it replaces the original.
+
+Usage:
+    python convert_csv_to_zip.py [file ...] [--codec deflate]
+        [--workers 4] [--recompress] [--keep]
 """
 
+import argparse
 import os
+import time
 import zipfile
-import pandas as pd
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from data.data_file_defs import ZIP_CODECS
 
 # Define files to compress
 FILES_TO_COMPRESS = [
@@ -15,67 +30,165 @@ FILES_TO_COMPRESS = [
     "output/imported_raw.csv",
 ]
 
-def compress_csv_to_zip(csv_filepath):
-    """Compress a CSV file to ZIP format"""
-    if not os.path.exists(csv_filepath):
-        print(f"⚠️  File not found: {csv_filepath}")
-        return False
-    
-    zip_filepath = csv_filepath.replace('.csv', '.zip')
-    csv_filename = os.path.basename(csv_filepath)
-    
-    # Get original file size
-    original_size = os.path.getsize(csv_filepath)
-    
-    # Read and compress
-    print(f"📦 Compressing: {csv_filepath}")
-    df = pd.read_csv(csv_filepath)
-    
-    with zipfile.ZipFile(zip_filepath, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
-        csv_string = df.to_csv(index=False)
-        zip_ref.writestr(csv_filename, csv_string)
-    
-    # Get compressed size
+# Bytes copied at a time
+BLOCK_SIZE = 1024 * 1024
+
+# Codec names accepted by --codec, "stored" for no compression
+CODECS = {**{codec: codec for codec in ZIP_CODECS if codec}, "stored": None}
+
+
+def _open_source(source_filepath):
+    """
+    Binary stream of the CSV bytes and the member name to store them
+    under: the CSV file itself or the CSV member of a ZIP file
+    """
+    if source_filepath.endswith(".zip"):
+        zip_ref = zipfile.ZipFile(source_filepath, "r")
+        csv_names = [name for name in zip_ref.namelist()
+                     if name.lower().endswith(".csv")]
+        if not csv_names:
+            zip_ref.close()
+            raise ValueError(f"No CSV file in {source_filepath}")
+        return zip_ref.open(csv_names[0]), csv_names[0], zip_ref
+    return open(source_filepath, "rb"), os.path.basename(source_filepath), None
+
+
+def _verify_zip(zip_filepath, member_name, crc, size):
+    """
+    Check the archive member holds exactly the source bytes: its recorded
+    CRC-32 and size match those of the source, and reading it back
+    (which makes zipfile check the CRC of the decompressed bytes) gives
+    the same size
+    """
+    with zipfile.ZipFile(zip_filepath, "r") as zip_ref:
+        info = zip_ref.getinfo(member_name)
+        if info.CRC != crc or info.file_size != size:
+            return False
+        read_size = 0
+        with zip_ref.open(info) as member:
+            while block := member.read(BLOCK_SIZE):
+                read_size += len(block)
+    return read_size == size
+
+
+def compress_csv_to_zip(source_filepath, codec="deflate",
+                        block_size=BLOCK_SIZE, keep_source=False):
+    """
+    Compress a CSV file (or recompress the CSV member of a ZIP file) into
+    a ZIP file with the given codec (see ZIP_CODECS), copying the bytes
+    in blocks. The archive is written to a temporary file and only
+    replaces the target once verified. Returns a dict of the file's
+    sizes and timing, None if the source is missing.
+    """
+    if not os.path.exists(source_filepath):
+        print(f"⚠️  File not found: {source_filepath}")
+        return None
+
+    zip_filepath = os.path.splitext(source_filepath)[0] + ".zip"
+    tmp_filepath = f"{zip_filepath}.{os.getpid()}.tmp"
+    compression, compresslevel = ZIP_CODECS[codec]
+    started = time.monotonic()
+
+    print(f"📦 Compressing: {source_filepath} ({codec or 'stored'})")
+    source, member_name, source_zip = _open_source(source_filepath)
+    crc = 0
+    size = 0
+    try:
+        with zipfile.ZipFile(tmp_filepath, "w", compression,
+                             compresslevel=compresslevel) as zip_ref:
+            with zip_ref.open(member_name, "w", force_zip64=True) as target:
+                while block := source.read(block_size):
+                    crc = zlib.crc32(block, crc)
+                    size += len(block)
+                    target.write(block)
+    finally:
+        source.close()
+        if source_zip is not None:
+            source_zip.close()
+
+    if not _verify_zip(tmp_filepath, member_name, crc, size):
+        os.remove(tmp_filepath)
+        raise IOError(f"Checksum mismatch compressing {source_filepath},"
+                      " original kept")
+    os.replace(tmp_filepath, zip_filepath)
+    # Remove original CSV
+    if not keep_source and source_filepath != zip_filepath:
+        os.remove(source_filepath)
+
     compressed_size = os.path.getsize(zip_filepath)
-    savings = (1 - compressed_size / original_size) * 100
-    
-    print(f"✓ Created: {zip_filepath}")
-    print(f"  Original: {original_size / 1024 / 1024:.2f} MB")
-    print(f"  Compressed: {compressed_size / 1024 / 1024:.2f} MB")
+    return {"source": source_filepath,
+            "zip": zip_filepath,
+            "original_size": size,
+            "compressed_size": compressed_size,
+            "crc": crc,
+            "seconds": time.monotonic() - started}
+
+
+def report(result, keep_source=False):
+    """Print the outcome of one file"""
+    savings = (1 - result["compressed_size"] / max(result["original_size"], 1)) * 100
+    rate = result["original_size"] / 1024 / 1024 / max(result["seconds"], 1e-6)
+    print(f"✓ Created: {result['zip']} (CRC-32 {result['crc']:08x} verified)")
+    print(f"  Original: {result['original_size'] / 1024 / 1024:.2f} MB")
+    print(f"  Compressed: {result['compressed_size'] / 1024 / 1024:.2f} MB")
     print(f"  Space saved: {savings:.1f}%")
-    
-    # Remove original CSV
-    os.remove(csv_filepath)
-    print(f"✓ Removed original CSV file\n")
-    
-    return True
+    print(f"  Time: {result['seconds']:.2f}s ({rate:.1f} MB/s)")
+    if not keep_source and result["source"] != result["zip"]:
+        print("✓ Removed original CSV file")
+    print()
+
+
+def source_files(filepaths, recompress=False):
+    """
+    The file to compress for each path: the CSV if it exists, otherwise
+    with recompress the ZIP already holding it
+    """
+    sources = []
+    for filepath in filepaths:
+        zip_filepath = os.path.splitext(filepath)[0] + ".zip"
+        if os.path.exists(filepath):
+            sources.append(filepath)
+        elif recompress and os.path.exists(zip_filepath):
+            sources.append(zip_filepath)
+        else:
+            print(f"⚠️  Skipping (not found): {filepath}\n")
+    return sources
 
-def main():
+
+def main(filepaths=None, codec="deflate", workers=None, recompress=False,
+         keep_source=False):
     """Convert all large CSV files to ZIP"""
     print("="*60)
     print("CSV to ZIP Conversion Utility")
     print("="*60 + "\n")
-    
-    total_original = 0
-    total_compressed = 0
-    files_processed = 0
-    
-    for filepath in FILES_TO_COMPRESS:
-        if os.path.exists(filepath):
-            original_size = os.path.getsize(filepath)
-            if compress_csv_to_zip(filepath):
-                files_processed += 1
-                total_original += original_size
-                zip_path = filepath.replace('.csv', '.zip')
-                total_compressed += os.path.getsize(zip_path)
-        else:
-            print(f"⚠️  Skipping (not found): {filepath}\n")
-    
-    if files_processed > 0:
-        total_savings = (1 - total_compressed / total_original) * 100
+
+    sources = source_files(filepaths or FILES_TO_COMPRESS, recompress)
+    results = []
+    if sources:
+        workers = workers or min(len(sources), os.cpu_count() or 1)
+        # zlib, bz2 and lzma release the GIL while compressing, so the
+        # files are compressed in parallel on threads
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(compress_csv_to_zip, source, codec,
+                                       BLOCK_SIZE, keep_source)
+                       for source in sources]
+            for future in futures:
+                try:
+                    result = future.result()
+                except (IOError, ValueError, zipfile.BadZipFile) as e:
+                    print(f"❌ {e}\n")
+                    continue
+                if result is not None:
+                    report(result, keep_source)
+                    results.append(result)
+
+    if results:
+        total_original = sum(r["original_size"] for r in results)
+        total_compressed = sum(r["compressed_size"] for r in results)
+        total_savings = (1 - total_compressed / max(total_original, 1)) * 100
         print("="*60)
         print("SUMMARY:")
-        print(f"  Files processed: {files_processed}")
+        print(f"  Files processed: {len(results)}")
         print(f"  Total original size: {total_original / 1024 / 1024:.2f} MB")
         print(f"  Total compressed size: {total_compressed / 1024 / 1024:.2f} MB")
         print(f"  Total space saved: {total_savings:.1f}% ({(total_original - total_compressed) / 1024 / 1024:.2f} MB)")
@@ -83,10 +196,25 @@ def main():
         print("\n✓ Conversion complete! Your dashboard will now use ZIP files automatically.")
     else:
         print("No files were processed. Either files don't exist or are already compressed.")
+    return len(results) == len(sources)
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("files", nargs="*", default=FILES_TO_COMPRESS,
+                        help="CSV files to compress")
+    parser.add_argument("--codec", choices=list(CODECS), default="deflate",
+                        help="compression codec of the archives")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="files compressed at the same time")
+    parser.add_argument("--recompress", action="store_true",
+                        help="recompress files already held in a ZIP")
+    parser.add_argument("--keep", action="store_true",
+                        help="keep the original CSV files")
+    args = parser.parse_args()
     try:
-        main()
+        main(args.files, CODECS[args.codec], args.workers, args.recompress,
+             args.keep)
     except Exception as e:
         print(f"\n❌ Error occurred: {e}")
         import traceback
@@ -1,58 +1,129 @@
+"""
+Election calendar: the general elections in reference_files/elections.csv
+and the election context of donation dates
+
+Each parliamentary sitting runs from its general election up to the next
+one. election_context finds the sitting of every date with a single
+searchsorted over the sorted election dates, and derives the days till
+and since an election, the electoral cycle phase and the governing party
+from it.
+"""
 import math
+import os
 import datetime as dt
-import bisect
+import numpy as np
 import streamlit as st
 import pandas as pd
-from components import calculations as calc
-from pdpy.elections import get_general_elections_dict
 from utils.logger import logger
 from utils.logger import log_function_call  # Import decorator
+from utils.pipeline_state import pipeline_state
+
+# Columns of elections.csv held in the election calendar
+CALENDAR_COLUMNS = ["name", "dissolution", "election", "WinningParty"]
+
+# Sitting and phase of a missing date
+UNKNOWN_SITTING = "Unknown"
+
+ONE_DAY = np.timedelta64(1, "D")
 
 
 @log_function_call
 @st.cache_data
-def load_election_dates():
-    """Load general election dates into session state."""
-    logger.info("Loading election dates from pdpy.")
-    ElectionDates_dict = get_general_elections_dict()
-
-    if not ElectionDates_dict:
-        logger.error("Failed to load election dates.")
-        st.session_state.ElectionDatesAscend = []
-        st.session_state.ElectionDatesDescend = []
-        raise ValueError("No valid election dates found.")
-
-    logger.info("Election Dates loaded from pdpy.")
-
-    # Add type field to all records
-    for key, value in ElectionDates_dict.items():
-        ElectionDates_dict[key]['type'] = "General Election"
-    logger.debug(f"ElectionDates_dict from pdpy: {ElectionDates_dict}")
-
-    # Extract only election dates as `date` objects
-    election_dates = [
-        value["election"] for key, value in ElectionDates_dict.items()
-        if isinstance(value, dict) and "election" in value and
-        value.get("type") == "General Election"
-    ]
-
-    # Check there are records in election_dates
-    if election_dates:
-        # Store sorted election dates in session state
-        st.session_state.ElectionDatesAscend = sorted(election_dates)
-        st.session_state.ElectionDatesDescend = sorted(
-            election_dates, reverse=True
-        )
-        logger.info("Election Dates Loaded Successfully.")
-        logger.debug("ElectionDatesAscend:"
-                     f" {st.session_state.ElectionDatesAscend}")
-        logger.debug("ElectionDatesDescend:"
-                     f" {st.session_state.ElectionDatesDescend}")
-    else:
-        logger.error("Failed to load election dates")
-        st.session_state.ElectionDatesAscend = []
-        st.session_state.ElectionDatesDescend = []
-        raise ValueError("No valid election dates found.")
+def load_election_calendar(elections_csv_path):
+    """
+    The general elections in elections_csv_path, sorted by election date,
+    with their sitting name, dissolution date and winning party. Returns
+    None if the file is missing or holds no general elections.
+    """
+    if not elections_csv_path or not os.path.exists(elections_csv_path):
+        logger.warning(f"Elections CSV not found at {elections_csv_path}")
+        return None
+    elections_df = pd.read_csv(elections_csv_path, dtype={"name": str})
+    calendar_df = elections_df.loc[
+        elections_df["type"] == "General Election", CALENDAR_COLUMNS].copy()
+    if calendar_df.empty:
+        logger.error(f"No general elections in {elections_csv_path}")
+        return None
+    for column in ["dissolution", "election"]:
+        calendar_df[column] = pd.to_datetime(calendar_df[column])
+    calendar_df = calendar_df.sort_values("election").reset_index(drop=True)
+    logger.info(f"Loaded {len(calendar_df)} general elections from"
+                f" {elections_csv_path}")
+    return calendar_df
+
+
+def election_calendar():
+    """The election calendar of the session's elections file"""
+    return load_election_calendar(pipeline_state().get("ELECTION_DATES"))
+
+
+def electoral_cycle_phase(days_till, thresholds_dict,
+                          default_label="Unclassified"):
+    """
+    Electoral cycle phase of each number of days till the next election:
+    the label of the first (low, high) range of thresholds_dict holding
+    it, default_label if none does (as entity_groups.assign_group)
+    """
+    days_till = np.asarray(days_till)
+    return np.select(
+        [(days_till >= low) & (days_till <= high)
+         for low, high in thresholds_dict],
+        list(thresholds_dict.values()),
+        default=default_label).astype(object)
+
+
+def election_context(dates, calendar_df=None, thresholds_dict=None,
+                     default_label="Unclassified"):
+    """
+    Election context of each of dates, as a DataFrame aligned with them:
+    parliamentary_sitting ("Pre-<first sitting>" before the first
+    election), DaysTillNextElection, DaysSinceLastElection,
+    ElectoralCyclePhase and GoverningParty. Dates after the last election
+    count their days till it as negative, dates before the first their
+    days since it. Missing dates get an "Unknown" sitting and phase and 0
+    days. Returns None if there is no election calendar.
+    """
+    if calendar_df is None:
+        calendar_df = election_calendar()
+    if calendar_df is None:
+        return None
+    if thresholds_dict is None:
+        thresholds_dict = pipeline_state().electoral_cycle_rules
+    dates = pd.Series(pd.to_datetime(dates))
+    elections = calendar_df["election"].to_numpy(dtype="datetime64[ns]")
+    values = dates.to_numpy(dtype="datetime64[ns]", copy=True)
+    missing = np.isnat(values)
+    values[missing] = elections[0]
+    last = len(elections) - 1
+
+    # Sitting of each date: the last election on or before it
+    sitting_pos = np.searchsorted(elections, values, side="right") - 1
+    last_pos = np.clip(sitting_pos, 0, last)
+    on_election = (sitting_pos >= 0) & (elections[last_pos] == values)
+    next_pos = np.clip(sitting_pos + 1 - on_election, 0, last)
+
+    days_till = (elections[next_pos] - values) // ONE_DAY
+    days_since = (values - elections[last_pos]) // ONE_DAY
+    days_till[missing] = 0
+    days_since[missing] = 0
+
+    names = calendar_df["name"].to_numpy(dtype=object)
+    in_sitting = (sitting_pos >= 0) & ~missing
+    sitting = np.where(in_sitting, names[last_pos], f"Pre-{names[0]}")
+    sitting[missing] = UNKNOWN_SITTING
+    phase = electoral_cycle_phase(days_till, thresholds_dict, default_label)
+    phase[missing] = UNKNOWN_SITTING
+    party = np.where(
+        in_sitting, calendar_df["WinningParty"].to_numpy(dtype=object)[
+            last_pos], None)
+
+    return pd.DataFrame({
+        "parliamentary_sitting": sitting,
+        "DaysTillNextElection": days_till.astype("int64"),
+        "DaysSinceLastElection": days_since.astype("int64"),
+        "ElectoralCyclePhase": phase,
+        "GoverningParty": party,
+    }, index=dates.index)
 
 
 def GenElectionRelation2(R_Date, divisor=1,
@@ -74,13 +145,8 @@ def GenElectionRelation2(R_Date, divisor=1,
         int: Days/weeks difference (rounded up if necessary),
         or None on failure.
     """
-    # Ensure election dates are loaded
-    if ("ElectionDatesAscend" not in st.session_state or
-            "ElectionDatesDescend" not in st.session_state):
-        logger.info("Election Dates not found in session, loading now.")
-        load_election_dates()
-
-    if not st.session_state.ElectionDatesAscend:
+    calendar_df = election_calendar()
+    if calendar_df is None:
         logger.error("Election dates could not be loaded. Returning None.")
         return None
 
@@ -97,52 +163,22 @@ def GenElectionRelation2(R_Date, divisor=1,
 
     try:
         # Convert R_Date to date object (ignore time component)
-        R_Date2 = dt.datetime.strptime(R_Date, date_format).date()
+        R_Date2 = pd.Timestamp(dt.datetime.strptime(R_Date, date_format)
+                               .date())
 
         if direction == "DaysTill":
-            idx = bisect.bisect_left(st.session_state.ElectionDatesAscend,
-                                     R_Date2)
-            if idx < len(st.session_state.ElectionDatesAscend):
-                DaysDiff = (st.session_state.ElectionDatesAscend[idx] -
-                            R_Date2).days
-                return (math.ceil(DaysDiff / divisor) if divisor > 1
-                        else DaysDiff)
-
-        elif direction == "DaysSince":
-            idx = bisect.bisect_right(st.session_state.ElectionDatesDescend,
-                                      R_Date2) - 1
-            if idx < 0:  # Prevent out-of-bounds access
+            if R_Date2 > calendar_df["election"].iloc[-1]:
+                return 0
+            DaysDiff = election_context([R_Date2], calendar_df)[
+                "DaysTillNextElection"].iloc[0]
+        else:
+            if R_Date2 < calendar_df["election"].iloc[0]:
                 return None
-            DaysDiff = (R_Date2 -
-                        st.session_state.ElectionDatesDescend[idx]).days
-            return math.ceil(DaysDiff / divisor) if divisor > 1 else DaysDiff
-
-        return 0
+            DaysDiff = election_context([R_Date2], calendar_df)[
+                "DaysSinceLastElection"].iloc[0]
+        DaysDiff = int(DaysDiff)
+        return math.ceil(DaysDiff / divisor) if divisor > 1 else DaysDiff
 
     except Exception as e:
         logger.error(f"Error processing date: {e}")
         return None
-
-
-def classify_electoral_cycle_from_thresholds(row,
-                                             thresholds_dict,
-                                             default_label="Unclassified"):
-    """
-    Use the existing assign_group threshold logic to classify a donation
-    into an electoral-cycle phase based on DaysTillNextElection.
-    """
-    days_till = row["DaysTillNextElection"]
-
-    # Handle missing / NaT values
-    if pd.isna(days_till):
-        return "Unknown"
-
-    # Reuse existing threshold allocation logic:
-    # days_till acts as the "total",
-    # default_label acts as entity_value fallback.
-    phase = calc.assign_group(
-        total=days_till,
-        thresholds_dict=thresholds_dict,
-        entity_value=default_label,
-    )
-    return phase
@@ -0,0 +1,309 @@
+"""
+Analytics store for the cleaned donations.
+
+When ANALYTICS_STORE["enabled"] is set, the cleaned data is also written
+to a file-based SQL database in output_dir (SQLite, or DuckDB when it is
+installed and chosen): the fact rows in the table cleaned_data, each
+dimension table under its session key and a view, donations, joining the
+names back onto the rows. The columns in ANALYTICS_STORE["indexes"] are
+indexed. The store records the versions of the artifacts it was built
+from and is rebuilt from the session frames when they change, so pages
+can run aggregations and filters as queries (query, where_clause) rather
+than over a copy of the table in every session.
+"""
+import contextlib
+import datetime as dt
+import hashlib
+import json
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+import config
+from data.star_schema import DIMENSIONS, dimension_columns
+from utils.logger import logger
+from utils.pipeline_state import pipeline_state
+
+try:
+    import duckdb
+except ImportError:  # optional, the store uses SQLite without it
+    duckdb = None
+
+FACT_TABLE = "cleaned_data"
+VIEW_NAME = "donations"
+INFO_TABLE = "store_info"
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+
+def analytics_settings():
+    return pipeline_state().get("ANALYTICS_STORE", config.ANALYTICS_STORE)
+
+
+def analytics_store_enabled():
+    """The store is only built and queried when switched on in config"""
+    return bool(analytics_settings().get("enabled", False))
+
+
+def analytics_backend():
+    """Configured backend, SQLite if duckdb is chosen but not installed"""
+    backend = analytics_settings().get("backend", "sqlite")
+    if backend == "duckdb" and duckdb is None:
+        logger.warning("duckdb not installed, analytics store uses sqlite.")
+        return "sqlite"
+    return backend
+
+
+def analytics_store_path():
+    return pipeline_state().get(
+        "analytics_store_fname",
+        os.path.join(config.DIRECTORIES["output_dir"],
+                     config.FILENAMES["output_dir"]["analytics_store_fname"]))
+
+
+def analytics_store_available():
+    """True if the store is enabled and has been built"""
+    return analytics_store_enabled() and os.path.exists(analytics_store_path())
+
+
+def quote(name):
+    """Quote a column or table name, several contain spaces"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+@contextlib.contextmanager
+def connect(path=None, read_only=True):
+    """Connection to the store, closed on leaving the block"""
+    path = path or analytics_store_path()
+    if analytics_backend() == "duckdb":
+        con = duckdb.connect(path, read_only=read_only)
+    elif read_only:
+        con = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    else:
+        con = sqlite3.connect(path)
+    try:
+        yield con
+        if not read_only:
+            con.commit()
+    finally:
+        con.close()
+
+
+def _bind(value):
+    """Parameter value the backend accepts"""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, (pd.Timestamp, dt.datetime)):
+        value = pd.Timestamp(value).to_pydatetime()
+        # SQLite holds the dates as ISO text, compared as strings
+        if analytics_backend() == "sqlite":
+            return str(pd.Timestamp(value))
+    return value
+
+
+def query(sql, params=None):
+    """Run a query against the store and return the result as a frame"""
+    params = [_bind(value) for value in params or []]
+    with connect() as con:
+        if analytics_backend() == "duckdb":
+            return con.execute(sql, params).df()
+        return pd.read_sql_query(sql, con, params=params)
+
+
+def _column_types():
+    """Logical type of each column of the donations view"""
+    from data.schema_registry import get_schema
+    types = {}
+    for artifact in ["cleaned_data",
+                     *(dim["artifact"] for dim in DIMENSIONS.values())]:
+        for name, spec in get_schema(artifact)["columns"].items():
+            types.setdefault(name, spec["type"])
+    return types
+
+
+def _filter_values(column, values):
+    """
+    Filter values that can equal a value of the column: dates for date
+    columns and strings for string columns. Values of another type match
+    no rows in pandas, so are dropped rather than cast by the backend.
+    """
+    logical_type = _column_types().get(column)
+    if logical_type is None:
+        return list(values)
+    kept = []
+    for value in values:
+        if logical_type == "datetime":
+            try:
+                kept.append(pd.Timestamp(value))
+            except (TypeError, ValueError):
+                continue
+        elif (logical_type == "string") == isinstance(value, str):
+            kept.append(value)
+    return kept
+
+
+def where_clause(filters=None, logical_operator="or", date_range=None,
+                 date_column="ReceivedDate"):
+    """
+    WHERE clause and its parameters selecting the rows apply_filters
+    (components.filters) would keep for the same filters, and filter_by_date
+    for date_range, a (start, end) tuple. Returns ("", []) for no filter.
+    """
+    conditions = []
+    params = []
+    for column, value in (filters or {}).items():
+        if value is None or value == []:  # Skip empty filters
+            continue
+        if isinstance(value, (list, tuple, set)):
+            values = [v for v in value if v is not None]
+            has_null = len(values) < len(value)
+            values = _filter_values(column, values)
+            condition = (f"{quote(column)} IN"
+                         f" ({', '.join('?' * len(values))})"
+                         if values else "FALSE")
+            if has_null:
+                condition = f"{condition} OR {quote(column)} IS NULL"
+            params.extend(values)
+        elif not _filter_values(column, [value]):
+            condition = "FALSE"
+        else:
+            condition = f"{quote(column)} = ?"
+            params.extend(_filter_values(column, [value]))
+        conditions.append(f"COALESCE({condition}, FALSE)")
+
+    clauses = []
+    if conditions:
+        if logical_operator == "and":
+            clauses.append(" AND ".join(conditions))
+        elif logical_operator == "or":
+            clauses.append(" OR ".join(conditions))
+        elif logical_operator == "nor":
+            clauses.append(f"NOT ({' OR '.join(conditions)})")
+        elif logical_operator == "except":
+            clauses.append(f"NOT ({' AND '.join(conditions)})")
+        else:
+            raise ValueError("logical_operator must be "
+                             " 'and', 'or', 'nor', or 'except'")
+    if date_range is not None:
+        clauses.append(f"{quote(date_column)} >= ?"
+                       f" AND {quote(date_column)} <= ?")
+        params.extend(date_range)
+    if not clauses:
+        return "", []
+    return "WHERE " + " AND ".join(f"({c})" for c in clauses), params
+
+
+def source_version():
+    """
+    Version of the artifacts the store is built from and of its settings;
+    the store is rebuilt when it changes
+    """
+    from data.artifact_manifest import get_manifest_entry
+    sources = {}
+    for fname in ["cleaned_data_fname",
+                  *(dim["fname"] for dim in DIMENSIONS.values())]:
+        entry = get_manifest_entry(pipeline_state().get(fname)) or {}
+        sources[fname] = entry.get("output_hash")
+    sources["backend"] = analytics_backend()
+    sources["indexes"] = list(analytics_settings().get("indexes", []))
+    return hashlib.sha256(
+        json.dumps(sources, sort_keys=True).encode()).hexdigest()
+
+
+def stored_version(path=None):
+    """Source version recorded in the store, None if it cannot be read"""
+    path = path or analytics_store_path()
+    if not os.path.exists(path):
+        return None
+    # a store written by the other backend is rebuilt
+    with open(path, "rb") as f:
+        file_backend = ("sqlite" if f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+                        else "duckdb")
+    if file_backend != analytics_backend():
+        return None
+    try:
+        with connect(path) as con:
+            row = con.execute(
+                f"SELECT source_version FROM {INFO_TABLE}").fetchone()
+        return row[0] if row else None
+    except Exception as e:
+        logger.warning(f"Could not read analytics store version: {e}")
+        return None
+
+
+def _write_table(con, name, df):
+    if analytics_backend() == "duckdb":
+        con.register("frame", df)
+        con.execute(f"CREATE TABLE {quote(name)} AS SELECT * FROM frame")
+        con.unregister("frame")
+    else:
+        df.to_sql(name, con, index=False, chunksize=20000)
+
+
+def _view_sql():
+    """The fact rows with the dimension columns joined back on"""
+    columns = ["f.*"]
+    joins = []
+    for n, (dim_key, dim) in enumerate(DIMENSIONS.items()):
+        alias = f"d{n}"
+        columns.extend(f"{alias}.{quote(name)}"
+                       for name in dimension_columns(dim_key))
+        joins.append(f"LEFT JOIN {quote(dim_key)} {alias}"
+                     f" ON f.{quote(dim['key'])} = {alias}.{quote(dim['key'])}")
+    return (f"CREATE VIEW {VIEW_NAME} AS SELECT {', '.join(columns)}"
+            f" FROM {FACT_TABLE} f {' '.join(joins)}")
+
+
+def build_analytics_store(fact_df, dimensions, version):
+    """
+    Write the fact and dimension tables to a new store, index it and
+    replace the previous store
+    """
+    path = analytics_store_path()
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    start = dt.datetime.now()
+    with connect(tmp_path, read_only=False) as con:
+        _write_table(con, FACT_TABLE, fact_df)
+        for dim_key, dim_df in dimensions.items():
+            _write_table(con, dim_key, dim_df.reset_index())
+        for column in analytics_settings().get("indexes", []):
+            if column not in fact_df.columns:
+                logger.warning(f"Analytics store: no column {column}"
+                               " to index.")
+                continue
+            con.execute(f"CREATE INDEX {quote('ix_' + column)}"
+                        f" ON {FACT_TABLE} ({quote(column)})")
+        con.execute(_view_sql())
+        con.execute(f"CREATE TABLE {INFO_TABLE} (source_version VARCHAR,"
+                    " built_at VARCHAR)")
+        con.execute(f"INSERT INTO {INFO_TABLE} VALUES (?, ?)",
+                    [version, start.isoformat(timespec="seconds")])
+    os.replace(tmp_path, path)
+    logger.info(f"Analytics store built: {len(fact_df)} rows in"
+                f" {(dt.datetime.now() - start).total_seconds():.1f}s"
+                f" ({analytics_backend()})")
+
+
+def ensure_analytics_store():
+    """
+    Rebuild the store from the session's cleaned data and dimension
+    frames if they have changed since it was built. Returns the rows of
+    the fact table, None if the frames are not loaded.
+    """
+    from data.shared_dataset import _session_frame
+    fact_df = _session_frame("data_clean")
+    if fact_df is None:
+        logger.error("Analytics store not built, cleaned data not loaded.")
+        return None
+    version = source_version()
+    if stored_version() == version:
+        logger.info("Analytics store is up to date")
+        return len(fact_df)
+    dimensions = {key: _session_frame(key) for key in DIMENSIONS}
+    missing = [key for key, dim_df in dimensions.items() if dim_df is None]
+    if missing:
+        logger.error(f"Analytics store not built, {missing} not loaded.")
+        return None
+    build_analytics_store(fact_df, dimensions, version)
+    return len(fact_df)
@@ -0,0 +1,272 @@
+"""
+Artifact manifest used to decide whether a pipeline artifact is stale.
+
+For each artifact written to the output directory the manifest records
+the content hashes of the files it was built from, the version of the
+pipeline code and of the configuration that produced it, its own content
+hash and its row count. An artifact is rebuilt only when one of these
+changes, so a checkout, container rebuild or touch that leaves file
+contents alone does not trigger a rebuild, while an edit to
+config.THRESHOLDS or FILTER_DEF does.
+"""
+import datetime as dt
+import hashlib
+import json
+import os
+import threading
+import config
+from data.data_file_defs import resolve_artifact_path
+from data.source_store import store_input_path
+from utils.logger import logger
+from utils.pipeline_state import pipeline_state
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Frames built concurrently record their artifacts from worker threads
+_manifest_lock = threading.Lock()
+
+# Source files of the pipeline stages, hashed into the code version; only
+# modules that decide the content of an artifact, not the page code
+PIPELINE_MODULES = [
+    "data/datasetupandclean.py",
+    "data/raw_data_clean.py",
+    "data/data_dedupe.py",
+    "data/clean_and_enhance.py",
+    "data/load_donor_regent_lists.py",
+    "data/GenElectionRelationship.py",
+    "data/schema_registry.py",
+    "data/data_file_defs.py",
+    "data/source_store.py",
+    "data/star_schema.py",
+    "data/dedupe_maps.py",
+    "data/entity_groups.py",
+    "data/out_of_core.py",
+    "components/mappings.py",
+]
+
+# Session state settings (with their config defaults) that change the
+# content of the artifacts, hashed into the config version
+PIPELINE_SETTINGS = {
+    "thresholds": config.THRESHOLDS,
+    "filter_def": config.FILTER_DEF,
+    "derived_column_rules": config.DERIVED_COLUMN_RULES,
+    "data_remappings": config.DATA_REMAPPINGS,
+    "electoral_cycle_rules": config.ELECTORAL_CYCLE_RULES,
+    "PLACEHOLDER_DATE": config.PLACEHOLDER_DATE,
+    "PLACEHOLDER_ID": config.PLACEHOLDER_ID,
+}
+
+# Artifacts built without any of the settings above, so a settings change
+# does not rebuild them; all other artifacts depend on every setting
+SETTINGS_INDEPENDENT_ARTIFACTS = ("imported_raw", "cleaned_donations")
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# (path, size, mtime_ns): sha256, so unchanged files are hashed once
+_file_hash_cache = {}
+
+
+def file_hash(filepath):
+    """Return the sha256 of a file's content, or None if it does not exist"""
+    if not filepath or not os.path.exists(filepath):
+        return None
+    stat = os.stat(filepath)
+    cache_key = (os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns)
+    if cache_key not in _file_hash_cache:
+        digest = hashlib.sha256()
+        with open(filepath, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+        _file_hash_cache[cache_key] = digest.hexdigest()
+    return _file_hash_cache[cache_key]
+
+
+def code_version():
+    """Hash of the pipeline source files"""
+    digest = hashlib.sha256()
+    for module in PIPELINE_MODULES:
+        digest.update(module.encode())
+        digest.update((file_hash(os.path.join(REPO_DIR, module))
+                       or "").encode())
+    return digest.hexdigest()[:16]
+
+
+def _canonical(value):
+    """
+    JSON-serialisable form of a setting; dicts such as THRESHOLDS have
+    tuple keys, so they become sorted lists of [key, value] pairs
+    """
+    if isinstance(value, dict):
+        return sorted([str(k), _canonical(v)] for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def config_version(key=None):
+    """Hash of the settings that change the content of an artifact"""
+    if key in SETTINGS_INDEPENDENT_ARTIFACTS:
+        return None
+    settings = {name: _canonical(pipeline_state().get(name, default))
+                for name, default in PIPELINE_SETTINGS.items()}
+    encoded = json.dumps(settings, sort_keys=True)
+    return hashlib.sha256(encoded.encode()).hexdigest()[:16]
+
+
+def manifest_path():
+    return pipeline_state().get(
+        "ARTIFACT_MANIFEST",
+        os.path.join(config.DIRECTORIES["reference_dir"],
+                     config.FILENAMES["reference_dir"]["ARTIFACT_MANIFEST"]))
+
+
+def load_manifest():
+    """Load the artifact manifest, empty if it does not exist yet"""
+    try:
+        with open(manifest_path(), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(manifest):
+    """Write the manifest to a temporary file and rename it into place"""
+    filepath = manifest_path()
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    tmp_filepath = f"{filepath}.{os.getpid()}.tmp"
+    with open(tmp_filepath, "w") as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+    os.replace(tmp_filepath, filepath)
+
+
+def artifact_key(filepath):
+    """Manifest key of an artifact: its file name without extension"""
+    return os.path.splitext(os.path.basename(os.fspath(filepath).strip()))[0]
+
+
+def _input_file(filepath):
+    """File hashed for an input: the stored artifact or the store manifest"""
+    filepath = store_input_path(filepath)
+    return resolve_artifact_path(filepath) or filepath
+
+
+def _input_key(filepath):
+    """
+    Manifest key of an input file: its path relative to the repository,
+    so inputs with the same file name in different directories are kept
+    apart
+    """
+    filepath = os.path.abspath(filepath)
+    try:
+        filepath = os.path.relpath(filepath, REPO_DIR)
+    except ValueError:
+        # on another drive than the repository
+        pass
+    return filepath.replace(os.sep, "/")
+
+
+def _input_hashes(inputs):
+    hashes = {}
+    for filepath in inputs:
+        if not filepath:
+            continue
+        resolved = _input_file(filepath)
+        hashes[_input_key(resolved)] = file_hash(resolved)
+    return hashes
+
+
+def get_manifest_entry(filepath):
+    return load_manifest().get(artifact_key(filepath))
+
+
+def is_artifact_stale(filepath, inputs):
+    """
+    Return True if the artifact at filepath has to be rebuilt from inputs:
+    it is missing, has no manifest entry, or its inputs, own content, code
+    version or config version differ from those recorded when it was built.
+    """
+    key = artifact_key(filepath)
+    storedfilepath = resolve_artifact_path(filepath)
+    entry = load_manifest().get(key)
+    if storedfilepath is None:
+        reason = "artifact missing"
+    elif entry is None:
+        reason = "no manifest entry"
+    elif entry.get("output_hash") != file_hash(storedfilepath):
+        reason = "artifact content changed"
+    elif entry.get("inputs") != _input_hashes(inputs):
+        reason = "inputs changed"
+    elif entry.get("code_version") != code_version():
+        reason = "pipeline code changed"
+    elif entry.get("config_version") != config_version(key):
+        reason = "configuration changed"
+    else:
+        logger.info(f"Artifact {key} is up to date")
+        return False
+    logger.info(f"Artifact {key} is stale: {reason}")
+    return True
+
+
+def changed_inputs(filepath, inputs):
+    """
+    The inputs whose content has changed since the artifact at filepath
+    was built from them. None if it has to be rebuilt for another reason:
+    it is missing or has no manifest entry, its own content, code version
+    or config version changed, or it was built from other inputs.
+    """
+    key = artifact_key(filepath)
+    storedfilepath = resolve_artifact_path(filepath)
+    entry = load_manifest().get(key)
+    if (storedfilepath is None or entry is None
+            or entry.get("output_hash") != file_hash(storedfilepath)
+            or entry.get("code_version") != code_version()
+            or entry.get("config_version") != config_version(key)):
+        return None
+    inputs = [filepath for filepath in inputs if filepath]
+    recorded = entry.get("inputs", {})
+    names = {_input_key(_input_file(filepath)): filepath
+             for filepath in inputs}
+    if set(names) != set(recorded):
+        return None
+    current = _input_hashes(inputs)
+    return [filepath for name, filepath in names.items()
+            if recorded[name] != current[name]]
+
+
+def record_artifact(filepath, inputs, rows):
+    """Record a freshly built artifact and the inputs it was built from"""
+    storedfilepath = resolve_artifact_path(filepath)
+    if storedfilepath is None:
+        logger.error(f"Cannot record {filepath}, artifact not found.")
+        return None
+    entry = {
+        "path": os.path.basename(storedfilepath),
+        "output_hash": file_hash(storedfilepath),
+        "inputs": _input_hashes(inputs),
+        "code_version": code_version(),
+        "config_version": config_version(artifact_key(filepath)),
+        "rows": int(rows),
+        "built_at": dt.datetime.now().isoformat(timespec="seconds"),
+    }
+    with _manifest_lock:
+        manifest = load_manifest()
+        manifest[artifact_key(filepath)] = entry
+        save_manifest(manifest)
+    logger.info(f"Manifest updated for {artifact_key(filepath)}:"
+                f" {entry['rows']} rows")
+    return entry
+
+
+def forget_artifact(filepath):
+    """
+    Remove an artifact's manifest entry, so it is stale and rebuilt, e.g.
+    when its stored file cannot be read back
+    """
+    with _manifest_lock:
+        manifest = load_manifest()
+        if manifest.pop(artifact_key(filepath), None) is None:
+            return
+        save_manifest(manifest)
+    logger.info(f"Manifest entry removed for {artifact_key(filepath)}")
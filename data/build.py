@@ -0,0 +1,161 @@
+"""
+Headless build of the data artifacts
+
+Runs the whole pipeline outside Streamlit, so the artifacts are built
+offline rather than on a user's first page load:
+
+    python -m data.build
+    python -m data.build --streaming --out-of-core --partition-rows 50000
+
+The pipeline functions read their file paths and settings from
+utils.pipeline_state.pipeline_state(), the browser session's
+st.session_state in the app. Here the pipeline runs, for the length of
+the build, in a plain HeadlessSessionState holding the explicit build
+config: the values utils.global_variables.initialize_session_state takes
+from config.py, with the overrides given. st.session_state itself is
+left as it is. The build publishes a snapshot and exits with
+status 0, or 1 if no current snapshot could be published. With
+BUILD_COORDINATION["app_builds"] set to False in config.py the app
+then only reads the snapshots built here.
+"""
+import argparse
+import contextlib
+import sys
+import time
+import config
+from utils.logger import logger
+from utils.pipeline_state import pipeline_state, use_pipeline_state
+
+
+class HeadlessSessionState(dict):
+    """Session state outside Streamlit, read by key or as attributes"""
+
+    def __getattr__(self, key):
+        try:
+            return self[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+    def __setattr__(self, key, value):
+        self[key] = value
+
+    def __delattr__(self, key):
+        try:
+            del self[key]
+        except KeyError:
+            raise AttributeError(key) from None
+
+
+def build_config(streaming=None, out_of_core=None, partition_rows=None,
+                 analytics_store=None, source=None):
+    """
+    Build config for run_build: the session state values to use in place
+    of those initialize_session_state takes from config.py. Settings left
+    as None keep their config.py values.
+    """
+    overrides = {}
+    if streaming is not None:
+        overrides["STREAMING_INGEST"] = streaming
+    if out_of_core is not None or partition_rows is not None:
+        overrides["OUT_OF_CORE"] = dict(config.OUT_OF_CORE)
+        if out_of_core is not None:
+            overrides["OUT_OF_CORE"]["enabled"] = out_of_core
+        if partition_rows is not None:
+            overrides["OUT_OF_CORE"]["partition_rows"] = partition_rows
+    if analytics_store is not None:
+        overrides["ANALYTICS_STORE"] = dict(config.ANALYTICS_STORE,
+                                            enabled=analytics_store)
+    if source is not None:
+        overrides["source_data_fname"] = source
+    return overrides
+
+
+# Session state values passed to worker processes; frames and shared
+# frame handles stay in the session that holds them
+SETTING_TYPES = (str, int, float, bool, dict, list, tuple, type(None))
+
+
+def session_settings():
+    """
+    The settings the pipeline runs with, for a worker process to run
+    pipeline functions in a headless_session holding them
+    """
+    return {key: value for key, value in pipeline_state().items()
+            if isinstance(value, SETTING_TYPES)}
+
+
+@contextlib.contextmanager
+def headless_session(overrides):
+    """
+    Run the pipeline in the current context with a HeadlessSessionState
+    holding the overrides and the config.py values for everything else
+    """
+    from utils.global_variables import initialize_session_state
+    with use_pipeline_state(HeadlessSessionState(overrides)) as state:
+        # init_state_var keeps the values already set
+        initialize_session_state()
+        yield state
+
+
+def run_build(overrides):
+    """
+    Build every artifact out of date for the build config and publish
+    the current snapshot. Returns its version, None if the build failed.
+    """
+    started = time.monotonic()
+    with headless_session(overrides) as state:
+        from data.data_loader import PAGE_FRAMES, build_artifacts
+        from data.snapshots import load_snapshot_manifest
+        version = build_artifacts()
+        report = state.get("build_report")
+        if version is None:
+            logger.error("Headless build failed, no snapshot published.")
+            return None
+        frames = load_snapshot_manifest(version)["frames"]
+    if report is not None:
+        for key, stage in report["stages"].items():
+            seconds = ("" if stage["seconds"] is None
+                       else f" {stage['seconds']:8.2f}s")
+            print(f"  {key:<16} {stage['status']:<8}{seconds}")
+        print(f"Stages took {report['elapsed']:.1f}s, critical path"
+              f" {report['critical_path']:.1f}s, sum of stages"
+              f" {report['stage_total']:.1f}s")
+    print(f"Snapshot {version} up to date"
+          f" ({time.monotonic() - started:.1f}s)")
+    for key in PAGE_FRAMES:
+        print(f"  {key:<16} {frames[key]['rows']:>9,} rows")
+    return version
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m data.build",
+        description=__doc__.split("\n")[1])
+    parser.add_argument("--streaming", action="store_true", default=None,
+                        help="stream the source file through the raw"
+                             " cleanup in blocks")
+    parser.add_argument("--out-of-core", action="store_true", default=None,
+                        help="build the cleaned data partition by"
+                             " partition")
+    parser.add_argument("--partition-rows", type=int,
+                        help="rows per out-of-core partition")
+    parser.add_argument("--analytics-store", action="store_true",
+                        default=None,
+                        help="also build the analytics store")
+    parser.add_argument("--source",
+                        help="source donations file to build from")
+    args = parser.parse_args(argv)
+    try:
+        version = run_build(build_config(
+            streaming=args.streaming, out_of_core=args.out_of_core,
+            partition_rows=args.partition_rows,
+            analytics_store=args.analytics_store, source=args.source))
+    except Exception as e:
+        logger.critical(f"Headless build crashed: {e}", exc_info=True)
+        print(f"Build failed: {e}")
+        return 1
+    return 0 if version is not None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""
+Single-flight coordination of the data build across sessions and processes.
+
+The build (staleness checks plus any rebuild of the pipeline artifacts)
+runs while holding an exclusive lock on a file in the output directory,
+and a status file records that a build is in progress, by which process
+and since when. The first session to take the lock builds; other sessions
+either wait for the lock, after which the manifest shows the artifacts are
+fresh and they are loaded without rebuilding, or are served the previous
+version of the artifacts while the build runs
+(config.BUILD_COORDINATION["wait_policy"]).
+The lock is released by the operating system if the building process dies.
+"""
+import datetime as dt
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+import config
+from utils.logger import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+LOCK_POLL_SECONDS = 0.5
+
+# build_lock default: the timeout set in config.BUILD_COORDINATION
+CONFIG_TIMEOUT = object()
+
+
+class BuildLockTimeout(Exception):
+    """Raised when the build lock is not acquired within the timeout"""
+
+
+def _output_path(filename):
+    return os.path.join(config.DIRECTORIES["output_dir"], filename)
+
+
+def lock_path():
+    return _output_path(config.BUILD_COORDINATION["lock_file"])
+
+
+def status_path():
+    return _output_path(config.BUILD_COORDINATION["status_file"])
+
+
+def _try_lock(lock_file):
+    """Take the exclusive lock without blocking, True if acquired"""
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def read_build_status():
+    """Return the last recorded build status, empty if none"""
+    try:
+        with open(status_path(), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write_build_status(state, **details):
+    status = {"state": state,
+              "host": socket.gethostname(),
+              "pid": os.getpid(),
+              "updated_at": dt.datetime.now().isoformat(timespec="seconds"),
+              **details}
+    os.makedirs(os.path.dirname(status_path()), exist_ok=True)
+    tmp_filepath = f"{status_path()}.{os.getpid()}.tmp"
+    with open(tmp_filepath, "w") as f:
+        json.dump(status, f, indent=4)
+    os.replace(tmp_filepath, status_path())
+
+
+def build_in_progress():
+    """
+    True if another session or process holds the build lock. The status
+    file alone is not trusted, as a crashed build leaves it saying
+    "building".
+    """
+    os.makedirs(os.path.dirname(lock_path()), exist_ok=True)
+    with open(lock_path(), "a+") as lock_file:
+        if _try_lock(lock_file):
+            _unlock(lock_file)
+            return False
+    return True
+
+
+@contextmanager
+def build_lock(timeout=CONFIG_TIMEOUT):
+    """
+    Hold the exclusive build lock for the duration of the block, waiting
+    up to timeout seconds (config.BUILD_COORDINATION["timeout"] by
+    default, None waits indefinitely) for a build by another session or
+    process to finish. Raises BuildLockTimeout if the wait runs out.
+    """
+    if timeout is CONFIG_TIMEOUT:
+        timeout = config.BUILD_COORDINATION["timeout"]
+    os.makedirs(os.path.dirname(lock_path()), exist_ok=True)
+    lock_file = open(lock_path(), "a+")
+    started = time.monotonic()
+    waited = False
+    try:
+        while not _try_lock(lock_file):
+            if not waited:
+                status = read_build_status()
+                logger.info("Build in progress by"
+                            f" {status.get('host')}:{status.get('pid')}"
+                            f" since {status.get('started_at')}, waiting.")
+                waited = True
+            if timeout is not None and time.monotonic() - started > timeout:
+                raise BuildLockTimeout(
+                    f"Build lock not acquired within {timeout} seconds")
+            time.sleep(LOCK_POLL_SECONDS)
+        if waited:
+            logger.info("Build lock acquired after waiting"
+                        f" {time.monotonic() - started:.1f}s")
+        build_started = dt.datetime.now().isoformat(timespec="seconds")
+        _write_build_status("building", started_at=build_started,
+                            thread=threading.current_thread().name)
+        try:
+            yield
+        except Exception as e:
+            _write_build_status("failed", started_at=build_started,
+                                error=str(e))
+            raise
+        else:
+            _write_build_status("idle", started_at=build_started)
+        finally:
+            _unlock(lock_file)
+    finally:
+        lock_file.close()
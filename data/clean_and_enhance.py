@@ -3,16 +3,84 @@ import pandas as pd
 import numpy as np
 import streamlit as st
 from data.data_utils import try_to_use_preprocessed_data
-from data.data_file_defs import normalize_string_columns_for_streamlit
+from data.shared_dataset import get_session_frame, session_frame_rows
+from data.schema_registry import coerce_to_schema
+from data.dedupe_maps import apply_entity_map, load_compiled_map
+from data.star_schema import (DIMENSIONS, build_dimensions,
+                              combine_dimension_rows,
+                              distinct_dimension_rows, join_dimensions,
+                              key_fact_rows,
+                              split_star_schema, save_dimensions,
+                              dimension_artifacts_exist)
+from data.out_of_core import (column_categories, column_values,
+                              combine_column_values, iter_partitions,
+                              load_spilled_partition, out_of_core_enabled,
+                              spill_directory, spill_partition)
 # from data.politicalperson import map_mp_to_party
 from components import mappings as mp
-from components import calculations as calc
+from data import entity_groups as eg
 from utils.logger import logger, log_function_call
+from utils.pipeline_state import pipeline_state
 from data.GenElectionRelationship import (
-    load_election_dates,
-    classify_electoral_cycle_from_thresholds,
+    UNKNOWN_SITTING,
+    election_context,
     )
 
+# Group column: entity whose donations per parliamentary sitting decide it
+ENTITY_GROUPS = {
+    "RegEntity_Group": "RegulatedEntityName",
+    "Party_Group": "PartyName",
+}
+
+# Columns dropped once the groups are assigned
+UNUSED_COLUMNS = [
+    "IsIrishSource",
+    "AccountingUnitsAsCentralParty",
+    "AccountingUnitName",
+    "AcceptedDate",
+    "ReportedDate",
+    "IsReportedPrePoll",
+    "AccountingUnitId",
+    "Postcode",
+    "CompanyRegistrationNumber",
+    "CampaigningName",
+]
+
+# Integer encoding column: column it encodes
+CODED_COLUMNS = {
+    "DonationTypeInt": "DonationType",
+    "RegulatedEntityNameInt": "RegulatedEntityName",
+    "DonorNameInt": "DonorName",
+    "DonationActionInt": "DonationAction",
+    "DonorStatusInt": "DonorStatus",
+    # "CampaigningNameInt": "CampaigningName",
+    "PurposeOfVisitInt": "PurposeOfVisit",
+    # "AccountingUnitNameInt": "AccountingUnitName",
+    # "ReportingPeriodNameInt": "ReportingPeriodName",
+    "RegulatedDoneeTypeInt": "RegulatedDoneeType",
+    # "IsIrishSourceInt": "IsIrishSource",
+    "IsBequestInt": "IsBequest",
+    "IsAggregationInt": "IsAggregation",
+    "IsSponsorshipInt": "IsSponsorship",
+    "NatureOfDonationInt": "NatureOfDonation",
+    "RegisterNameInt": "RegisterName",
+    "PartyNameInt": "PartyName",
+    "PartyGroupInt": "Party_Group",
+    "RegEntityGrou[Int": "RegEntity_Group",
+}
+
+# Original and cleaned id and name columns dropped from the cleaned data
+SOURCE_ENTITY_COLUMNS = [
+    "CleanedRegulatedEntityId",
+    "CleanedRegulatedEntityName",
+    "CleanedDonorId",
+    "CleanedDonorName",
+    "OriginalRegulatedEntityId",
+    "OriginalRegulatedEntityName",
+    "OriginalDonorId",
+    "OriginalDonorName",
+]
+
 
 @log_function_call
 def load_cleaned_data(
@@ -24,43 +92,60 @@ def load_cleaned_data(
         main_file="raw_data",
         cleaned_file="data_clean"):
 
+    # Out of core the cleaned donations are read from their artifact a
+    # partition at a time, rather than from the frame in session state
+    out_of_core = out_of_core_enabled()
     if (
-        st.session_state.get(originaldatafilepath) is None
-        or st.session_state.get(processeddatafilepath) is None
-        or st.session_state.get(main_file) is None
+        pipeline_state().get(originaldatafilepath) is None
+        or pipeline_state().get(processeddatafilepath) is None
+        or (pipeline_state().get(main_file) is None and not out_of_core)
     ):
         logger.error(f"Session state variables not initialized! {__name__}")
         st.error(f"Session state variables not initialized! {__name__}")
         return None
-    logger.debug(f"Rows in Raw Data: {len(st.session_state.get(main_file))}")
 
-    originaldatafilepath = st.session_state.get(originaldatafilepath)
-    processeddatafilepath = st.session_state.get(processeddatafilepath)
+    originaldatafilepath = pipeline_state().get(originaldatafilepath)
+    processeddatafilepath = pipeline_state().get(processeddatafilepath)
+    if out_of_core:
+        # the build (data_loader.prepare_cleaned_artifacts) only calls
+        # this when the cleaned data is out of date, and is given the row
+        # count rather than the frame
+        logger.info(f"Cleaning data out of core... {__name__}")
+        return load_cleaned_data_partitioned(originaldatafilepath,
+                                             processeddatafilepath,
+                                             output_csv)
+    source_rows = session_frame_rows(main_file)
+    logger.debug(f"Rows in Raw Data: {source_rows}")
 
     # Use function to check if file has been updated and if not,
     # load preprocessed data
     loaddata_df = try_to_use_preprocessed_data(
         originalfilepath=originaldatafilepath,
         savedfilepath=processeddatafilepath,
-        timestamp_key="cleaned_data_last_modified")
+        artifact="cleaned_data",
+        extra_inputs=[pipeline_state().get("regentity_map_fname"),
+                      pipeline_state().get("ELECTION_DATES")])
+    if loaddata_df is not None and not dimension_artifacts_exist():
+        logger.warning("Dimension tables missing, rebuilding cleaned data.")
+        loaddata_df = None
     if loaddata_df is None:
         logger.error(f"Failed to load data from {originaldatafilepath}")
     # Check if cached data loaded successfully and return it
     if loaddata_df is not None:
         # check that number of rows in the loaded data is the same as the
         # number of rows in the original data
-        if len(loaddata_df) == len(st.session_state.get(main_file)):
+        if len(loaddata_df) == source_rows:
             return loaddata_df
         else:
             logger.error(
                 f"Number of rows in loaded data ({len(loaddata_df)}) "
                 f"does not match the number of rows in the original data "
-                f"({len(st.session_state.get(main_file))})! {__name__}"
+                f"({source_rows})! {__name__}"
             )
             st.error(
                 f"Number of rows in loaded data ({len(loaddata_df)}) "
                 f"does not match the number of rows in the original data "
-                f"({len(st.session_state.get(main_file))})! {__name__}"
+                f"({source_rows})! {__name__}"
             )
             logger.error(f"Reprocessing data... {__name__}")
             st.error(f"Reprocessing data... {__name__}")
@@ -68,7 +153,7 @@ def load_cleaned_data(
     logger.info(f"Loading and cleaning data... {__name__}")
     if streamlitrun:
         # Load the data
-        orig_df = st.session_state.get(datafile)
+        orig_df = get_session_frame(datafile)
         if orig_df is None:
             st.error(f"No data found in session state! {__name__}")
             logger.error(f"No data found in session state! {__name__}")
@@ -79,8 +164,280 @@ def load_cleaned_data(
         else:
             orig_df = datafile
     logger.debug(f"Clean Data Prep 79: streamlitdata load: {len(orig_df)}")
+    # When only the cleaned donations have changed, clean just the new and
+    # changed rows and splice them into the previous cleaned data
+    loadclean_df = load_cleaned_data_incremental(
+        orig_df, originaldatafilepath, processeddatafilepath, output_csv)
+    if loadclean_df is not None:
+        return loadclean_df
     # create a copy of the original data
-    loadclean_df = orig_df.copy()
+    loadclean_df = clean_donation_rows(orig_df.copy())
+    # Apply dictionary to populate RegEntity_Group and Party_Group
+    loadclean_df = add_entity_groups(
+        loadclean_df, assign_entity_groups(entity_group_totals(loadclean_df)))
+    logger.debug(f"Clean Data Prep 335: Party_Group: {len(loadclean_df)}")
+    # Ensure all columns that are in data are also in data_clean
+    for col in orig_df.columns:
+        if col not in loadclean_df.columns:
+            loadclean_df[col] = orig_df[col]
+
+    loadclean_df = encode_cleaned_rows(
+        loadclean_df,
+        {code_column: column_categories(column_values(loadclean_df[column]))
+         for code_column, column in CODED_COLUMNS.items()})
+    loadclean_df = add_election_measures(loadclean_df)
+    if loadclean_df is None:
+        return None
+
+    logger.debug(f"Clean Data Prep 353: Election dates: {len(loadclean_df)}")
+    # compare count of rows in original data with cleaned data
+    if len(orig_df) != len(loadclean_df):
+        logger.error(
+            f"Number of rows in cleaned data ({len(loadclean_df)}) "
+            f"does not match the number of rows in the original data "
+            f"({len(orig_df)})! {__name__}"
+        )
+        # Dedupe the data
+        loadclean_df = loadclean_df.drop_duplicates()
+        logger.info(
+            f"Deduplication completed, shape: {loadclean_df.shape} {__name__}"
+        )
+        # compare count of rows in original data with cleaned data
+        if len(orig_df) != len(loadclean_df):
+            logger.error(
+                "Post deduplication: "
+                f"Number of rows in cleaned data ({len(loadclean_df)}) "
+                f"does not match the number of rows in the original data "
+                f"({len(orig_df)})! {__name__}"
+            )
+            st.error(
+                "Post deduplication: "
+                f"Number of rows in cleaned data ({len(loadclean_df)}) "
+                f"does not match the number of rows in the original data "
+                f"({len(orig_df)})! {__name__}, deduplication failed"
+            )
+            return ValueError("Deduplication failed")
+    logger.debug(f"Clean Data Prep 386: End of clean: {len(loadclean_df)}")
+    loadclean_df = finish_cleaned_rows(loadclean_df)
+    loadclean_df = save_cleaned_data(loadclean_df, row_hashes(orig_df),
+                                     originaldatafilepath,
+                                     processeddatafilepath, output_csv)
+    logger.info(f"Cleaned Data completed, shape: {loadclean_df.shape}")
+    # return the cleaned data
+    return loadclean_df
+
+
+def save_cleaned_data(loadclean_df, rows_df, originaldatafilepath,
+                      processeddatafilepath, output_csv):
+    """
+    Split the cleaned rows into the fact and dimension tables and, if
+    output_csv, save them with the row hashes (row_hashes) of the cleaned
+    donations they were built from. Returns the fact rows in the compact
+    dtypes they are loaded with.
+    """
+    # Keep the names once in the dimension tables, keyed from the rows
+    loadclean_df, dimensions = split_star_schema(loadclean_df)
+    # Save cleaned data
+    if output_csv:
+        # Save the cleaned data to a CSV file for further analysis or reporting
+        from data.data_file_defs import save_dataframe_artifact
+        cleaned_inputs = cleaned_data_inputs(originaldatafilepath)
+        # dimensions first, the fact table's manifest entry marks the
+        # star schema complete
+        save_dimensions(dimensions, cleaned_inputs)
+        save_dataframe_artifact(loadclean_df, processeddatafilepath, index=True,
+                                artifact="cleaned_data",
+                                inputs=cleaned_inputs)
+        save_row_hashes(rows_df, processeddatafilepath)
+    # Hold the frame in the compact dtypes it is loaded with
+    return coerce_to_schema(loadclean_df, "cleaned_data")
+
+
+def cleaned_data_inputs(originaldatafilepath):
+    """Files the cleaned data and its dimension tables are built from"""
+    return [originaldatafilepath,
+            pipeline_state().get("regentity_map_fname"),
+            pipeline_state().get("ELECTION_DATES")]
+
+
+def row_hashes(orig_df):
+    """
+    The ECRef and a hash of each cleaned donation row. Rows are hashed in
+    the dtypes the cleaned donations are stored in, so a row hashes the
+    same whether it was just cleaned or read back from its artifact.
+    """
+    from data.data_file_defs import blank_strings_to_missing
+    typed_df = blank_strings_to_missing(
+        coerce_to_schema(orig_df.copy(deep=False), "cleaned_donations"),
+        "cleaned_donations")
+    hashes = pd.util.hash_pandas_object(typed_df, index=False)
+    return pd.DataFrame({"ECRef": orig_df["ECRef"].to_numpy(),
+                         "RowHash": hashes.to_numpy().view("int64")})
+
+
+def save_row_hashes(rows_df, processeddatafilepath):
+    """Save the row hashes of the cleaned data at processeddatafilepath"""
+    from data.data_file_defs import save_dataframe_artifact
+    save_dataframe_artifact(rows_df,
+                            pipeline_state().get("cleaned_data_rows_fname"),
+                            index=False, artifact="cleaned_data_rows",
+                            inputs=[processeddatafilepath])
+
+
+def previous_row_hashes(originaldatafilepath, processeddatafilepath):
+    """
+    The row hashes the cleaned data was built from, if it can be updated
+    incrementally: only the cleaned donations have changed since it was
+    built and its row hashes and dimension tables are current. None
+    otherwise.
+    """
+    from data.artifact_manifest import changed_inputs, is_artifact_stale
+    from data.data_file_defs import read_artifact
+    rows_fname = pipeline_state().get("cleaned_data_rows_fname")
+    changed = changed_inputs(processeddatafilepath,
+                             cleaned_data_inputs(originaldatafilepath))
+    if changed != [originaldatafilepath]:
+        logger.info("Incremental cleaning not possible: the cleaned data"
+                    " is current or other inputs have changed.")
+        return None
+    if (not dimension_artifacts_exist()
+            or is_artifact_stale(rows_fname, [processeddatafilepath])):
+        logger.info("Incremental cleaning not possible: no current row"
+                    " hashes or dimension tables.")
+        return None
+    return read_artifact("cleaned_data_rows", rows_fname)
+
+
+@log_function_call
+def load_cleaned_data_incremental(orig_df, originaldatafilepath,
+                                  processeddatafilepath, output_csv=False):
+    """
+    Incremental version of the cleaning in load_cleaned_data, when only the
+    cleaned donations have changed since the cleaned data was built.
+
+    Rows are matched to the previous cleaned data by ECRef and compared by
+    row hash. Only the new and changed rows are cleaned (the row-local
+    steps: dates, nature of donation, party, dubious scores, sitting and
+    election measures). The groups are reassigned only for the entity and
+    parliamentary sitting pairs these rows, and the rows removed or
+    replaced, belong to. The codes and dimension keys, which depend on the
+    values of all the rows, are recomputed (vectorised) over all of them.
+    The result is the same as cleaning every row.
+
+    Returns None, for the caller to clean every row, if incremental
+    cleaning is disabled, the previous cleaned data cannot be used, or
+    no rows or more than max_changed_fraction of them changed.
+    """
+    from data.data_file_defs import read_artifact
+    settings = pipeline_state().get("INCREMENTAL_CLEANING") or {}
+    if not settings.get("enabled"):
+        return None
+    previous_rows = previous_row_hashes(originaldatafilepath,
+                                        processeddatafilepath)
+    if previous_rows is None:
+        return None
+    if not (orig_df["ECRef"].is_unique and previous_rows["ECRef"].is_unique):
+        logger.info("Incremental cleaning not possible: ECRef does not"
+                    " identify the rows.")
+        return None
+    rows_df = row_hashes(orig_df)
+    positions = pd.Index(previous_rows["ECRef"]).get_indexer(orig_df["ECRef"])
+    changed = ((positions < 0)
+               | (previous_rows["RowHash"].to_numpy()[positions]
+                  != rows_df["RowHash"].to_numpy()))
+    kept_positions = positions[~changed]
+    removed = np.ones(len(previous_rows), dtype=bool)
+    removed[kept_positions] = False
+    logger.info(f"Incremental cleaning: {changed.sum()} new or changed rows,"
+                f" {removed.sum()} rows removed or replaced")
+    if (not changed.any() or changed.sum()
+            > settings.get("max_changed_fraction", 1) * len(orig_df)):
+        return None
+
+    # The previous rows, with their dimension columns joined back on
+    previous_df = read_artifact("cleaned_data", processeddatafilepath)
+    if previous_df is None or len(previous_df) != len(previous_rows):
+        logger.warning("Incremental cleaning: previous cleaned data does not"
+                       " match its row hashes.")
+        return None
+    previous_df = join_dimensions(
+        previous_df,
+        {dim_key: read_artifact(dim["artifact"],
+                                pipeline_state().get(dim["fname"]))
+         for dim_key, dim in DIMENSIONS.items()})
+    kept_df = previous_df.iloc[kept_positions].copy()
+    delta_df = clean_donation_rows(orig_df[changed].copy())
+
+    # Groups of the entity and sitting pairs touched by the delta
+    def group_rows(df):
+        pairs_df = df[[entity for entity in ENTITY_GROUPS.values()
+                       if entity in df.columns]
+                      + ["parliamentary_sitting", "EventCount"]].copy()
+        # sittings are stored as numbers, cleaned rows hold their names
+        pairs_df["parliamentary_sitting"] = (
+            pairs_df["parliamentary_sitting"].astype(str))
+        return pairs_df
+
+    kept_pairs = group_rows(kept_df)
+    delta_pairs = group_rows(delta_df)
+    touched_pairs = pd.concat([delta_pairs,
+                               group_rows(previous_df[removed])])
+    touched_kept = {}
+    touched_totals = {}
+    for group_column, entity in ENTITY_GROUPS.items():
+        if entity not in delta_pairs.columns:
+            continue
+        pair_columns = [entity, "parliamentary_sitting"]
+        touched = pd.MultiIndex.from_frame(
+            touched_pairs[pair_columns].dropna().drop_duplicates())
+        touched_kept[group_column] = pd.MultiIndex.from_frame(
+            kept_pairs[pair_columns]).isin(touched)
+        touched_totals[group_column] = eg.entity_measure_totals(
+            pd.concat([kept_pairs[touched_kept[group_column]],
+                       delta_pairs]),
+            entity, "EventCount", groupby_column="parliamentary_sitting")
+    entity_groups = assign_entity_groups(touched_totals)
+    for group_column, groups in entity_groups.items():
+        kept_groups = kept_df[group_column].astype("object")
+        kept_groups[touched_kept[group_column]] = eg.merge_entity_groups(
+            kept_pairs[touched_kept[group_column]], groups).to_numpy()
+        kept_df[group_column] = kept_groups
+        delta_df[group_column] = eg.merge_entity_groups(delta_pairs,
+                                                          groups).to_numpy()
+
+    # Codes against the categories of the columns over all the rows; the
+    # previous rows' categoricals keep the categories of removed rows
+    categories = {
+        code_column: column_categories(combine_column_values(
+            [kept_df[column].dropna().unique(),
+             column_values(delta_df[column])]))
+        for code_column, column in CODED_COLUMNS.items()}
+    kept_df = add_column_codes(kept_df, categories)
+    delta_df = encode_cleaned_rows(delta_df, categories)
+    delta_df = add_election_measures(delta_df)
+    if delta_df is None:
+        return None
+    delta_df = coerce_to_schema(finish_cleaned_rows(delta_df), "cleaned_data")
+
+    # Splice the rows back into the order of the cleaned donations
+    loadclean_df = pd.concat([kept_df[delta_df.columns], delta_df])
+    order = np.concatenate([np.flatnonzero(~changed), np.flatnonzero(changed)])
+    loadclean_df = loadclean_df.iloc[np.argsort(order, kind="stable")]
+    loadclean_df.index = orig_df.index
+    loadclean_df = save_cleaned_data(loadclean_df, rows_df,
+                                     originaldatafilepath,
+                                     processeddatafilepath, output_csv)
+    logger.info(f"Cleaned Data completed incrementally, shape:"
+                f" {loadclean_df.shape}")
+    return loadclean_df
+
+
+def clean_donation_rows(loadclean_df):
+    """
+    Clean the donation records and add the columns each row's own values
+    decide: dates, party, dubious donor and data scores and parliamentary
+    sitting. Applied to the whole data or to one partition of it.
+    """
     # Create simple column to enable count of events using sum
     loadclean_df["EventCount"] = 1
     # convert DonorId = "" to null
@@ -122,7 +479,7 @@ def load_cleaned_data(
             errors="coerce"
         )
         .dt.normalize()
-        .fillna(st.session_state.PLACEHOLDER_DATE)
+        .fillna(pipeline_state().PLACEHOLDER_DATE)
     )
     # Phase 1 - line 122 - Clean data prep
     logger.debug(f"Clean Data Prep 126: streamlitdata"
@@ -136,21 +493,16 @@ def load_cleaned_data(
     )
     # Fill blank RegulatedDoneeType with RegulatedEntityType
     loadclean_df["RegulatedDoneeType"] = (
-        loadclean_df["RegulatedDoneeType"].fillna(loadclean_df["RegulatedEntityType"])
+        loadclean_df["RegulatedDoneeType"].astype("object")
+        .fillna(loadclean_df["RegulatedEntityType"].astype("object"))
     )
     # Handle NatureOfDonation based on other fields
     if "NatureOfDonation" in loadclean_df.columns:
-        loadclean_df["NatureOfDonation"] = loadclean_df.apply(
-            mp.map_nature_of_donation, axis=1
-        )
-        loadclean_df["NatureOfDonation"] = (
-            loadclean_df["NatureOfDonation"].replace(
-                {"Donation to nan": "Other", "Other Payment": "Other"}
-               ))
+        loadclean_df = add_derived_columns(loadclean_df, ["NatureOfDonation"])
 
     # apply mapping of MPs to party membership
     map_filename = "regentity_map_fname"
-    map_file_path = st.session_state.get(map_filename)
+    map_file_path = pipeline_state().get(map_filename)
     if not map_file_path:
         logger.error(f"{map_filename} not found in session state filenames")
         raise ValueError(f"{map_filename} not found in session state filenames")
@@ -160,35 +512,25 @@ def load_cleaned_data(
     elif os.path.exists(map_file_path) and os.path.getsize(map_file_path) > 0:
         logger.info(f"Map file {map_filename} exists."
                     " Proceeding with deduplication.")
-        # Load the dedupe map file
-        re_dedupe_df = pd.read_csv(map_file_path, dtype={
-            "CleanedRegulatedEntityId": "int64",
-            "RegulatedEntityId": "int64",
-            "CleanedRegulatedEntityName": "object",
-            "PartyName": "object",
-            "PartyId": "int64",
-            "Political Leaning": "object",
-            "Special Interest": "object",
-            })
-        # drop unnecessary columns
-        re_dedupe_df = re_dedupe_df.drop(["RegulatedEntityId",
-                                          "CleanedRegulatedEntityName"
-                                          ], axis=1)
-        # Ensure that there is only one value for each entity ID by taking
-        # the first value in all cases
-        re_dedupe_df = re_dedupe_df.groupby("CleanedRegulatedEntityId").first().reset_index()
-        # rename CleanedRegulatedEntityId to RegulatedEntityId
-        re_dedupe_df.rename(
-            columns={"CleanedRegulatedEntityId": "RegulatedEntityId"}, inplace=True)
-        # Merge the cleaned data with the original data, selecting only required columns
-        loadclean_df = pd.merge(loadclean_df,
-                                re_dedupe_df[["RegulatedEntityId",
-                                              "PartyName",
-                                              "PartyId",
-                                              "Political Leaning",
-                                              "Special Interest"]],
-                                how="left",
-                                on="RegulatedEntityId")
+        # Load the compiled dedupe map, keeping only the first value for
+        # each entity ID
+        party_columns = ["PartyName", "PartyId", "Political Leaning",
+                         "Special Interest"]
+        re_dedupe_map = load_compiled_map(map_file_path,
+                                          "CleanedRegulatedEntityId",
+                                          party_columns,
+                                          dtype={
+                                              "CleanedRegulatedEntityId": "int64",
+                                              "RegulatedEntityId": "int64",
+                                              "CleanedRegulatedEntityName": "object",
+                                              "PartyName": "object",
+                                              "PartyId": "int64",
+                                              "Political Leaning": "object",
+                                              "Special Interest": "object",
+                                              })
+        # Look up the party of each cleaned regulated entity
+        apply_entity_map(loadclean_df, re_dedupe_map, "RegulatedEntityId",
+                         party_columns)
         # Replace Independent with "" in PartyName and 1000001 in PartyId with Null
         loadclean_df["PartyId"] = loadclean_df["PartyId"].replace(1000001, pd.NA)
         loadclean_df["PartyName"] = loadclean_df["PartyName"].replace("Independent", pd.NA)
@@ -206,195 +548,79 @@ def load_cleaned_data(
     logger.debug(f"Clean Data Prep 204: Map Party: {len(loadclean_df)}")
 
     # Create a DubiousData flag for problematic records
-    if ("PLACEHOLDER_DATE" not in st.session_state) or (
-        "PLACEHOLDER_ID" not in st.session_state
+    if ("PLACEHOLDER_DATE" not in pipeline_state()) or (
+        "PLACEHOLDER_ID" not in pipeline_state()
     ):
         raise ValueError(
             "Session state variables PLACEHOLDER_DATE "
             "and PLACEHOLDER_ID must be initialized before use."
         )
 
-    if "filter_def" not in st.session_state:
+    if "filter_def" not in pipeline_state():
         raise ValueError(
             "Session state variables filter_def must"
             " be initialized before use."
         )
 
-    # load dubioud donor criteria
-    DubiousDonorTypes = (
-        st.session_state["filter_def"].get("DubiousDonorTypes_ftr")
-    )
-    # Get list of DonorStatus filter from DubiousDonorTypes
-    DubiousDonorTypesDS = DubiousDonorTypes.get("DonorStatus")
-    # Get list of DonorName filter from DubiousDonorTypes
-    DubiousDonorTypesDN = DubiousDonorTypes.get("DonorName")
-    # Get list of DonorId filter from DubiousDonorTypes
-    DubiousDonorTypesDI = DubiousDonorTypes.get("DonorId")
-    # Get list of NatureOfDonation filter from DubiousDonorTypes
-    DubiousDonorTypesND = DubiousDonorTypes.get("NatureOfDonation")
-    # Get list of DonationType filter from DubiousDonorTypes
-    DubiousDonorTypesDT = DubiousDonorTypes.get("DonationType")
-
-    # Extend dubious donor criteria using session state variables
-    loadclean_df["DubiousDonor"] = (
-        (
-            loadclean_df["DonorId"]
-            .isin(DubiousDonorTypesDI)
-            .astype(int)
-            )
-        +
-        (
-            loadclean_df["DonorName"]
-            .isin(DubiousDonorTypesDN)
-            .astype(int)
-           )
-        +
-        (
-            loadclean_df["DonationType"]
-            .isin(DubiousDonorTypesDT)
-            .astype(int)
-            )
-        +
-        (
-            loadclean_df["DonorStatus"]
-            .isin(DubiousDonorTypesDS)
-            .astype(int)
-            )
-        +
-        (
-            loadclean_df["NatureOfDonation"]
-            .isin(DubiousDonorTypesND)
-            .astype(int)
-            )
-
-    )
-    # Extend dubious donation criteria using session state variables
-    DubiousDonationTypes = (
-        st.session_state["filter_def"].get("DubiousDonationType_ftr")
-    )
-    # load dubious donation criteria
-    DubiousDonationTypesND = DubiousDonationTypes.get("NatureOfDonation")
-    DubiousDonationTypesDT = DubiousDonationTypes.get("DonationType")
-    DubioudDonationTypesDA = DubiousDonationTypes.get("DonationAction")
-    DubiousDonationTypesREI = DubiousDonationTypes.get("RegulatedEntityId")
-    DubiousDonationTypesREN = DubiousDonationTypes.get("RegulatedEntityName")
-    DubiousDonationTypesIA = DubiousDonationTypes.get("IsAggregation")
-    DubiousDonationTypesRD = DubiousDonationTypes.get("ReceivedDate")
-
-    loadclean_df["DubiousData"] = (
-        loadclean_df["DubiousDonor"]
-        + (loadclean_df["DonationType"].isin(DubiousDonationTypesDT).astype(int))
-        + (loadclean_df["DonationAction"].isin(DubioudDonationTypesDA).astype(int))
-        + (loadclean_df["IsAggregation"].isin(DubiousDonationTypesIA).astype(int))
-        + (loadclean_df["NatureOfDonation"]
-            .isin(DubiousDonationTypesND).astype(int))
-        + (
-            loadclean_df["ReceivedDate"]
-            .isin(DubiousDonationTypesRD)
-            .astype(int)
-        )
-        + (
-            loadclean_df["RegulatedEntityId"]
-            .isin(DubiousDonationTypesREI)
-            .astype(int)
-        )
-        + (loadclean_df["RegulatedEntityName"]
-           .isin(DubiousDonationTypesREN).astype(int))
-        - (
-            (
-                (loadclean_df["IsAggregation"].eq(True) |
-                 loadclean_df["DonationType"].eq("Aggregated Donation") |
-                    loadclean_df["NatureOfDonation"].eq("Aggregated Donation")
-                 )
-                & (
-                    loadclean_df["DonorStatus"].isin(
-                        st.session_state["filter_def"].get("SafeDonors_ftr")
-                    )
-                )
-            ).astype(int)
-        )
-    )
-
-    # if "DubiousData" is less than 0, set it to 0
-    loadclean_df["DubiousData"] = loadclean_df["DubiousData"].clip(lower=0)
+    # Score dubious donors and donations from the criteria in filter_def
+    loadclean_df = add_derived_columns(loadclean_df,
+                                       ["DubiousDonor", "DubiousData"])
 
     # Add parliamentary_sitting column BEFORE group assignment
     # so we can group by parliamentary sitting instead of lifetime totals
-    elections_csv_path = os.path.join(
-        st.session_state.BASE_DIR, "reference_files", "elections.csv")
-
-    if os.path.exists(elections_csv_path):
-        elections_df = pd.read_csv(elections_csv_path)
-        # Filter to only General Elections
-        elections_df = elections_df[elections_df['type'] == 'General Election']
-        elections_df['election'] = pd.to_datetime(elections_df['election'])
-        elections_df = elections_df.sort_values('election')
-
-        def assign_parliamentary_sitting(received_date):
-            """Assign donation to parliamentary sitting based on election date"""
-            if pd.isna(received_date):
-                return "Unknown"
-
-            # Find the most recent election before this date
-            prev_elections = elections_df[elections_df['election'] <= received_date]
-            if prev_elections.empty:
-                return "Pre-1929"
-            else:
-                return prev_elections.iloc[-1]['name']
-
-        loadclean_df['parliamentary_sitting'] = loadclean_df['ReceivedDate'].apply(
-            assign_parliamentary_sitting
-        )
-        logger.info(f"Added parliamentary_sitting column with {loadclean_df['parliamentary_sitting'].nunique()} unique periods")
+    context_df = election_context(loadclean_df["ReceivedDate"])
+    if context_df is not None:
+        loadclean_df["parliamentary_sitting"] = (
+            context_df["parliamentary_sitting"])
+        logger.info("Added parliamentary_sitting column with"
+                    f" {loadclean_df['parliamentary_sitting'].nunique()}"
+                    " unique periods")
     else:
-        logger.warning(f"Elections CSV not found at {elections_csv_path}, setting parliamentary_sitting to 'Unknown'")
-        loadclean_df['parliamentary_sitting'] = "Unknown"
-
-    # Apply dictionary to populate RegEntity_Group
-    thresholds = st.session_state.thresholds
-    party_parents = st.session_state.data_remappings["PartyParents"]
-    if "RegulatedEntityName" in loadclean_df.columns:
-        loadclean_df["RegEntity_Group"] = calc.determine_groups_optimized(
-            loadclean_df,
-            "RegulatedEntityName",
-            "EventCount",
-            thresholds,
-            exception_dict=party_parents,
-            groupby_column="parliamentary_sitting"
-        )
-    logger.debug(f"Clean Data Prep 325: RegEntity_Map: {len(loadclean_df)}")
-    # Apply Dictionary to populate Party_Group
-    if "PartyName" in loadclean_df.columns:
-        loadclean_df["Party_Group"] = calc.determine_groups_optimized(
-            loadclean_df,
-            "PartyName",
-            "EventCount",
-            thresholds,
-            exception_dict=party_parents,
-            groupby_column="parliamentary_sitting"
-        )
-    logger.debug(f"Clean Data Prep 335: Party_Group: {len(loadclean_df)}")
-    # Ensure all columns that are in data are also in data_clean
-    for col in orig_df.columns:
-        if col not in loadclean_df.columns:
-            loadclean_df[col] = orig_df[col]
+        logger.warning("No election calendar, setting"
+                       " parliamentary_sitting to 'Unknown'")
+        loadclean_df["parliamentary_sitting"] = UNKNOWN_SITTING
 
+    return loadclean_df
+
+
+def entity_group_totals(loadclean_df):
+    """
+    EventCount of each entity per parliamentary sitting, for each group
+    column, so groups follow the donations per parliamentary sitting
+    rather than lifetime totals
+    """
+    return {group_column: eg.entity_measure_totals(
+                loadclean_df, entity, "EventCount",
+                groupby_column="parliamentary_sitting")
+            for group_column, entity in ENTITY_GROUPS.items()
+            if entity in loadclean_df.columns}
+
+
+def assign_entity_groups(entity_totals):
+    """Assign the group of each entity from its totals over all the data"""
+    thresholds = pipeline_state().thresholds
+    party_parents = pipeline_state().data_remappings["PartyParents"]
+    return {group_column: eg.assign_entity_groups(
+                totals, ENTITY_GROUPS[group_column], thresholds,
+                exception_dict=party_parents)
+            for group_column, totals in entity_totals.items()}
+
+
+def add_entity_groups(loadclean_df, entity_groups):
+    """Populate RegEntity_Group and Party_Group from the entity groups"""
+    for group_column, groups in entity_groups.items():
+        loadclean_df[group_column] = eg.merge_entity_groups(loadclean_df,
+                                                              groups)
+    return loadclean_df
+
+
+def encode_cleaned_rows(loadclean_df, categories):
+    """
+    Drop the columns no longer needed and add the integer encoding of
+    columns, coded against the categories of each over all the data
+    """
     # Drop Columns that are not needed
-    loadclean_df = loadclean_df.drop(
-        [
-            "IsIrishSource",
-            "AccountingUnitsAsCentralParty",
-            "AccountingUnitName",
-            "AcceptedDate",
-            "ReportedDate",
-            "IsReportedPrePoll",
-            "AccountingUnitId",
-            "Postcode",
-            "CompanyRegistrationNumber",
-            "CampaigningName",
-        ],
-        axis=1,
-    )
+    loadclean_df = loadclean_df.drop(UNUSED_COLUMNS, axis=1)
 
     # Column encoding DonationType, RegulatedEntityName, DonorName,
     # DonationAction, DonorStatus,
@@ -402,57 +628,41 @@ def load_cleaned_data(
     # RegulatedDoneeType,
     # IsIrishSource, IsBequest, IsAggregation, IsSponsorship, NatureOfDonation,
     # RegisterName
-    loadclean_df["DonationTypeInt"] = (
-        loadclean_df["DonationType"].astype("category").cat.codes)
-    loadclean_df["RegulatedEntityNameInt"] = (
-        loadclean_df["RegulatedEntityName"].astype("category").cat.codes)
-    loadclean_df["DonorNameInt"] = (
-        loadclean_df["DonorName"].astype("category").cat.codes)
-    loadclean_df["DonationActionInt"] = (
-        loadclean_df["DonationAction"].astype("category").cat.codes)
-    loadclean_df["DonorStatusInt"] = (
-        loadclean_df["DonorStatus"].astype("category").cat.codes)
-    # loadclean_df["CampaigningNameInt"] = (
-    #     loadclean_df["CampaigningName"].astype("category").cat.codes)
-    loadclean_df["PurposeOfVisitInt"] = (
-        loadclean_df["PurposeOfVisit"].astype("category").cat.codes)
-    # loadclean_df["AccountingUnitNameInt"] = (
-    #     loadclean_df["AccountingUnitName"].astype("category").cat.codes)
-    # loadclean_df["ReportingPeriodNameInt"] = (
-    #     loadclean_df["ReportingPeriodName"].astype("category").cat.codes)
-    loadclean_df["RegulatedDoneeTypeInt"] = (
-        loadclean_df["RegulatedDoneeType"].astype("category").cat.codes)
-    # loadclean_df["IsIrishSourceInt"] = (
-    #     loadclean_df["IsIrishSource"].astype("category").cat.codes)
-    loadclean_df["IsBequestInt"] = (
-        loadclean_df["IsBequest"].astype("category").cat.codes)
-    loadclean_df["IsAggregationInt"] = (
-        loadclean_df["IsAggregation"].astype("category").cat.codes)
-    loadclean_df["IsSponsorshipInt"] = (
-        loadclean_df["IsSponsorship"].astype("category").cat.codes)
-    loadclean_df["NatureOfDonationInt"] = (
-        loadclean_df["NatureOfDonation"].astype("category").cat.codes)
-    loadclean_df["RegisterNameInt"] = (
-        loadclean_df["RegisterName"].astype("category").cat.codes)
-    loadclean_df["PartyNameInt"] = (
-        loadclean_df["PartyName"].astype("category").cat.codes)
-    loadclean_df["PartyGroupInt"] = (
-        loadclean_df["Party_Group"].astype("category").cat.codes)
-    loadclean_df["RegEntityGrou[Int"] = (
-        loadclean_df["RegEntity_Group"].astype("category").cat.codes)
+    loadclean_df = add_column_codes(loadclean_df, categories)
 
     # Column encoding PublicFundsInt
-    loadclean_df["PublicFundsInt"] = (
-        loadclean_df["DonationType"]
-        .apply(lambda x: 0 if x != "Public Funds" else 1))
-    # Calculate the number of days to the next election and
-    # since the last election
-    # Ensure election dates are loaded
-    if ("ElectionDatesAscend" not in st.session_state or
-            "ElectionDatesDescend" not in st.session_state):
-        load_election_dates()
-
-    if st.session_state.ElectionDatesAscend is None:
+    return add_derived_columns(loadclean_df, ["PublicFundsInt"])
+
+
+def add_derived_columns(loadclean_df, columns):
+    """Add the columns computed from their rules (derived_column_rules)"""
+    rules = pipeline_state()["derived_column_rules"]
+    for column in columns:
+        loadclean_df[column] = mp.derive_column(
+            loadclean_df, rules[column], pipeline_state()["filter_def"])
+    return loadclean_df
+
+
+def add_column_codes(loadclean_df, categories):
+    """Add the integer encoding of the code columns in categories"""
+    for code_column, codes in categories.items():
+        loadclean_df[code_column] = pd.Categorical(
+            loadclean_df[CODED_COLUMNS[code_column]], categories=codes).codes
+    return loadclean_df
+
+
+def add_election_measures(loadclean_df):
+    """
+    Add the days, weeks, quarters and years to the next and since the
+    last general election and the electoral cycle phase of each donation.
+    Returns None if the election dates cannot be loaded.
+    """
+    # Days to the next and since the last election and the phase of
+    # each donation, from the election calendar
+    loadclean_df["ReceivedDate"] = pd.to_datetime(loadclean_df["ReceivedDate"])
+    context_df = election_context(loadclean_df["ReceivedDate"])
+
+    if context_df is None:
         # set [DaysTillNextElection, DaysSinceLastElection,
         # WeeksTillNextElection, WeeksSinceLastElection,QtrsTillNextElection,
         # QtrsSinceLastElection] to None
@@ -466,62 +676,11 @@ def load_cleaned_data(
         loadclean_df["YrsSinceLastElection"] = None
         logger.error("Election dates could not be loaded. Returning None.")
         st.error("Election dates could not be loaded. Returning None.")
-        return None 
+        return None
     else:
-        # Convert election dates into Pandas Series
-        loadclean_df["ReceivedDate"] = pd.to_datetime(
-            loadclean_df["ReceivedDate"])
-        election_dates_asc = pd.to_datetime(
-            pd.Series(st.session_state.ElectionDatesAscend))
-        election_dates_desc = pd.to_datetime(
-            pd.Series(st.session_state.ElectionDatesDescend))
-        electoral_cycle_thresholds = st.session_state.electoral_cycle_rules
-        # Calculate days till the next election and since the last election
-        def get_days_till_next_election(date_series):
-            date_series = pd.to_datetime(date_series)
-            idx = np.searchsorted(election_dates_asc, date_series, side="left")
-
-            # Ensure idx is within valid bounds
-            idx = np.clip(idx, 0, len(election_dates_asc) - 1)
-
-            # Assign next election date only if idx is valid
-            next_election_dates = np.where(idx < len(election_dates_asc),
-                                        election_dates_asc.iloc[idx],
-                                        pd.NaT)
-
-            # Compute days difference and handle NaT cases
-            days_diff = (pd.to_datetime(next_election_dates) - date_series).dt.days
-            return days_diff.fillna(0).astype(int)  # Default to 0
-
-        def get_days_since_last_election(date_series):
-            date_series = pd.to_datetime(date_series)
-            # Use ascending dates and get the position just BEFORE the date
-            idx = np.searchsorted(election_dates_asc, date_series, side="right") - 1
-
-            # Ensure idx is within valid bounds (can be -1 if before first election)
-            idx = np.clip(idx, 0, len(election_dates_asc) - 1)
-
-            # Assign last election date only if idx is valid
-            last_election_dates = np.where(idx >= 0,
-                                        election_dates_asc.iloc[idx],
-                                        pd.NaT)
-
-            # Compute days difference and handle NaT cases
-            days_diff = (date_series - pd.to_datetime(last_election_dates)).dt.days
-            return days_diff.fillna(0).astype(int)  # Default to 0
-        # Apply vectorized calculations
-        loadclean_df["DaysTillNextElection"] = (
-            get_days_till_next_election(loadclean_df["ReceivedDate"])
-            )
-        loadclean_df["DaysSinceLastElection"] = (
-            get_days_since_last_election(loadclean_df["ReceivedDate"])
-            )
-        loadclean_df["ElectoralCyclePhase"] = loadclean_df.apply(
-            classify_electoral_cycle_from_thresholds,
-            axis=1,
-            thresholds_dict=electoral_cycle_thresholds,
-            default_label="Unclassified"
-            )
+        for column in ["DaysTillNextElection", "DaysSinceLastElection",
+                       "ElectoralCyclePhase"]:
+            loadclean_df[column] = context_df[column]
 
         # Compute weeks and quarters and years
         for period, divisor in [("Wks", 7), ("Qtrs", 91), ("Yrs", 365)]:
@@ -532,56 +691,110 @@ def load_cleaned_data(
 
         # parliamentary_sitting column already added earlier (before group assignment)
 
-    logger.debug(f"Clean Data Prep 353: Election dates: {len(loadclean_df)}")
-    # compare count of rows in original data with cleaned data
-    if len(orig_df) != len(loadclean_df):
-        logger.error(
-            f"Number of rows in cleaned data ({len(loadclean_df)}) "
-            f"does not match the number of rows in the original data "
-            f"({len(orig_df)})! {__name__}"
-        )
-        # Dedupe the data
-        loadclean_df = loadclean_df.drop_duplicates()
-        logger.info(
-            f"Deduplication completed, shape: {loadclean_df.shape} {__name__}"
-        )
-        # compare count of rows in original data with cleaned data
-        if len(orig_df) != len(loadclean_df):
-            logger.error(
-                "Post deduplication: "
-                f"Number of rows in cleaned data ({len(loadclean_df)}) "
-                f"does not match the number of rows in the original data "
-                f"({len(orig_df)})! {__name__}"
-            )
-            st.error(
-                "Post deduplication: "
-                f"Number of rows in cleaned data ({len(loadclean_df)}) "
-                f"does not match the number of rows in the original data "
-                f"({len(orig_df)})! {__name__}, deduplication failed"
-            )
-            return ValueError("Deduplication failed")
-    logger.debug(f"Clean Data Prep 386: End of clean: {len(loadclean_df)}")
-    # Drop unnecessary columns
-    loadclean_df = loadclean_df.drop(
-        [
-            "CleanedRegulatedEntityId",
-            "CleanedRegulatedEntityName",
-            "CleanedDonorId",
-            "CleanedDonorName",
-            "OriginalRegulatedEntityId",
-            "OriginalRegulatedEntityName",
-            "OriginalDonorId",
-            "OriginalDonorName",
-        ],
-        axis=1,
-    )
-    # Normalize string dtypes to avoid Streamlit Arrow LargeUtf8 errors
-    loadclean_df = normalize_string_columns_for_streamlit(loadclean_df)
-    # Save cleaned data
-    if output_csv:
-        # Save the cleaned data to a CSV file for further analysis or reporting
-        from data.data_file_defs import save_dataframe_to_zip
-        save_dataframe_to_zip(loadclean_df, processeddatafilepath, index=True)
-    logger.info(f"Cleaned Data completed, shape: {loadclean_df.shape}")
-    # return the cleaned data
     return loadclean_df
+
+
+def finish_cleaned_rows(loadclean_df):
+    """Drop the original and cleaned id and name columns"""
+    # Drop unnecessary columns
+    return loadclean_df.drop(SOURCE_ENTITY_COLUMNS, axis=1)
+
+
+@log_function_call
+def load_cleaned_data_partitioned(originaldatafilepath, processeddatafilepath,
+                                  output_csv=False):
+    """
+    Out-of-core version of the cleaning in load_cleaned_data, reading the
+    cleaned donations artifact one partition at a time (data.out_of_core).
+
+    The first pass cleans the rows of each partition, spills them and
+    collects what depends on all the data: the entity totals per
+    parliamentary sitting, the values of the encoded columns and the
+    distinct dimension rows. These are combined, then the second pass
+    adds the groups, codes, election measures and dimension keys to each
+    spilled partition and writes it to the cleaned data artifact. The
+    result is the same as cleaning the whole frame in memory.
+
+    Returns the number of rows written, not the frame, so the cleaned
+    data is never held whole; None if a partition could not be cleaned.
+    """
+    from data.data_file_defs import StreamingArtifactWriter
+    totals_parts = []
+    values_parts = {column: [] for column in CODED_COLUMNS.values()}
+    dimension_parts = []
+    rows_parts = []
+    with spill_directory() as spill_dir:
+        spilled = []
+        for number, partition_df in enumerate(iter_partitions(
+                "cleaned_donations", originaldatafilepath)):
+            rows_parts.append(row_hashes(partition_df))
+            partition_df = clean_donation_rows(partition_df)
+            totals_parts.append(entity_group_totals(partition_df))
+            for column in values_parts:
+                if column in partition_df.columns:
+                    values_parts[column].append(
+                        column_values(partition_df[column]))
+            dimension_parts.append(distinct_dimension_rows(partition_df))
+            spilled.append(spill_partition(spill_dir, number, partition_df))
+        if not spilled:
+            logger.error(f"No rows read from {originaldatafilepath}")
+            return None
+        logger.info(f"Cleaned {len(spilled)} partitions, combining"
+                    " partial aggregates")
+
+        entity_groups = assign_entity_groups(
+            {group_column: eg.combine_measure_totals(
+                [part[group_column] for part in totals_parts])
+             for group_column in totals_parts[0]})
+        categories = {}
+        for code_column, column in CODED_COLUMNS.items():
+            if column in entity_groups:
+                values = entity_groups[column]["group"].dropna().unique()
+            else:
+                values = combine_column_values(values_parts[column])
+            categories[code_column] = column_categories(values)
+        dimensions = build_dimensions(combine_dimension_rows(dimension_parts))
+
+        # rows go to a temporary artifact when the cleaned data is not saved
+        target = (processeddatafilepath if output_csv
+                  else os.path.join(spill_dir, "cleaned_data"))
+        rows = 0
+        try:
+            # a failed partition abandons the artifact, leaving the
+            # previous version in place
+            with StreamingArtifactWriter(target,
+                                         artifact="cleaned_data") as writer:
+                for path in spilled:
+                    partition_df = load_spilled_partition(path)
+                    partition_rows = len(partition_df)
+                    partition_df = add_entity_groups(partition_df,
+                                                     entity_groups)
+                    partition_df = encode_cleaned_rows(partition_df,
+                                                       categories)
+                    partition_df = add_election_measures(partition_df)
+                    if partition_df is None:
+                        raise ValueError("Election dates could not be"
+                                         " loaded.")
+                    if len(partition_df) != partition_rows:
+                        raise ValueError(f"Partition {path} changed from"
+                                         f" {partition_rows} to"
+                                         f" {len(partition_df)} rows.")
+                    partition_df = finish_cleaned_rows(partition_df)
+                    writer.append(key_fact_rows(partition_df, dimensions))
+                    rows += partition_rows
+        except ValueError as e:
+            logger.error(f"Out-of-core cleaning failed: {e}")
+            return None
+        saved_filepath = writer.filepath
+        if output_csv:
+            from data.artifact_manifest import record_artifact
+            cleaned_inputs = cleaned_data_inputs(originaldatafilepath)
+            # dimensions first, the fact table's manifest entry marks the
+            # star schema complete
+            save_dimensions(dimensions, cleaned_inputs)
+            record_artifact(saved_filepath, cleaned_inputs, rows)
+            save_row_hashes(pd.concat(rows_parts, ignore_index=True),
+                            processeddatafilepath)
+    logger.info(f"Cleaned Data completed out of core, {rows} rows written"
+                f" to {saved_filepath}")
+    return rows
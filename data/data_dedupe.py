@@ -1,11 +1,12 @@
+import multiprocessing
 import pandas as pd
-import streamlit as st
 import os
+from concurrent.futures import ProcessPoolExecutor
 from rapidfuzz import process, fuzz
 from collections import defaultdict
+from data.dedupe_maps import apply_entity_map, load_compiled_map
 from utils.logger import logger, log_function_call
-# Import the is_file_updated function
-from data.data_utils import is_file_updated
+from utils.pipeline_state import pipeline_state
 
 
 @log_function_call
@@ -14,13 +15,16 @@ def dedupe_entity_file(
     entity,
     map_filename,
     threshold=85,
-    output_csv=False
+    output_csv=False,
+    entity_map=None
     ):
     """
-    Loads a dedupe mapping file from the reference folder and
-    merges it with the original data. Merges on the field named
-    {entity}id. If the file does not exist, the dedupe_entity_fuzzy
-    function is called to dedupe the data and return the new data.
+    Loads a dedupe mapping file from the reference folder, compiled to a
+    binary lookup (data.dedupe_maps), and looks up the cleaned id and name
+    of each row by the field named {entity}id. If the file does not
+    exist, the dedupe_entity_fuzzy function is called to dedupe the data
+    and return the new data. A map already loaded with load_entity_map
+    can be passed as entity_map for the chunks of a streamed import.
     """
     # Load the data prep - set field names
     originalentityname = f"Original{entity}Name"
@@ -36,26 +40,24 @@ def dedupe_entity_file(
         raise ValueError(f"{entityid} not found in data")
 
     # Check if the mapping file exists in the session state
-    map_file_path = st.session_state.get(map_filename)
-    if not map_file_path:
+    map_file_path = pipeline_state().get(map_filename)
+    if entity_map is not None:
+        re_dedupe_map = entity_map
+    elif not map_file_path:
         logger.error(f"{map_filename} not found in session state filenames")
         raise ValueError(f"{map_filename} not found in session state filenames")
-
-    # File exists and contains data use it to dedupe the data
-    # check {map_filename} exists and has data
     elif os.path.exists(map_file_path) and os.path.getsize(map_file_path) > 0:
         logger.info(f"Map file {map_filename} exists."
                     " Proceeding with deduplication.")
-        # Load the dedupe map file
-        re_dedupe_df = pd.read_csv(map_file_path)
-        # Ensure that there is only one value for each entity ID by taking
-        # the first value in all cases
-        re_dedupe_df = re_dedupe_df.groupby(entityid).first().reset_index()
-        # Merge the cleaned data with the original data, selecting only required columns
-        loaddata_dd_df = pd.merge(loaddata_dd_df,
-                      re_dedupe_df[[entityid, cleanedentityname, cleanedentityid]],
-                      how="left",
-                      on=entityid)
+        re_dedupe_map = load_entity_map(map_file_path, entityid)
+    else:
+        re_dedupe_map = None
+
+    if re_dedupe_map is not None:
+        # Look up the cleaned id and name of each row, adding the columns
+        # in place rather than merging a copy of the frame
+        apply_entity_map(loaddata_dd_df, re_dedupe_map, entityid,
+                         [cleanedentityname, cleanedentityid])
         # # Rename columns
         # entityname_x = f"{entityname}_x"
         # # entityname_y = f"{entityname}_y"
@@ -123,6 +125,83 @@ def dedupe_entity_file(
     return loaddata_dd_df
 
 
+def entity_map_available(map_filename):
+    """True if the mapping file in session state under map_filename has content"""
+    map_file_path = pipeline_state().get(map_filename)
+    return bool(map_file_path and os.path.exists(map_file_path)
+                and os.path.getsize(map_file_path) > 0)
+
+
+def dedupe_entity_in_session(settings, columns_df, entity, map_filename,
+                             output_csv):
+    """
+    dedupe_entity_file in a worker process, in a headless session holding
+    the settings of the session that started it
+    """
+    from data.build import headless_session
+    with headless_session(settings):
+        return dedupe_entity_file(columns_df, entity, map_filename,
+                                  output_csv=output_csv)
+
+
+@log_function_call
+def dedupe_entities(loaddata_df, entities, output_csv=False):
+    """
+    Dedupe each of entities, a list of (entity, map session key), on its
+    own id and name columns, so the entities do not depend on each other.
+    Lookups in a mapping file take a fraction of a second and run here;
+    fuzzy deduplication, CPU-bound Python, runs for the entities without
+    a mapping file at the same time on a process pool. The columns each
+    dedupe adds are joined to the frame in the order of entities, as
+    deduping one entity after the other would.
+    """
+    from data.build import session_settings
+
+    def entity_columns(entity):
+        return loaddata_df[[column for column in (f"{entity}Id",
+                                                  f"{entity}Name")
+                            if column in loaddata_df.columns]].copy()
+
+    fuzzy = [(entity, map_filename) for entity, map_filename in entities
+             if not entity_map_available(map_filename)]
+    deduped = {}
+    if len(fuzzy) > 1:
+        settings = session_settings()
+        with ProcessPoolExecutor(
+                max_workers=len(fuzzy),
+                mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = {entity: executor.submit(
+                dedupe_entity_in_session, settings, entity_columns(entity),
+                entity, map_filename, output_csv)
+                for entity, map_filename in fuzzy}
+            deduped = {entity: future.result()
+                       for entity, future in futures.items()}
+    for entity, map_filename in entities:
+        if entity not in deduped:
+            deduped[entity] = dedupe_entity_file(
+                entity_columns(entity), entity, map_filename,
+                output_csv=output_csv)
+        columns_df = deduped[entity]
+        loaddata_df.rename(columns={f"{entity}Id": f"Original{entity}Id",
+                                    f"{entity}Name": f"Original{entity}Name"},
+                           inplace=True)
+        for column in columns_df.columns[2:]:
+            loaddata_df[column] = columns_df[column]
+    return loaddata_df
+
+
+@log_function_call
+def load_entity_map(map_file_path, entityid):
+    """
+    Load the compiled lookup of a dedupe mapping file, keeping only the
+    first mapping for each entity ID. The file is recompiled only when
+    its content changes.
+    """
+    entity = entityid[:-len("Id")]
+    return load_compiled_map(map_file_path, entityid,
+                             [f"Cleaned{entity}Name", f"Cleaned{entity}Id"])
+
+
 @log_function_call
 def dedupe_entity_fuzzy(deupedf, entity, threshold=85, output_csv=False):
     """
@@ -169,7 +248,7 @@ def dedupe_entity_fuzzy(deupedf, entity, threshold=85, output_csv=False):
     # Save results to a CSV file if requested
     if output_csv:
         fname = f"potential_{entity.lower()}_duplicates_fname"
-        potential_regentity_duplicates_filename = st.session_state[fname]
+        potential_regentity_duplicates_filename = pipeline_state()[fname]
         output_df = pd.DataFrame(
             potential_duplicates.items(), columns=[entityid, "Potential Duplicates"]
         )
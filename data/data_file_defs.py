@@ -1,21 +1,38 @@
 import pandas as pd
 import zipfile
 import os
+import queue
+import threading
+import time
 import config
+from data import schema_registry
+from utils.logger import logger
 
 
-def normalize_string_columns_for_streamlit(df):
+ARTIFACT_EXTENSIONS = (".parquet", ".zip", ".csv")
+
+
+def _artifact_candidates(filepath):
+    """Return the parquet, zip and csv variants of an artifact path"""
+    filepath = os.fspath(filepath).strip()
+    base, ext = os.path.splitext(filepath)
+    if ext.lower() not in ARTIFACT_EXTENSIONS:
+        base = filepath
+    return [base + extension for extension in ARTIFACT_EXTENSIONS]
+
+
+def resolve_artifact_path(filepath):
     """
-    Convert pandas string dtypes (e.g., string[pyarrow]) to plain object
-    to avoid Streamlit 1.19 Arrow LargeUtf8 rendering errors.
+    Return the path of the stored version of an artifact, preferring the
+    typed parquet file over the CSV-inside-ZIP and plain CSV versions.
+    Returns None if no version of the artifact exists.
     """
-    if df is None:
-        return df
-    for col in df.columns:
-        dtype_str = str(df[col].dtype)
-        if dtype_str.startswith("string"):
-            df[col] = df[col].astype("object")
-    return df
+    if filepath is None:
+        return None
+    for candidate in _artifact_candidates(filepath):
+        if os.path.exists(candidate):
+            return candidate
+    return None
 
 
 def _read_csv_from_zip_or_csv(filepath):
@@ -46,8 +63,221 @@ def _read_csv_from_zip_or_csv(filepath):
     return filepath
 
 
-def save_dataframe_to_zip(df, csv_filepath, index=True):
-    """Helper function to save DataFrame to ZIP file"""
+def _csv_usecols(filepath, columns, index_col):
+    """
+    Header names of the given columns and the index column of a CSV, so
+    only they are parsed
+    """
+    header = pd.read_csv(_read_csv_from_zip_or_csv(filepath),
+                         nrows=0).columns
+    wanted = set(columns)
+    return [name for position, name in enumerate(header)
+            if name in wanted or position == index_col]
+
+
+def _read_artifact(filepath, columns=None, **read_csv_kwargs):
+    """
+    Read an artifact into a DataFrame. A parquet version is read as-is,
+    keeping its stored dtypes and index, otherwise the CSV is parsed from
+    the ZIP or CSV file using the supplied read_csv arguments. When
+    columns are given only those columns (and the index) are read.
+    """
+    resolved_path = resolve_artifact_path(filepath) or filepath
+    if resolved_path.endswith(".parquet"):
+        if columns is not None:
+            import pyarrow.parquet as pq
+            stored = set(pq.read_schema(resolved_path).names)
+            columns = [name for name in columns if name in stored]
+        return pd.read_parquet(resolved_path, columns=columns)
+    if columns is not None:
+        read_csv_kwargs["usecols"] = _csv_usecols(
+            resolved_path, columns, read_csv_kwargs.get("index_col"))
+    return pd.read_csv(_read_csv_from_zip_or_csv(resolved_path),
+                       **read_csv_kwargs)
+
+
+def blank_strings_to_missing(df, artifact=None):
+    """
+    Replace the empty strings of the text and categorical columns of a
+    frame with missing values, as reading them back from CSV does, so an
+    artifact holds the same values whichever format it is stored in. The
+    blank columns registered for the artifact keep their empty strings,
+    which coerce_to_schema restores when they are read back from CSV.
+    """
+    keep = (set(schema_registry.get_blank_columns(artifact))
+            if artifact is not None else set())
+    for col in df.columns:
+        if col in keep:
+            continue
+        values = df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            if "" in values.cat.categories:
+                df[col] = values.cat.remove_categories([""])
+        elif (values.dtype == "object"
+              or isinstance(values.dtype, pd.StringDtype)):
+            blank = values.eq("").to_numpy(dtype=bool, na_value=False)
+            if blank.any():
+                df[col] = values.mask(blank)
+    return df
+
+
+def _prepare_for_parquet(df, artifact=None):
+    """
+    Parquet columns must hold a single type, so object columns mixing
+    types (e.g. sitting names read as numbers plus "Unknown") are stored
+    as strings, keeping missing values as nulls. Empty strings are stored
+    as nulls, as they were read back from the CSV artifacts, except in
+    the artifact's blank columns.
+    """
+    df = blank_strings_to_missing(df, artifact)
+    for col in df.columns:
+        if df[col].dtype == "object":
+            inferred = pd.api.types.infer_dtype(df[col], skipna=True)
+            if inferred not in ("string", "empty", "bytes"):
+                df[col] = df[col].where(df[col].isna(),
+                                        df[col].astype(str))
+    return df
+
+
+def _remove_other_artifact_versions(keep_filepath):
+    """
+    Remove stale versions of an artifact that resolve_artifact_path would
+    pick over the one just written. Versions it ranks below are left in
+    place, so a parquet build keeps the ZIP artifacts shipped with the
+    repository for deployments that do not run the build.
+    """
+    for candidate in _artifact_candidates(keep_filepath):
+        if os.path.normpath(candidate) == os.path.normpath(keep_filepath):
+            break
+        if os.path.exists(candidate):
+            os.remove(candidate)
+
+
+def _resolve_output_path(filepath, extension):
+    """Resolve an artifact path to an absolute path with the given extension"""
+    filepath = os.fspath(filepath).strip()
+    base, ext = os.path.splitext(filepath)
+    if ext.lower() not in ARTIFACT_EXTENSIONS:
+        base = filepath
+    output_filepath = base + extension
+
+    # If no directory was provided, default to output directory
+    if not os.path.dirname(output_filepath):
+        output_dir = config.DIRECTORIES.get("output_dir", "")
+        output_filepath = os.path.join(output_dir, output_filepath)
+
+    # Normalize and ensure absolute path
+    output_filepath = os.path.normpath(os.path.abspath(output_filepath))
+
+    # Create parent directory if it doesn't exist
+    dir_path = os.path.dirname(output_filepath)
+    if dir_path:
+        os.makedirs(dir_path, exist_ok=True)
+    return output_filepath
+
+
+def _temporary_path(filepath):
+    """
+    Temporary file next to filepath, unique to this process and thread,
+    so concurrent writers never share a partly written file
+    """
+    return f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+ZIP_CODECS = {  # codec: (zipfile compression, compresslevel)
+    "deflate": (zipfile.ZIP_DEFLATED, None),
+    "deflate-fast": (zipfile.ZIP_DEFLATED, 1),
+    "bzip2": (zipfile.ZIP_BZIP2, None),
+    "lzma": (zipfile.ZIP_LZMA, None),
+    None: (zipfile.ZIP_STORED, None),
+}
+
+# Line ending of the CSV inside ZIP artifacts. Some text fields hold bare
+# carriage returns, which are only quoted, and so read back as part of the
+# field, when the lines end in CRLF (as source_store.EXPORT_LINE_TERMINATOR)
+ZIP_LINE_TERMINATOR = "\r\n"
+
+
+def get_artifact_codec(artifact, artifact_format):
+    """
+    Compression codec for an artifact in the given format, taken from
+    config.ARTIFACT_CODECS. The fast codecs a ZIP file cannot hold (zstd,
+    lz4, snappy) fall back to fast deflate for ZIP artifacts.
+    """
+    default = (config.PARQUET_COMPRESSION if artifact_format == "parquet"
+               else "deflate")
+    codec = config.ARTIFACT_CODECS.get(artifact, default)
+    if artifact_format != "parquet" and codec not in ZIP_CODECS:
+        logger.debug(f"{codec} not available in ZIP files,"
+                     f" using deflate-fast for {artifact}")
+        codec = "deflate-fast"
+    return codec
+
+
+def _log_write_rate(filepath, nbytes, started, codec):
+    """Report the size and throughput of an artifact write"""
+    elapsed = max(time.monotonic() - started, 1e-6)
+    stored = os.path.getsize(filepath) if os.path.exists(filepath) else 0
+    logger.info(f"Wrote {os.path.basename(filepath)} ({codec}):"
+                f" {nbytes / 1e6:.1f} MB in {elapsed:.2f}s,"
+                f" {nbytes / 1e6 / elapsed:.1f} MB/s,"
+                f" {stored / 1e6:.1f} MB on disk")
+
+
+def _write_csv_blocks(df, zip_ref, csv_filename, index, block_rows,
+                      lineterminator=None):
+    """
+    Write a frame into a ZIP member as CSV, block_rows rows at a time, so
+    the CSV text of the whole frame is never held in memory. Blocks are
+    formatted on the calling thread and compressed on a writer thread
+    (zlib releases the GIL), so formatting and compression overlap. The
+    member is a single deflate stream, so its blocks are compressed one
+    after another on that one thread, not in parallel; the faster codecs
+    are zstd and lz4 for parquet artifacts and deflate-fast for ZIP.
+    Returns the number of uncompressed bytes written.
+    """
+    blocks = queue.Queue(maxsize=2)
+    written = {"bytes": 0, "error": None}
+
+    def compress_blocks(member):
+        while True:
+            block = blocks.get()
+            if block is None:
+                return
+            # after an error keep draining so the producer never blocks
+            if written["error"] is None:
+                try:
+                    member.write(block)
+                    written["bytes"] += len(block)
+                except Exception as e:
+                    written["error"] = e
+
+    with zip_ref.open(csv_filename, "w", force_zip64=True) as member:
+        writer = threading.Thread(target=compress_blocks, args=(member,),
+                                  name="zip-writer", daemon=True)
+        writer.start()
+        try:
+            for start in range(0, max(len(df), 1), block_rows):
+                block = df.iloc[start:start + block_rows].to_csv(
+                    index=index, header=start == 0,
+                    lineterminator=lineterminator)
+                blocks.put(block.encode("utf-8"))
+        finally:
+            blocks.put(None)
+            writer.join()
+    if written["error"] is not None:
+        raise written["error"]
+    return written["bytes"]
+
+
+def save_dataframe_to_zip(df, csv_filepath, index=True, codec="deflate",
+                          block_rows=None, lineterminator=None):
+    """
+    Helper function to save DataFrame to ZIP file. Rows are streamed into
+    the archive member in blocks of block_rows (config.ARTIFACT_WRITE_BLOCK_ROWS
+    by default) using the given codec (see ZIP_CODECS). lineterminator
+    defaults to ZIP_LINE_TERMINATOR.
+    """
     # Check if csv_filepath is already a zip reference
     csv_filepath = os.fspath(csv_filepath).strip()
     if csv_filepath.endswith('.zip'):
@@ -71,224 +301,342 @@ def save_dataframe_to_zip(df, csv_filepath, index=True):
     if dir_path:
         os.makedirs(dir_path, exist_ok=True)
     
-    with zipfile.ZipFile(zip_filepath, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
-        csv_string = df.to_csv(index=index)
-        zip_ref.writestr(csv_filename, csv_string)
-    
+    compression, compresslevel = ZIP_CODECS.get(codec,
+                                                ZIP_CODECS["deflate"])
+    started = time.monotonic()
+    # Write to a temporary file and rename it into place so readers never
+    # see a partly written archive
+    tmp_filepath = _temporary_path(zip_filepath)
+    try:
+        with zipfile.ZipFile(tmp_filepath, 'w', compression,
+                             compresslevel=compresslevel) as zip_ref:
+            nbytes = _write_csv_blocks(
+                df, zip_ref, csv_filename, index,
+                block_rows or config.ARTIFACT_WRITE_BLOCK_ROWS,
+                lineterminator or ZIP_LINE_TERMINATOR)
+    except BaseException:
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+        raise
+    os.replace(tmp_filepath, zip_filepath)
+    _log_write_rate(zip_filepath, nbytes, started, codec)
+
     return zip_filepath
 
 
-def load_source_data(originaldatafilepath):
-    loaddata_df = pd.read_csv(
-        _read_csv_from_zip_or_csv(originaldatafilepath),
-        engine='python',
-        dtype={
-            "ECRef": "object",
-            "RegulatedEntityName": "object",
-            "RegulatedEntityType": "object",
-            "Value": "object",
-            "AcceptedDate": "object",
-            "AccountingUnitName": "object",
-            "DonorName": "object",
-            "AccountingUnitsAsCentralParty": "object",
-            "IsSponsorship": "object",
-            "DonorStatus": "object",
-            "RegulatedDoneeType": "object",
-            "CompanyRegistrationNumber": "object",
-            "Postcode": "object",
-            "DonationType": "object",
-            "NatureOfDonation": "object",
-            "PurposeOfVisit": "object",
-            "DonationAction": "object",
-            "ReceivedDate": "object",
-            "ReportedDate": "object",
-            "IsReportedPrePoll": "object",
-            "ReportingPeriodName": "object",
-            "IsBequest": "object",
-            "IsAggregation": "object",
-            "RegulatedEntityId": "object",
-            "AccountingUnitId": "object",
-            "DonorId": "object",
-            "CampaigningName": "object",
-            "RegisterName": "object",
-            "IsIrishSource": "object",
-        },
-        index_col=0,
+def save_dataframe_to_parquet(df, filepath, index=True, codec=None,
+                              artifact=None):
+    """
+    Helper function to save DataFrame to a parquet file. Datetimes,
+    nullable integers and categoricals are stored with their dtypes so
+    the artifact can be loaded without re-parsing. Column chunks are
+    compressed with codec (config.PARQUET_COMPRESSION by default).
+    artifact names the registered artifact, whose blank columns keep
+    their empty strings.
+    """
+    codec = codec or config.PARQUET_COMPRESSION
+    parquet_filepath = _resolve_output_path(filepath, ".parquet")
+    started = time.monotonic()
+    tmp_filepath = _temporary_path(parquet_filepath)
+    _prepare_for_parquet(df.copy(), artifact).to_parquet(
+        tmp_filepath,
+        index=index,
+        compression=codec,
     )
-    return normalize_string_columns_for_streamlit(loaddata_df)
+    os.replace(tmp_filepath, parquet_filepath)
+    _log_write_rate(parquet_filepath,
+                    df.memory_usage(index=index, deep=True).sum(),
+                    started, codec)
+    return parquet_filepath
+
+
+def save_dataframe_artifact(df, filepath, index=True, artifact=None,
+                            inputs=None):
+    """
+    Save a pipeline artifact in the format set by config.ARTIFACT_FORMAT
+    and remove any stale copy stored in another format. Falls back to
+    CSV-inside-ZIP if parquet support is not installed. When the artifact
+    name is given the frame is validated and cast to its registered schema
+    before writing, and a memory report of the cast is written next to
+    it. When the input files are given the artifact is recorded in the
+    artifact manifest as built from them.
+    """
+    if artifact is not None:
+        schema_registry.validate_dataframe(df, artifact)
+        built_df = df
+        df = schema_registry.coerce_to_schema(df.copy(), artifact)
+    if config.ARTIFACT_FORMAT == "parquet":
+        try:
+            saved_filepath = save_dataframe_to_parquet(
+                df, filepath, index,
+                codec=get_artifact_codec(artifact, "parquet"),
+                artifact=artifact)
+        except ImportError as e:
+            logger.warning(f"Parquet support unavailable ({e}),"
+                           " saving artifact as ZIP instead.")
+            saved_filepath = save_dataframe_to_zip(
+                df, filepath, index,
+                codec=get_artifact_codec(artifact, "zip"))
+    else:
+        saved_filepath = save_dataframe_to_zip(
+            df, filepath, index, codec=get_artifact_codec(artifact, "zip"))
+    _remove_other_artifact_versions(saved_filepath)
+    if artifact is not None:
+        from data.memory_report import (build_memory_report,
+                                        write_memory_report)
+        write_memory_report(build_memory_report(artifact, built_df, df),
+                            saved_filepath)
+    if inputs is not None:
+        from data.artifact_manifest import record_artifact
+        record_artifact(saved_filepath, inputs, len(df))
+    return saved_filepath
+
+
+def read_artifact(artifact, filepath, columns=None):
+    """
+    Read an artifact using the dtypes, date columns and index registered
+    for it in data.schema_registry, then validate it against the schema.
+    Artifacts without a registered schema are read with their first
+    column as the index. When columns are given only those columns are
+    read, which with a parquet artifact skips the other column chunks.
+    A CSV that cannot be parsed is removed from the artifact manifest, so
+    it is rebuilt, and None is returned.
+    """
+    try:
+        if artifact not in schema_registry.ARTIFACT_SCHEMAS:
+            return _read_artifact(filepath, columns, index_col=0)
+        loaddata_df = _read_artifact(
+            filepath, columns,
+            **schema_registry.get_read_csv_kwargs(artifact, columns))
+    except pd.errors.ParserError as e:
+        from data.artifact_manifest import forget_artifact
+        logger.error(f"Could not parse {filepath}, marking it stale: {e}")
+        forget_artifact(filepath)
+        return None
+    loaddata_df = schema_registry.coerce_to_schema(loaddata_df, artifact)
+    schema_registry.validate_dataframe(loaddata_df, artifact, columns)
+    return loaddata_df
+
+
+def read_artifact_chunks(artifact, filepath, chunksize=None, columns=None):
+    """
+    Read an artifact in blocks of chunksize rows, so only one block is
+    held in memory. Each block is cast to the registered schema. columns
+    limits the columns read (columns the artifact does not have are
+    skipped), except from the source store.
+    """
+    chunksize = chunksize or config.INGEST_CHUNKSIZE
+    from data import source_store
+    if artifact == "source" and source_store.store_exists(filepath):
+        # a partition holds about a year of records, read one at a time
+        yield from source_store.iter_store_chunks(filepath)
+        return
+    resolved_path = resolve_artifact_path(filepath) or filepath
+    if resolved_path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(resolved_path)
+        if columns is not None:
+            available = parquet_file.schema_arrow.names
+            columns = [name for name in columns if name in available]
+        for batch in parquet_file.iter_batches(batch_size=chunksize,
+                                               columns=columns):
+            chunk_df = batch.to_pandas()
+            yield schema_registry.coerce_to_schema(chunk_df, artifact)
+        return
+    read_kwargs = schema_registry.get_read_csv_kwargs(artifact, columns)
+    # low_memory has no effect once the file is read in chunks
+    read_kwargs.pop("low_memory", None)
+    with pd.read_csv(_read_csv_from_zip_or_csv(resolved_path),
+                     chunksize=chunksize, **read_kwargs) as reader:
+        for chunk_df in reader:
+            if columns is not None:
+                chunk_df = chunk_df[[name for name in chunk_df.columns
+                                     if name in columns]]
+            yield schema_registry.coerce_to_schema(chunk_df, artifact)
+
+
+class StreamingArtifactWriter:
+    """
+    Write an artifact one block of rows at a time in the format set by
+    config.ARTIFACT_FORMAT. Parquet blocks are written as row groups and
+    CSV blocks are appended to the member of the ZIP file. Rows go to a
+    temporary file which replaces the artifact when the writer is closed,
+    so a failed import leaves the previous artifact in place.
+
+    Usage:
+        with StreamingArtifactWriter(path, artifact="cleaned_donations") as w:
+            for chunk_df in chunks:
+                w.append(chunk_df)
+    """
+
+    def __init__(self, filepath, artifact=None, index=True,
+                 artifact_format=None):
+        self.artifact = artifact
+        self.index = index
+        self.artifact_format = artifact_format or config.ARTIFACT_FORMAT
+        if self.artifact_format == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError as e:
+                logger.warning(f"Parquet support unavailable ({e}),"
+                               " streaming artifact as ZIP instead.")
+                self.artifact_format = "zip"
+        extension = ".parquet" if self.artifact_format == "parquet" else ".zip"
+        self.filepath = _resolve_output_path(filepath, extension)
+        self.tmp_filepath = _temporary_path(self.filepath)
+        self.codec = get_artifact_codec(artifact, self.artifact_format)
+        self.rows_written = 0
+        self.bytes_written = 0
+        self._header_written = False
+        self._started = time.monotonic()
+        self._parquet_writer = None
+        self._arrow_schema = None
+        self._zip_file = None
+        self._zip_member = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def _arrow_schema_for(self, table):
+        """
+        Fix the parquet schema from the first block, taking the types of
+        registered columns from the schema registry so a column that is
+        empty in the first block keeps its type in later blocks.
+        """
+        import pyarrow as pa
+        arrow_types = {"string": pa.string(), "float": pa.float64(),
+                       "float32": pa.float32(), "int": pa.int64(),
+                       "int8": pa.int8(), "int16": pa.int16(),
+                       "int32": pa.int32(), "nullable_int": pa.int64(),
+                       "nullable_int32": pa.int32(),
+                       "datetime": pa.timestamp("ns")}
+        columns = (schema_registry.get_schema(self.artifact)["columns"]
+                   if self.artifact else {})
+        fields = []
+        for field in table.schema:
+            if field.name in columns:
+                arrow_type = arrow_types[columns[field.name]["type"]]
+                if (pa.types.is_timestamp(arrow_type)
+                        and pa.types.is_timestamp(field.type)):
+                    # keep the unit of the frame, as a frame saved whole
+                    arrow_type = field.type
+                field = field.with_type(arrow_type)
+            elif pa.types.is_null(field.type):
+                field = field.with_type(pa.string())
+            fields.append(field)
+        return pa.schema(fields, metadata=table.schema.metadata)
+
+    def _append_parquet(self, df):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        # Categories differ between blocks, so they are stored as strings
+        # and restored by the schema registry when the artifact is read
+        for col in df.columns:
+            if isinstance(df[col].dtype, pd.CategoricalDtype):
+                df[col] = df[col].astype("object")
+        df = _prepare_for_parquet(df, self.artifact)
+        if self._parquet_writer is None:
+            table = pa.Table.from_pandas(df, preserve_index=self.index)
+            self._arrow_schema = self._arrow_schema_for(table)
+            table = table.cast(self._arrow_schema)
+            self._parquet_writer = pq.ParquetWriter(
+                self.tmp_filepath, self._arrow_schema,
+                compression=self.codec)
+        else:
+            table = pa.Table.from_pandas(df, schema=self._arrow_schema,
+                                         preserve_index=self.index)
+        self._parquet_writer.write_table(table)
+        self.bytes_written += table.nbytes
+
+    def _append_zip(self, df):
+        if self._zip_file is None:
+            csv_filename = os.path.basename(self.filepath).replace(".zip",
+                                                                   ".csv")
+            compression, compresslevel = ZIP_CODECS[self.codec]
+            self._zip_file = zipfile.ZipFile(self.tmp_filepath, "w",
+                                             compression,
+                                             compresslevel=compresslevel)
+            self._zip_member = self._zip_file.open(csv_filename, "w",
+                                                   force_zip64=True)
+        # an empty first block still writes the header
+        block = df.to_csv(index=self.index,
+                          header=not self._header_written,
+                          lineterminator=ZIP_LINE_TERMINATOR).encode("utf-8")
+        self._zip_member.write(block)
+        self._header_written = True
+        self.bytes_written += len(block)
+
+    def append(self, df):
+        """Write one block of rows to the artifact"""
+        if self.artifact is not None:
+            df = schema_registry.coerce_to_schema(df.copy(), self.artifact)
+        if self.artifact_format == "parquet":
+            self._append_parquet(df)
+        else:
+            self._append_zip(df)
+        self.rows_written += len(df)
+
+    def _close_handles(self):
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+        if self._zip_member is not None:
+            self._zip_member.close()
+            self._zip_member = None
+        if self._zip_file is not None:
+            self._zip_file.close()
+            self._zip_file = None
+
+    def close(self):
+        """Finish the artifact and move it into place, returning its path"""
+        self._close_handles()
+        if not os.path.exists(self.tmp_filepath):
+            logger.warning(f"No rows written to {self.filepath}")
+            return None
+        os.replace(self.tmp_filepath, self.filepath)
+        _remove_other_artifact_versions(self.filepath)
+        logger.info(f"Streamed {self.rows_written} rows to {self.filepath}")
+        _log_write_rate(self.filepath, self.bytes_written, self._started,
+                        self.codec)
+        return self.filepath
+
+    def abort(self):
+        """Discard the partly written artifact"""
+        self._close_handles()
+        if os.path.exists(self.tmp_filepath):
+            os.remove(self.tmp_filepath)
+        logger.warning(f"Streaming write to {self.filepath} abandoned")
+
+
+def load_source_data(originaldatafilepath):
+    from data import source_store
+    if source_store.store_exists(originaldatafilepath):
+        return source_store.read_store(originaldatafilepath)
+    return read_artifact("source", originaldatafilepath)
 
 
 def load_improved_raw_data(originaldatafilepath):
-    loaddata_df = pd.read_csv(
-        _read_csv_from_zip_or_csv(originaldatafilepath),
-        dtype={
-            "ECRef": "object",
-            "RegulatedEntityName": "object",
-            "RegulatedEntityType": "object",
-            "Value": "float64",
-            "AcceptedDate": "object",
-            "AccountingUnitName": "object",
-            "DonorName": "object",
-            "AccountingUnitsAsCentralParty": "object",
-            "IsSponsorship": "object",
-            "DonorStatus": "object",
-            "RegulatedDoneeType": "object",
-            "CompanyRegistrationNumber": "object",
-            "Postcode": "object",
-            "DonationType": "object",
-            "NatureOfDonation": "object",
-            "PurposeOfVisit": "object",
-            "DonationAction": "object",
-            "ReceivedDate": "object",
-            "ReportedDate": "object",
-            "IsReportedPrePoll": "object",
-            "ReportingPeriodName": "object",
-            "IsBequest": "object",
-            "IsAggregation": "object",
-            "RegulatedEntityId": "int64",
-            "AccountingUnitId": "object",
-            "DonorId": "int64",
-            "CampaigningName": "object",
-            "RegisterName": "object",
-            "IsIrishSource": "object",
-        },
-        index_col=0,
-    )
-    return normalize_string_columns_for_streamlit(loaddata_df)
+    return read_artifact("improved_raw", originaldatafilepath)
 
 
 def load_cleaned_donations(originaldatafilepath):
-    loaddata_df = pd.read_csv(
-        _read_csv_from_zip_or_csv(originaldatafilepath),
-        engine='python',
-        dtype={
-            "ECRef": "object",
-            "OriginalRegulatedEntityName": "object",
-            "RegulatedEntityName": "object",
-            "RegulatedEntityType": "object",
-            "Value": "float64",
-            "AcceptedDate": "object",
-            "AccountingUnitName": "object",
-            "OriginalDonorName": "object",
-            "AccountingUnitsAsCentralParty": "object",
-            "IsSponsorship": "object",
-            "DonorStatus": "object",
-            "RegulatedDoneeType": "object",
-            "CompanyRegistrationNumber": "object",
-            "Postcode": "object",
-            "DonationType": "object",
-            "NatureOfDonation": "object",
-            "PurposeOfVisit": "object",
-            "DonationAction": "object",
-            "ReceivedDate": "object",
-            "ReportedDate": "object",
-            "IsReportedPrePoll": "object",
-            "ReportingPeriodName": "object",
-            "IsBequest": "object",
-            "IsAggregation": "object",
-            "OriginalRegulatedEntityId": "Int64",
-            "AccountingUnitId": "object",
-            "OriginalDonorId": "Int64",
-            "CampaigningName": "object",
-            "RegisterName": "object",
-            "IsIrishSource": "object",
-            "CleanedRegulatedEntityName": "object",
-            "CleanedRegulatedEntityId": "Int64",
-            "RegulatedEntityId": "Int64",
-            "CleanedDonorName": "object",
-            "CleanedDonorId": "Int64",
-            "DonorId": "Int64",
-            "DonorName": "object",
-        },
-        index_col=0,)
-
-    return normalize_string_columns_for_streamlit(loaddata_df)
-
-
-def load_cleaned_data(originaldatafilepath):
-    loaddata_df = pd.read_csv(
-        _read_csv_from_zip_or_csv(originaldatafilepath),
-        engine='python',
-        dtype={
-            "ECRef": "object",
-            "OriginalRegulatedEntityName": "object",
-            "RegulatedEntityType": "object",
-            "Value": "float64",
-            "OriginalDonorName": "object",
-            "IsSponsorship": "object",
-            "DonorStatus": "object",
-            "RegulatedDoneeType": "object",
-            "DonationType": "object",
-            "NatureOfDonation": "object",
-            "PurposeOfVisit": "object",
-            "DonationAction": "object",
-            "ReportingPeriodName": "object",
-            "IsBequest": "object",
-            "IsAggregation": "object",
-            "OriginalRegulatedEntityId": "int64",
-            "OriginalDonorId": "int64",
-            "CampaigningName": "object",
-            "RegisterName": "object",
-            "CleanedRegulatedEntityName": "object",
-            "CleanedRegulatedEntityId": "int64",
-            "RegulatedEntityId": "int64",
-            "RegulatedEntityName": "object",
-            "CleanedDonorName": "object",
-            "CleanedDonorId": "int64",
-            "DonorId": "int64",
-            "DonorName": "object",
-            "EventCount": "int64",
-            "YearReceived": "int64",
-            "MonthReceived": "int64",
-            "YearMonthReceived": "int64",
-            "PartyName": "object",
-            "PartyId": "int64",
-            "DubiousDonor": "int64",
-            "DubiousData": "int64",
-            "RegEntity_Group": "object",
-            "DonationTypeInt": "int64",
-            "RegulatedEntityNameInt": "int64",
-            "DonorNameInt": "int64",
-            "DonationActionInt": "int64",
-            "DonorStatusInt": "int64",
-            "PurposeOfVisitInt": "int64",
-            "RegulatedDoneeTypeInt": "int64",
-            "IsBequestInt": "int64",
-            "IsAggregationInt": "int64",
-            "IsSponsorshipInt": "int64",
-            "NatureOfDonationInt": "int64",
-            "RegisterNameInt": "int64",
-            "PublicFundsInt": "int64",
-            "DaysTillNextElection": "int64",
-            "DaysSinceLastElection": "int64",
-            "WksTillNextElection": "int64",
-            "WksSinceLastElection": "int64",
-            "QtrsTillNextElection": "int64",
-            "QtrsSinceLastElection": "int64",
-            "YrsTillNextElection": "int64",
-            "YrsSinceLastElection": "int64",
-            "parliamentary_sitting": "int64",
-        },
-        parse_dates=["ReceivedDate"],
-        index_col=0,)
-
-    return normalize_string_columns_for_streamlit(loaddata_df)
+    return read_artifact("cleaned_donations", originaldatafilepath)
+
+
+def load_cleaned_data(originaldatafilepath, columns=None):
+    return read_artifact("cleaned_data", originaldatafilepath, columns)
 
 
 def load_donor_list(originaldatafilepath):
-    loaddata_df = pd.read_csv(
-        _read_csv_from_zip_or_csv(originaldatafilepath),
-        dtype={
-            "DonorId": "int64",
-            "DonorName": "object",
-            "DonorType": "object",
-            "CompanyRegistrationNumber": "object",
-            "Address": "object",
-            "Postcode": "object",
-            "Country": "object",
-            "IsIrishSource": "string",
-        },
-        index_col="DonorId",
-    )
+    return read_artifact("cleaned_donorlist", originaldatafilepath)
+
 
-    return normalize_string_columns_for_streamlit(loaddata_df)
+def load_regentity_list(originaldatafilepath):
+    return read_artifact("cleaned_regentity", originaldatafilepath)
@@ -1,16 +1,46 @@
+import contextvars
+import datetime as dt
+import functools
+import os
+from concurrent.futures import (ThreadPoolExecutor, FIRST_COMPLETED,
+                                wait)
 import streamlit as st
-from data.datasetupandclean import load_raw_data
+from data.datasetupandclean import load_raw_data, stream_raw_data
 from data.clean_and_enhance import load_cleaned_data
 from data.load_donor_regent_lists import (load_donorList_data,
                                           load_regulated_entity_data
                                           )
+from data.shared_dataset import (SHARED_FRAMES,
+                                 shared_dataset_enabled,
+                                 shared_frame_path,
+                                 make_handle,
+                                 publish_frame,
+                                 session_frame_rows,
+                                 _published_file_is_current,
+                                 )
+from data.build_coordinator import (BuildLockTimeout, build_lock,
+                                    build_in_progress)
+from data.star_schema import DIMENSIONS
+from data.snapshots import (SNAPSHOT_FRAMES,
+                            current_version,
+                            load_snapshot_manifest,
+                            pin_version,
+                            pinned_version,
+                            publish_snapshot,
+                            snapshot_frame_path,
+                            snapshot_is_current,
+                            snapshot_shared_path,
+                            )
+from data.analytics_store import (analytics_store_enabled,
+                                  ensure_analytics_store)
+from data.out_of_core import out_of_core_enabled, partition_rows
+import config
 from utils.logger import log_function_call, logger
+from utils.pipeline_state import pipeline_state
 
 
-@log_function_call
-@st.cache_data
-def get_raw_data():
-    return load_raw_data(
+def build_raw_data():
+    raw_data = load_raw_data(
         main_file="raw_data",
         cleaned_file="raw_data_clean",
         output_csv=True,
@@ -18,13 +48,16 @@ def get_raw_data():
         dedupe_regentity=True,
         originaldatafilepath="source_data_fname",
         processeddatafilepath="imported_raw_fname")
+    if isinstance(raw_data, str):
+        # streamed to the cleaned donations artifact, which data_clean
+        # is built from
+        from data.data_file_defs import load_cleaned_donations
+        return load_cleaned_donations(raw_data)
+    return raw_data
 
 
-@log_function_call
-@st.cache_data
-def get_cleaned_data():
-    from data.data_file_defs import normalize_string_columns_for_streamlit
-    cleaned_df = load_cleaned_data(
+def build_cleaned_data():
+    return load_cleaned_data(
         originaldatafilepath="cleaned_donations_fname",
         processeddatafilepath="cleaned_data_fname",
         datafile="raw_data",
@@ -32,12 +65,9 @@ def get_cleaned_data():
         output_csv=True,
         main_file="raw_data",
         cleaned_file="data_clean")
-    return normalize_string_columns_for_streamlit(cleaned_df)
 
 
-@log_function_call
-@st.cache_data
-def get_donor_data():
+def build_donor_data():
     return load_donorList_data(
         main_file="data_clean",
         cleaned_file="data_donor",
@@ -47,9 +77,7 @@ def get_donor_data():
         cleaneddatafilepath="cleaned_donorlist_fname")
 
 
-@log_function_call
-@st.cache_data
-def get_regentity_data():
+def build_regentity_data():
     return load_regulated_entity_data(
         main_file="data_clean",
         cleaned_file="data_regentity",
@@ -60,64 +88,632 @@ def get_regentity_data():
         )
 
 
+def stale_stage(stages):
+    """
+    The first of the (artifact session key, input session keys) stages
+    whose artifact the manifest shows is out of date, None if all are
+    current. Only file hashes are checked, no frame is read.
+    """
+    from data.artifact_manifest import is_artifact_stale
+    from data.raw_data_clean import dedupe_map_inputs
+    for artifact_fname, input_fnames in stages:
+        inputs = [pipeline_state().get(fname) for fname in input_fnames]
+        if artifact_fname == "cleaned_donations_fname":
+            inputs += dedupe_map_inputs(dedupe_donors=True,
+                                        dedupe_regentity=True)
+        if is_artifact_stale(pipeline_state().get(artifact_fname), inputs):
+            return artifact_fname
+    return None
+
+
+def cleaned_donations_are_current():
+    """True if the manifest shows the cleaned donations are up to date"""
+    return stale_stage(STAGES["raw_data"]["outputs"]) is None
+
+
+def cleaned_data_is_current():
+    """
+    True if the manifest shows cleaned_data, its dimension tables and the
+    artifacts they are built from are all up to date. Only file hashes are checked, no frame is
+    read. The inputs are those recorded by load_raw_data,
+    raw_data_cleanup and clean_and_enhance.load_cleaned_data.
+    """
+    return stale_stage(STAGES["raw_data"]["outputs"]
+                       + STAGES["data_clean"]["outputs"]) is None
+
+
+def prepare_raw_artifacts():
+    """
+    Out-of-core mode: bring the cleaned donations artifact up to date
+    without holding the raw data or the cleaned donations in memory. The
+    source file is streamed through the raw cleanup (stream_raw_data) in
+    partitions, whatever STREAMING_INGEST is set to, and load_cleaned_data
+    reads the result partition by partition. Returns its row count, None
+    if it could not be built.
+    """
+    from data.artifact_manifest import get_manifest_entry
+    if not cleaned_donations_are_current():
+        cleaned_filepath = stream_raw_data(
+            originaldatafilepath=pipeline_state().get("source_data_fname"),
+            processeddatafilepath=pipeline_state().get("imported_raw_fname"),
+            output_csv=True,
+            dedupe_donors=True,
+            dedupe_regentity=True,
+            chunksize=partition_rows())
+        if cleaned_filepath is None:
+            # fuzzy deduplication needs the whole file
+            logger.warning("Streaming import unavailable, the raw data is"
+                           " loaded whole for the out-of-core build.")
+            raw_df = get_raw_data()
+            pipeline_state().pop("raw_data", None)
+            if raw_df is None:
+                return None
+            del raw_df
+    entry = get_manifest_entry(pipeline_state().get("cleaned_donations_fname"))
+    return entry and entry["rows"]
+
+
+def prepare_cleaned_artifacts():
+    """
+    Out-of-core mode: bring cleaned_data and its dimension tables up to
+    date without holding cleaned_data in memory. load_cleaned_data builds
+    them partition by partition, only when the manifest shows they are
+    out of date. Returns the row count of cleaned_data, None if it could
+    not be built.
+    """
+    from data.artifact_manifest import get_manifest_entry
+    if not stage_is_current("data_clean") and get_cleaned_data() is None:
+        return None
+    entry = get_manifest_entry(pipeline_state().get("cleaned_data_fname"))
+    return entry and entry["rows"]
+
+
+def load_current_cleaned_data():
+    """
+    Fast startup: load cleaned_data straight from its artifact, without
+    raw_data or cleaned_donations, once cleaned_data_is_current has
+    confirmed it. The frame is checked against the row counts recorded
+    in the manifest for it and for the cleaned donations it was built
+    from. Returns None if either check fails.
+    """
+    from data.artifact_manifest import get_manifest_entry
+    from data.data_utils import importfile
+    cleaned_fname = pipeline_state().get("cleaned_data_fname")
+    entry = get_manifest_entry(cleaned_fname)
+    donations_entry = get_manifest_entry(
+        pipeline_state().get("cleaned_donations_fname"))
+    cleaned_df = importfile("cleaned_data", cleaned_fname)
+    if cleaned_df is None:
+        return None
+    if len(cleaned_df) != entry["rows"]:
+        logger.warning(f"cleaned_data has {len(cleaned_df)} rows, the"
+                       f" manifest records {entry['rows']}.")
+        return None
+    if donations_entry is None or donations_entry["rows"] != entry["rows"]:
+        logger.warning("cleaned_data rows do not match the cleaned"
+                       " donations it was built from.")
+        return None
+    logger.info(f"Fast startup: cleaned_data loaded from {entry['path']},"
+                f" {entry['rows']} rows")
+    return cleaned_df
+
+
+def build_dimension_data(key):
+    """Dimension tables are saved by load_cleaned_data and read back"""
+    from data.data_utils import importfile
+    return importfile(DIMENSIONS[key]["artifact"],
+                      pipeline_state().get(DIMENSIONS[key]["fname"]))
+
+
+FRAME_BUILDERS = {
+    "raw_data": build_raw_data,
+    "data_clean": build_cleaned_data,
+    "data_donor": build_donor_data,
+    "data_regentity": build_regentity_data,
+    **{key: functools.partial(build_dimension_data, key)
+       for key in DIMENSIONS},
+}
+
+# The inputs the cleaned data and its dimension tables are recorded as
+# built from by clean_and_enhance.load_cleaned_data
+CLEANED_DATA_INPUTS = ["cleaned_donations_fname", "regentity_map_fname",
+                       "ELECTION_DATES"]
+
+# The build stages, one per frame. inputs are the frames a stage is built
+# from and outputs the (artifact session key, input session keys) of the
+# artifacts it writes, as recorded in the manifest. A stage starts as soon
+# as its inputs have loaded, so independent stages (the dimension tables,
+# then the donor and regulated entity lists) run at the same time.
+STAGES = {
+    "raw_data": {
+        "inputs": [],
+        "outputs": [("imported_raw_fname", ["source_data_fname"]),
+                    ("cleaned_donations_fname", ["imported_raw_fname"])],
+    },
+    "data_clean": {
+        "inputs": ["raw_data"],
+        "outputs": [("cleaned_data_fname", CLEANED_DATA_INPUTS)]
+                   + [(dim["fname"], CLEANED_DATA_INPUTS)
+                      for dim in DIMENSIONS.values()],
+    },
+    "data_donor": {
+        "inputs": ["data_clean", "dim_donor"],
+        "outputs": [("cleaned_donorlist_fname", ["cleaned_data_fname"])],
+    },
+    "data_regentity": {
+        "inputs": ["data_clean", "dim_regentity"],
+        "outputs": [("cleaned_regentity_fname", ["cleaned_data_fname"])],
+    },
+    # written by the data_clean stage and read back
+    **{key: {"inputs": ["data_clean"], "outputs": []} for key in DIMENSIONS},
+}
+
+# Frames the pages read, published in each snapshot; raw_data is only
+# needed to build data_clean
+PAGE_FRAMES = SNAPSHOT_FRAMES
+
+
+# The get_ functions below build the frames from the artifacts. They run
+# only under the build lock, when the current snapshot is out of date, so
+# are not cached: sessions read their frames from the snapshot they pinned
+# (get_snapshot_frame, get_snapshot_handle), cached by its version id.
 @log_function_call
-def firstload():
-    from data.data_file_defs import normalize_string_columns_for_streamlit
-    def load_data_to_session(key, loader_function):
-        if key not in st.session_state:
-            st.session_state[key] = loader_function()
-            return key
-        else:
-            return key
+def get_raw_data():
+    return build_raw_data()
 
-    # Load and cache data correctly
-    load_data_to_session("raw_data", get_raw_data)
-    if "raw_data" in st.session_state and st.session_state.raw_data is not None:
-        st.session_state.raw_data = normalize_string_columns_for_streamlit(
-            st.session_state.raw_data
-        )
-    if "raw_data" not in st.session_state:
-        logger.info("raw_data not in session state.")
+
+@log_function_call
+def get_cleaned_data():
+    return build_cleaned_data()
+
+
+@log_function_call
+@st.cache_data
+def get_current_cleaned_data(output_hash):
+    """output_hash, the artifact's content hash, keys the cache"""
+    return load_current_cleaned_data()
+
+
+@log_function_call
+def get_donor_data():
+    return build_donor_data()
+
+
+@log_function_call
+def get_regentity_data():
+    return build_regentity_data()
+
+
+@log_function_call
+@st.cache_data
+def get_dimension_data(key, output_hash):
+    """output_hash, the artifact's content hash, keys the cache"""
+    return build_dimension_data(key)
+
+
+@log_function_call
+def get_shared_handle(key, fast_startup=False):
+    """
+    Build a frame and publish it to the shared dataset, returning the
+    handle that sessions hold instead of the frame. With fast_startup
+    data_clean is loaded directly from its artifact.
+    """
+    if fast_startup:
+        # another process may already have published the current frame
+        path = shared_frame_path(key)
+        if _published_file_is_current(key, path):
+            from data.artifact_manifest import get_manifest_entry
+            entry = get_manifest_entry(pipeline_state().cleaned_data_fname)
+            logger.info(f"Fast startup: using published {key} at {path}")
+            return make_handle(key, path, entry["rows"])
+        loaddata_df = load_current_cleaned_data()
     else:
-        logger.debug("st.session_state.raw_data:"
-                     f" {len(st.session_state.raw_data)}")
-    load_data_to_session("data_clean", get_cleaned_data)
-    if "data_clean" in st.session_state and st.session_state.data_clean is not None:
-        st.session_state.data_clean = normalize_string_columns_for_streamlit(
-            st.session_state.data_clean
-        )
-    if "data_clean" not in st.session_state:
-        logger.info("data_clean not in session state.")
+        loaddata_df = FRAME_BUILDERS[key]()
+    if loaddata_df is None:
+        logger.error(f"{key} could not be built for the shared dataset.")
+        return None
+    return publish_frame(key, loaddata_df)
+
+
+@log_function_call
+@st.cache_data
+def get_snapshot_frame(key, version):
+    """A frame of a snapshot; the version id keys the cache"""
+    from data.data_utils import importfile
+    return importfile(SHARED_FRAMES[key][0], snapshot_frame_path(version, key))
+
+
+@log_function_call
+@st.cache_resource
+def get_snapshot_handle(key, version):
+    """
+    Handle to the shared copy of a frame of a snapshot, published once in
+    the snapshot directory; the version id keys the cache
+    """
+    path = snapshot_shared_path(version, key)
+    if os.path.exists(path):
+        rows = load_snapshot_manifest(version)["frames"][key]["rows"]
+        return make_handle(key, path, rows)
+    loaddata_df = get_snapshot_frame(key, version)
+    if loaddata_df is None:
+        logger.error(f"{key} could not be read from snapshot {version}.")
+        return None
+    return publish_frame(key, loaddata_df, path=path)
+
+
+def load_snapshot_frames(version, shared):
+    """
+    Put the frames of a snapshot that session state does not hold yet in
+    session state, at the same time. Returns True if all of them loaded.
+    """
+
+    def load_snapshot_to_session(key):
+        if key not in pipeline_state():
+            if shared:
+                pipeline_state()[key] = get_snapshot_handle(key, version)
+            else:
+                pipeline_state()[key] = get_snapshot_frame(key, version)
+        rows = session_frame_rows(key)
+        if rows is None:
+            logger.error(f"{key} not loaded from snapshot {version}.")
+            pipeline_state().pop(key, None)
+        return rows
+
+    results = load_frames_concurrently(
+        {key: functools.partial(load_snapshot_to_session, key)
+         for key in SNAPSHOT_FRAMES})
+    return all(rows is not None for rows in results.values())
+
+
+@log_function_call
+def serve_previous_frames(shared):
+    """
+    Put the previous version of every frame in session state without
+    checking or rebuilding the artifacts, used while another session is
+    building. The session is pinned to the current snapshot if there is
+    one. Returns False, leaving session state unchanged, if any previous
+    version is missing.
+    """
+    from data.data_file_defs import read_artifact, resolve_artifact_path
+    version = pinned_version() or current_version()
+    if version is not None:
+        pin_version(version)
+        return load_snapshot_frames(version, shared)
+    previous = {}
+    for key in PAGE_FRAMES:
+        artifact, fname_key = SHARED_FRAMES[key]
+        if shared and os.path.exists(shared_frame_path(key)):
+            previous[key] = make_handle(key, shared_frame_path(key))
+        elif resolve_artifact_path(pipeline_state().get(fname_key)):
+            previous[key] = read_artifact(artifact,
+                                          pipeline_state().get(fname_key))
+        else:
+            logger.info(f"No previous version of {key} to serve.")
+            return False
+    for key, value in previous.items():
+        pipeline_state()[key] = value
+    return True
+
+
+def _attach_script_context():
+    """
+    Let worker threads use the session's st.session_state and
+    caches, as the script thread does
+    """
+    try:
+        from streamlit.runtime.scriptrunner import (add_script_run_ctx,
+                                                    get_script_run_ctx)
+    except ImportError:
+        return lambda: None
+    ctx = get_script_run_ctx()
+    return lambda: add_script_run_ctx(ctx=ctx)
+
+
+@log_function_call
+def load_frames_concurrently(loaders, max_workers=None, timings=None):
+    """
+    Load the frames in loaders, a dict of frame key to a function loading
+    it, in dependency order (the inputs of STAGES). Each frame is started
+    as soon as the frames it is built from have loaded, so independent
+    frames load at the same time. Returns a dict of frame key to the
+    loader's result, None for frames not loaded because an input failed.
+    The seconds each loader took are added to timings if given.
+
+    The loaders run on threads, not processes: they put frames and shared
+    frame handles in the session's pipeline_state(), which a worker
+    process cannot reach. The stages that can overlap (the dimension
+    tables, then the donor and regulated entity lists) are short
+    groupbys and reads once data_clean is built, while a spawned process
+    takes longer than all of them just to import the pipeline. The
+    CPU-bound fuzzy dedupe runs on its own process pool
+    (data_dedupe.dedupe_entities).
+    """
+    max_workers = max_workers or config.FIRSTLOAD_WORKERS
+    results = {}
+    pending = dict(loaders)
+    running = {}
+    timings = {} if timings is None else timings
+    with ThreadPoolExecutor(max_workers=max_workers,
+                            thread_name_prefix="firstload") as executor:
+        attach = _attach_script_context()
+
+        def run(key, loader_function):
+            attach()
+            return loader_function()
+
+        while pending or running:
+            for key in list(pending):
+                inputs = [dep for dep in
+                          STAGES.get(key, {}).get("inputs", [])
+                          if dep in loaders]
+                if any(dep in results and results[dep] is None
+                       for dep in inputs):
+                    logger.warning(f"{key} not loaded, an input failed.")
+                    results[key] = None
+                    del pending[key]
+                elif all(dep in results for dep in inputs):
+                    # each loader in a copy of this context, so it runs
+                    # in the same pipeline_state()
+                    running[executor.submit(
+                        contextvars.copy_context().run, run, key,
+                        pending.pop(key))] = (key, dt.datetime.now())
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, started = running.pop(future)
+                results[key] = future.result()
+                timings[key] = (dt.datetime.now() - started).total_seconds()
+                logger.info(f"{key} loaded in {timings[key]:.2f}s"
+                            f" ({len(results)}/{len(loaders)})")
+    return results
+
+
+def stage_is_current(key):
+    """True if the manifest shows every artifact the stage writes is current"""
+    return stale_stage(STAGES[key]["outputs"]) is None
+
+
+def stages_to_run(keys):
+    """
+    The stages to run to put the frames in keys in session state: each
+    frame not there yet and the stages it is built from. Stages whose
+    frames are only read to build frames already loaded are skipped, as
+    raw_data is once fast startup has loaded data_clean.
+    """
+    needed = []
+    pending = [key for key in keys if key not in pipeline_state()]
+    while pending:
+        key = pending.pop()
+        if key not in needed:
+            needed.append(key)
+            pending += [dep for dep in STAGES[key]["inputs"]
+                        if dep not in pipeline_state()]
+    return [key for key in STAGES if key in needed]
+
+
+def stage_report(statuses, timings, elapsed):
+    """
+    Report of a build: each stage's status (built, cached when its
+    artifacts were current and only read back, loaded for the dimension
+    tables data_clean writes, skipped or failed) and seconds, the wall time of the build, the sum of the stage times and
+    the critical path, the longest chain of stages run one after another
+    """
+    finished = {}
+    for key in STAGES:
+        if key in timings:
+            finished[key] = timings[key] + max(
+                [finished.get(dep, 0) for dep in STAGES[key]["inputs"]],
+                default=0)
+    report = {
+        "stages": {key: {"status": status, "seconds": timings.get(key)}
+                   for key, status in statuses.items()},
+        "elapsed": elapsed,
+        "stage_total": sum(timings.values()),
+        "critical_path": max(finished.values(), default=0),
+    }
+    for key, stage in report["stages"].items():
+        seconds = ("" if stage["seconds"] is None
+                   else f" in {stage['seconds']:.2f}s")
+        logger.info(f"Stage {key}: {stage['status']}{seconds}")
+    logger.info(f"Build took {elapsed:.2f}s, critical path"
+                f" {report['critical_path']:.2f}s, stages"
+                f" {report['stage_total']:.2f}s in total")
+    return report
+
+
+def load_dimension(key):
+    from data.artifact_manifest import get_manifest_entry
+    entry = get_manifest_entry(
+        pipeline_state().get(DIMENSIONS[key]["fname"]))
+    return get_dimension_data(key, entry and entry["output_hash"])
+
+
+def load_data_to_session(key, loader_function, shared, fast_startup=False):
+    """
+    Put a frame in session state, a handle to its shared copy if shared,
+    and return its rows, None if it did not load
+    """
+    if key not in pipeline_state():
+        if shared:
+            pipeline_state()[key] = get_shared_handle(key, fast_startup)
+        else:
+            pipeline_state()[key] = loader_function()
+    rows = session_frame_rows(key)
+    if rows is None:
+        logger.info(f"{key} not in session state.")
+        pipeline_state().pop(key, None)
     else:
-        logger.debug("st.session_state.raw_data:"
-                    f" {len(st.session_state.data_clean)}")
+        logger.debug(f"pipeline_state().{key}: {rows}")
+    return rows
+
+
+@log_function_call
+def firstload():
+    # A session keeps reading the snapshot it pinned when it first loaded,
+    # whatever has been built since
+    if pinned_version() is not None and all(
+            key in pipeline_state() for key in PAGE_FRAMES):
+        return
+    # With the shared dataset each session holds a handle to a frame shared
+    # by all sessions and processes, otherwise its own copy of the frame
+    shared = shared_dataset_enabled()
+
+    # When the artifacts are built offline (python -m data.build) the app
+    # only reads the current snapshot
+    if not config.BUILD_COORDINATION["app_builds"]:
+        version = current_version()
+        if version is None:
+            logger.error("No snapshot built, run python -m data.build.")
+            st.error("The data has not been built yet. Please check logs.")
+            return
+        load_snapshot_frames(pin_version(version), shared)
+        return
+
+    # While another session rebuilds the artifacts, either show the
+    # previous data or wait for the build to finish
+    if (config.BUILD_COORDINATION["wait_policy"] == "serve_previous"
+            and build_in_progress() and serve_previous_frames(shared)):
+        logger.info("Build in progress, previous data served.")
+        st.info("The data is being refreshed, showing the previous version.")
+        return
+
+    # Only one session at a time checks and rebuilds the artifacts
+    try:
+        with build_lock():
+            version = build_snapshot(shared)
+            if version is None:
+                return
+            # Frames the build did not put in session state are read from
+            # the snapshot the session pins
+            load_snapshot_frames(pin_version(version), shared)
+            # the analytics store is rebuilt if the frames have changed
+            # since it was built
+            if analytics_store_enabled():
+                ensure_analytics_store()
+    except BuildLockTimeout as e:
+        # another session's build is taking too long: show the previous
+        # data if there is any rather than keep waiting
+        logger.warning(f"{e}, serving the previous data.")
+        if serve_previous_frames(shared):
+            st.info("The data is being refreshed, showing the previous"
+                    " version.")
+        else:
+            st.error("The data is being refreshed and is not available"
+                     " yet. Please try again later.")
+
+
+def build_snapshot(shared):
+    """
+    Rebuild the artifacts and publish them as a new snapshot if the
+    current snapshot is out of date. Call while holding build_lock.
+    Returns the current snapshot version, None if none was published.
+    """
+    version = current_version()
+    if version is not None and snapshot_is_current(version):
+        return version
+    build_frames(shared)
+    version = publish_snapshot()
+    if version is None:
+        logger.error("No snapshot published, data not loaded.")
+        return None
+    # shared frames built in output/shared are replaced by the
+    # next build, so the session holds the snapshot's copies
+    if shared:
+        for key in PAGE_FRAMES:
+            pipeline_state().pop(key, None)
+    return version
+
+
+@log_function_call
+def build_artifacts():
+    """
+    Headless build (data.build): bring the artifacts, the current
+    snapshot and the analytics store up to date without serving a page.
+    Returns the current snapshot version, None if the build failed.
+    """
+    shared = shared_dataset_enabled()
+    try:
+        with build_lock():
+            version = build_snapshot(shared)
+            if version is not None and analytics_store_enabled():
+                # the store is built from the frames of the snapshot
+                load_snapshot_frames(pin_version(version), shared)
+                if ensure_analytics_store() is None:
+                    return None
+    except BuildLockTimeout as e:
+        logger.error(f"{e}, another build is still running.")
+        return None
+    return version
+
+
+def build_frames(shared):
+    """
+    Check the artifacts and rebuild those that are out of date, putting
+    each frame in session state as it is built. The stage report
+    (stage_report) is kept in session state as build_report.
+    """
+    started = dt.datetime.now()
+    statuses = {key: "skipped" for key in STAGES}
+    timings = {}
+    load = functools.partial(load_data_to_session, shared=shared)
+    # When cleaned_data is up to date it is loaded on its own, and the
+    # raw data and cleaned donations are never read
+    fast_startup = False
+    if ("data_clean" not in pipeline_state() and not out_of_core_enabled()
+            and cleaned_data_is_current()):
+        from data.artifact_manifest import get_manifest_entry
+        entry = get_manifest_entry(pipeline_state().cleaned_data_fname)
+        load_started = dt.datetime.now()
+        fast_startup = load(
+            "data_clean",
+            lambda: get_current_cleaned_data(entry["output_hash"]),
+            fast_startup=True) is not None
+        if fast_startup:
+            statuses["data_clean"] = "cached"
+            timings["data_clean"] = (
+                dt.datetime.now() - load_started).total_seconds()
+        else:
+            logger.warning("Fast startup failed, rebuilding data.")
+    # Load and cache data correctly; each frame is put in session state
+    # as soon as it has loaded, and frames whose inputs are loaded (the
+    # dimension tables, then the donor and regulated entity lists) load
+    # at the same time
+    loaders = {
+        "raw_data": lambda: load("raw_data", get_raw_data),
+        "data_clean": lambda: load("data_clean", get_cleaned_data),
+        "data_donor": lambda: load("data_donor", get_donor_data),
+        "data_regentity": lambda: load("data_regentity",
+                                       get_regentity_data),
+        **{key: functools.partial(load, key,
+                                  functools.partial(load_dimension, key))
+           for key in DIMENSIONS},
+    }
+    if out_of_core_enabled():
+        # raw_data and data_clean are only built on disk, partition by
+        # partition, and the stages return their row counts: neither is
+        # held in session state or published. The donor and regulated
+        # entity lists are summed from the partitions of cleaned_data.
+        loaders["raw_data"] = prepare_raw_artifacts
+        loaders["data_clean"] = prepare_cleaned_artifacts
+
+    def run_stage(key):
+        # checked as the stage starts, once its inputs have been written;
+        # stages whose artifacts are current only read them back
+        if not STAGES[key]["outputs"]:
+            statuses[key] = "loaded"
+        elif stage_is_current(key):
+            statuses[key] = "cached"
+        else:
+            statuses[key] = "built"
+        return loaders[key]()
+
     # load_data_to_session("data_party_sum", get_party_summary_data)
-    load_data_to_session("data_donor", get_donor_data)
-    if "data_donor" in st.session_state and st.session_state.data_donor is not None:
-        st.session_state.data_donor = normalize_string_columns_for_streamlit(
-            st.session_state.data_donor
-        )
-    if "data_clean" not in st.session_state:
-        logger.info("data_clean not in session state.")
-    else:
-        logger.debug("st.session_state.data_donor:"
-                    f" {len(st.session_state.data_donor)}")
-        logger.debug("st.session_state.data_clean:"
-                    f" {len(st.session_state.data_clean)}")
-    load_data_to_session("data_regentity", get_regentity_data)
-    if (
-        "data_regentity" in st.session_state
-        and st.session_state.data_regentity is not None
-    ):
-        st.session_state.data_regentity = normalize_string_columns_for_streamlit(
-            st.session_state.data_regentity
-        )
-    if "data_clean" not in st.session_state:
-        logger.info("data_clean not in session state.")
-    else:
-        logger.debug("st.session_state.data_regentity:"
-                    f" {len(st.session_state.data_regentity)}")
-        logger.debug("st.session_state.data_donor:"
-                    f" {len(st.session_state.data_donor)}")
-        logger.debug("st.session_state.data_clean:"
-                    f" {len(st.session_state.data_clean)}")
+    results = load_frames_concurrently(
+        {key: functools.partial(run_stage, key)
+         for key in stages_to_run(PAGE_FRAMES)}, timings=timings)
+    for key, result in results.items():
+        if result is None:
+            statuses[key] = "failed"
+    pipeline_state()["build_report"] = stage_report(
+        statuses, timings, (dt.datetime.now() - started).total_seconds())
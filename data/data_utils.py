@@ -1,24 +1,25 @@
 import streamlit as st
 import os
-import json
-# import pandas as pd
 from utils.logger import log_function_call, logger
-from data.data_file_defs import (load_source_data,
-                                 load_improved_raw_data,
-                                 load_cleaned_data,
-                                 load_cleaned_donations
-                                 # ,load_donor_list
-                                 )
+from utils.pipeline_state import pipeline_state
+from data.data_file_defs import read_artifact, resolve_artifact_path
+from data.artifact_manifest import (is_artifact_stale, get_manifest_entry,
+                                    forget_artifact)
 
 
-@st.cache_data
 @log_function_call
 def try_to_use_preprocessed_data(originalfilepath,
                                  savedfilepath,
-                                 timestamp_key):
+                                 artifact,
+                                 extra_inputs=None):
     """
-    Checks if the original file has been updated and if not,
-    loads the preprocessed data
+    Loads the preprocessed artifact if the artifact manifest shows it was
+    built from the current content of originalfilepath (and any
+    extra_inputs) with the current pipeline code and configuration.
+    Not cached: it runs only while a build checks the artifacts, and a
+    cache keyed on the paths would return the artifact as first read.
+    An artifact that does not read back with the rows recorded for it is
+    marked stale and None is returned, for the caller to rebuild it.
     """
     logger.info(f"Original file path: {originalfilepath}")
     logger.info(f"Saved file path: {savedfilepath}")
@@ -27,27 +28,19 @@ def try_to_use_preprocessed_data(originalfilepath,
         logger.error("Error: originalfilepath is None!")
         return None
 
-    if not is_file_updated(originalfilepath,
-                           timestamp_key) and os.path.exists(savedfilepath):
-        # Load last modified dates from the JSON file
-        last_modified_dates = load_last_modified_dates()
-        last_mod_time = last_modified_dates.get(timestamp_key, None)
-        logger.info(f"Loading preprocessed data. Using {savedfilepath}"
-                    f" dated {last_mod_time} instead of {originalfilepath}")
-        return importfile(timestamp_key, savedfilepath)
-
-    # If saved file is missing, try alternate extension before giving up
-    if not os.path.exists(savedfilepath):
-        alt_path = None
-        if savedfilepath.endswith(".zip"):
-            alt_path = savedfilepath.replace(".zip", ".csv")
-        elif savedfilepath.endswith(".csv"):
-            alt_path = savedfilepath.replace(".csv", ".zip")
-        if alt_path and os.path.exists(alt_path):
-            logger.info(
-                f"Loading preprocessed data from alternate file {alt_path}"
-            )
-            return importfile(timestamp_key, alt_path)
+    inputs = [originalfilepath] + list(extra_inputs or [])
+    if not is_artifact_stale(savedfilepath, inputs):
+        entry = get_manifest_entry(savedfilepath)
+        logger.info(f"Loading preprocessed data. Using {entry['path']}"
+                    f" built {entry['built_at']} instead of"
+                    f" {originalfilepath}")
+        loaddata_df = importfile(artifact, savedfilepath)
+        if loaddata_df is not None and len(loaddata_df) != entry["rows"]:
+            logger.warning(f"{entry['path']} read back {len(loaddata_df)}"
+                           f" rows, the manifest records {entry['rows']}.")
+            forget_artifact(savedfilepath)
+            return None
+        return loaddata_df
 
     return None
 
@@ -63,8 +56,8 @@ def initialise_data():
     logger.info("Running first load function.")
     firstload()
     # check that the all data has been loaded into the session state
-    if "data_clean" not in st.session_state or \
-            st.session_state.data_clean is None:
+    if "data_clean" not in pipeline_state() or \
+            pipeline_state().data_clean is None:
         logger.error("Data loading failed.")
         st.error("Data loading failed. Please check logs.")
         raise SystemExit("Data loading failed. Exiting.")
@@ -73,119 +66,22 @@ def initialise_data():
     return None
 
 
-def load_last_modified_dates():
-    """Load the last modified dates from the JSON file."""
-    try:
-        with open('reference_files/last_modified_dates.json', 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}
-
-
-def save_last_modified_dates(last_modified_dates):
-    """Save the updated last modified dates to the JSON file."""
-    # Create the folder if it doesn't exist
-    os.makedirs('reference_files', exist_ok=True)
-    with open('reference_files/last_modified_dates.json', 'w') as f:
-        json.dump(last_modified_dates, f, indent=4)
-
-
-@log_function_call
-def get_file_modification_time(filepath):
-    """Returns the last modification time of the given file."""
-    logger.info(f"Getting modification time for {filepath}")
-    if os.path.exists(filepath):
-        return os.path.getmtime(filepath)
-
-    # Try alternate extension if CSV/ZIP doesn't exist
-    alt_path = None
-    if filepath.endswith(".zip"):
-        alt_path = filepath.replace(".zip", ".csv")
-    elif filepath.endswith(".csv"):
-        alt_path = filepath.replace(".csv", ".zip")
-
-    if alt_path and os.path.exists(alt_path):
-        logger.info(f"Using alternate file for modification time: {alt_path}")
-        return os.path.getmtime(alt_path)
-
-    logger.warning(f"File {filepath} does not exist.")
-    return None
-
-
-@log_function_call
-def is_file_updated(main_file, timestamp_key):
-    """Checks if the main file has been updated
-    since the last recorded timestamp."""
-    logger.info(f"Checking if {main_file} has been updated.")
-
-    # Load last modified dates from the JSON file
-    last_modified_dates = load_last_modified_dates()
-
-    # Get the current modification time of the file
-    current_mod_time = get_file_modification_time(main_file)
-    logger.info(f"Current modification time: {current_mod_time}")
-
-    # Retrieve the last modification time from the loaded data
-    last_mod_time = last_modified_dates.get(timestamp_key, None)
-    logger.info(f"Last modification time: {last_mod_time}")
-
-    # If file does not exist or mod time unavailable, treat as not updated
-    if current_mod_time is None:
-        logger.warning(f"Cannot determine modification time for {main_file}")
-        # Force reprocessing if we cannot determine file timestamp
-        return True
-
-    # Check if the file has been updated
-    if last_mod_time is None or (current_mod_time > last_mod_time):
-        # Update the session state and the JSON file with the new timestamp
-        last_modified_dates[timestamp_key] = current_mod_time
-        st.session_state[timestamp_key] = current_mod_time
-        # Save the updated modification times back to the JSON file
-        save_last_modified_dates(last_modified_dates)
-
-        return True  # File has changed
-
-    return False  # File is unchanged
-
-
-def importfile(timestamp_key, savedfilepath):
+def importfile(artifact, savedfilepath, columns=None):
     """
     Imports a file from the given path.
-    Using a specified file definition
+    Using the file definition registered for the artifact,
+    reading only the given columns if any
     """
     logger.info(f"Importing file from {savedfilepath}")
 
-    if not os.path.exists(savedfilepath):
-        alt_path = None
-        if savedfilepath.endswith(".zip"):
-            alt_path = savedfilepath.replace(".zip", ".csv")
-        elif savedfilepath.endswith(".csv"):
-            alt_path = savedfilepath.replace(".csv", ".zip")
-        if alt_path and os.path.exists(alt_path):
-            logger.info(f"Using alternate file for import: {alt_path}")
-            savedfilepath = alt_path
-        else:
-            logger.error(f"File {savedfilepath} does not exist.")
-            return None
-    elif os.path.getsize(savedfilepath) == 0:
+    storedfilepath = resolve_artifact_path(savedfilepath)
+    if storedfilepath is None:
+        logger.error(f"File {savedfilepath} does not exist.")
+        return None
+    if storedfilepath != savedfilepath:
+        logger.info(f"Using alternate file for import: {storedfilepath}")
+        savedfilepath = storedfilepath
+    if os.path.getsize(savedfilepath) == 0:
         logger.error(f"File {savedfilepath} is empty.")
         return None
-    elif timestamp_key == "load_raw_data_last_modified":
-        loaddata_df = load_source_data(savedfilepath)
-    elif timestamp_key == "cleaned_raw_data_last_modified":
-        loaddata_df = load_improved_raw_data(savedfilepath)
-    elif timestamp_key == "cleaned_data_last_modified":
-        loaddata_df = load_cleaned_data(savedfilepath)
-    elif timestamp_key == "cleaned_donations_last_modified":
-        loaddata_df = load_cleaned_donations(savedfilepath)
-    elif timestamp_key == "election_dates_last_modified":
-        # Import here to avoid circular dependency
-        from data.GenElectionRelationship import load_election_dates
-        loaddata_df = load_election_dates()
-    # elif timestamp_key == "load_donorlist_data_last_modified":
-    #    loaddata_df = load_donor_list(savedfilepath)
-    # or whatever the appropriate loader is
-    else:
-        logger.error(f"Timestamp key {timestamp_key} not recognised.")
-        return
-    return loaddata_df
+    return read_artifact(artifact, savedfilepath, columns)
@@ -1,10 +1,14 @@
-import pandas as pd
-import streamlit as st
+import config
 from data.data_utils import try_to_use_preprocessed_data
-from data.raw_data_clean import raw_data_cleanup
+from data.artifact_manifest import record_artifact
+from data.data_file_defs import load_source_data
+from data.raw_data_clean import (raw_data_cleanup,
+                                 stream_raw_data_cleanup,
+                                 dedupe_map_inputs)
 from utils.logger import (log_function_call,
                           logger,
                           )
+from utils.pipeline_state import pipeline_state
 
 
 @log_function_call
@@ -17,21 +21,21 @@ def load_raw_data(main_file="raw_data",
                   processeddatafilepath="imported_raw_fname"):
     # Ensure session state variables are initialized
     if (
-        "BASE_DIR" not in st.session_state
+        "BASE_DIR" not in pipeline_state()
     ):
         logger.critical("Base Dir Session state variables not initialized!")
         return None
 
     if (
-        "directories" not in st.session_state
+        "directories" not in pipeline_state()
     ):        # Set the original data file path
         logger.critical("Directories Session state variables not initialized!")
         return None
 
     if (
-        "filenames" not in st.session_state
-        or st.session_state.get(originaldatafilepath) is None
-        or st.session_state.get(processeddatafilepath) is None
+        "filenames" not in pipeline_state()
+        or pipeline_state().get(originaldatafilepath) is None
+        or pipeline_state().get(processeddatafilepath) is None
     ):
         logger.critical(f"{originaldatafilepath} or {processeddatafilepath} "
                         "Session state variables not initialized!")
@@ -42,14 +46,14 @@ def load_raw_data(main_file="raw_data",
     logger.debug("Processed data file path pre"
                  f" raw data load: {processeddatafilepath}")
 
-    originaldatafilepath = st.session_state.get(originaldatafilepath)
-    processeddatafilepath = st.session_state.get(processeddatafilepath)
+    originaldatafilepath = pipeline_state().get(originaldatafilepath)
+    processeddatafilepath = pipeline_state().get(processeddatafilepath)
     # Use function to check if file has been updated and if not,
     # load preprocessed data
     loaddata_df = try_to_use_preprocessed_data(
         originalfilepath=originaldatafilepath,
         savedfilepath=processeddatafilepath,
-        timestamp_key="load_raw_data_last_modified")
+        artifact="imported_raw")
     # Check if cached data loaded successfully and return it
     if loaddata_df is not None:
         logger.info("Preprocessed data loaded successfully.")
@@ -59,57 +63,33 @@ def load_raw_data(main_file="raw_data",
                      f" raw data load: {originaldatafilepath}")
         logger.debug("Processed data file path post"
                      f" raw data load: {processeddatafilepath}")
+        if pipeline_state().get("STREAMING_INGEST", config.STREAMING_INGEST):
+            cleaned_filepath = stream_raw_data(
+                originaldatafilepath=originaldatafilepath,
+                processeddatafilepath=processeddatafilepath,
+                output_csv=output_csv,
+                dedupe_donors=dedupe_donors,
+                dedupe_regentity=dedupe_regentity)
+            if cleaned_filepath is not None:
+                # the cleaned donations are only on disk, callers that
+                # need the frame read it from this path
+                return cleaned_filepath
+            logger.info("Streaming import unavailable, loading in memory.")
         # Load and clean the raw data
-        loaddata_df = pd.read_csv(
-            originaldatafilepath,
-            dtype={
-                "index": "int64",
-                "ECRef": "object",
-                "RegulatedEntityName": "object",
-                "RegulatedEntityType": "object",
-                "Value": "object",
-                "AcceptedDate": "object",
-                "AccountingUnitName": "object",
-                "DonorName": "object",
-                "AccountingUnitsAsCentralParty": "object",
-                "IsSponsorship": "string",
-                "DonorStatus": "object",
-                "RegulatedDoneeType": "object",
-                "CompanyRegistrationNumber": "object",
-                "Postcode": "object",
-                "DonationType": "object",
-                "NatureOfDonation": "object",
-                "PurposeOfVisit": "object",
-                "DonationAction": "object",
-                "ReceivedDate": "object",
-                "ReportedDate": "object",
-                "IsReportedPrePoll": "string",
-                "ReportingPeriodName": "object",
-                "IsBequest": "string",
-                "IsAggregation": "string",
-                "RegulatedEntityId": "object",
-                "AccountingUnitId": "object",
-                "DonorId": "object",
-                "CampaigningName": "object",
-                "RegisterName": "object",
-                "IsIrishSource": "string",
-            },
-            index_col="index",
-        )
+        loaddata_df = load_source_data(originaldatafilepath)
 
         # Print progress message
         logger.info(f"Data loaded successfully."
                     f" Data has {loaddata_df.shape[0]} rows "
                     f"and {loaddata_df.shape[1]} columns")
-        # Save the raw data to session state (normalize to avoid Arrow errors)
-        from data.data_file_defs import normalize_string_columns_for_streamlit
-        loaddata_df = normalize_string_columns_for_streamlit(loaddata_df)
-        st.session_state.raw_data = loaddata_df
+        # Save the raw data to session state
+        pipeline_state().raw_data = loaddata_df
         if output_csv:
-            from data.data_file_defs import save_dataframe_to_zip, normalize_string_columns_for_streamlit
-            loaddata_df = normalize_string_columns_for_streamlit(loaddata_df)
-            save_dataframe_to_zip(loaddata_df, processeddatafilepath, index=True)
-            logger.info(f"Data saved to {processeddatafilepath.replace('.csv', '.zip')}")
+            from data.data_file_defs import save_dataframe_artifact
+            saved_filepath = save_dataframe_artifact(loaddata_df, processeddatafilepath,
+                                                     index=True, artifact="imported_raw",
+                                                     inputs=[originaldatafilepath])
+            logger.info(f"Data saved to {saved_filepath}")
         logger.info("Data saved to sessionstate as 'raw_data'")
 
     # Cleanse the raw data
@@ -124,3 +104,40 @@ def load_raw_data(main_file="raw_data",
         return loaddata_df
 
     return imported_raw_data(loaddata_df)
+
+
+def stream_raw_data(originaldatafilepath,
+                    processeddatafilepath,
+                    output_csv=True,
+                    dedupe_donors=False,
+                    dedupe_regentity=False,
+                    chunksize=None):
+    """
+    Stream the source file through the raw cleanup to the cleaned
+    donations artifact (stream_raw_data_cleanup) and record the artifacts
+    written in the manifest. The cleaned donations are never held whole
+    in memory. chunksize is the rows per block, config.INGEST_CHUNKSIZE if
+    None.
+
+    Returns the path of the cleaned donations artifact, None if the
+    streaming import is unavailable.
+    """
+    streamed = stream_raw_data_cleanup(
+        originaldatafilepath=originaldatafilepath,
+        rawcopyfilepath=processeddatafilepath if output_csv else None,
+        dedupe_donors=dedupe_donors,
+        dedupe_regentity=dedupe_regentity,
+        processeddatafilepath="cleaned_donations_fname",
+        chunksize=chunksize)
+    if streamed is None:
+        return None
+    cleaned_filepath, rows = streamed
+    if output_csv:
+        # record both streamed artifacts so raw_data_cleanup
+        # treats the cleaned donations as up to date
+        record_artifact(processeddatafilepath, [originaldatafilepath], rows)
+        record_artifact(cleaned_filepath,
+                        [processeddatafilepath]
+                        + dedupe_map_inputs(dedupe_donors, dedupe_regentity),
+                        rows)
+    return cleaned_filepath
@@ -0,0 +1,137 @@
+"""
+Compiled dedupe reference maps.
+
+The dedupe mapping files in reference_files (PoliticalDonorsDeduped.csv,
+PoliticalEntityDeDuped.csv) are compiled once into a binary lookup kept
+in DIRECTORIES["map_cache_dir"]: the entity ids sorted into one array,
+with each mapped column alongside as an id array or as integer codes into
+its distinct names. A map is recompiled only when the content hash of its
+CSV changes, and is applied to a frame by a binary search of the id
+array instead of a DataFrame merge, so the donation frame is not copied.
+"""
+import os
+import numpy as np
+import pandas as pd
+import config
+from utils.logger import logger
+from utils.pipeline_state import pipeline_state
+
+# Suffix of the arrays holding the names of a string column
+CATEGORIES_SUFFIX = "__categories"
+
+# (map file hash, key column, value columns): compiled map
+_compiled_maps = {}
+
+
+def map_cache_path(map_file_path, key_column):
+    """Compiled version of a mapping file, one per key column"""
+    cache_dir = pipeline_state().get("map_cache_dir",
+                                     config.DIRECTORIES["map_cache_dir"])
+    base = os.path.splitext(os.path.basename(map_file_path))[0]
+    return os.path.join(cache_dir, f"{base}.{key_column}.npz")
+
+
+def compile_entity_map(map_file_path, key_column, value_columns,
+                       dtype=None):
+    """
+    Compile a mapping file: the first non-null value of each column for
+    every key, as groupby(key).first() gives, with the keys sorted.
+    Returns a dict of arrays: "keys", one array per numeric column and
+    codes plus names for each string column.
+    """
+    map_df = pd.read_csv(map_file_path, dtype=dtype)
+    map_df = map_df.groupby(key_column)[value_columns].first()
+    compiled = {"keys": map_df.index.to_numpy(dtype="int64")}
+    for name in value_columns:
+        values = map_df[name]
+        if pd.api.types.is_numeric_dtype(values):
+            compiled[name] = values.to_numpy(dtype="float64")
+        else:
+            codes, categories = pd.factorize(values, sort=True)
+            compiled[name] = codes.astype("int32")
+            compiled[name + CATEGORIES_SUFFIX] = categories.to_numpy(
+                dtype=str)
+    logger.info(f"Compiled {map_file_path} on {key_column}:"
+                f" {len(compiled['keys'])} ids")
+    return compiled
+
+
+def _save_compiled_map(compiled, cache_path, source_hash):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, source_hash=np.array(source_hash), **compiled)
+    os.replace(tmp_path, cache_path)
+
+
+def _load_compiled_map(cache_path, source_hash):
+    """The compiled map at cache_path if it was built from source_hash"""
+    try:
+        with np.load(cache_path, allow_pickle=False) as stored:
+            if str(stored["source_hash"]) != source_hash:
+                return None
+            return {name: stored[name] for name in stored.files
+                    if name != "source_hash"}
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def load_compiled_map(map_file_path, key_column, value_columns,
+                      dtype=None):
+    """
+    Return the compiled lookup for a mapping file, compiling it only if
+    the CSV's content hash differs from the one it was compiled from
+    """
+    from data.artifact_manifest import file_hash
+    source_hash = file_hash(map_file_path)
+    cache_key = (source_hash, key_column, tuple(value_columns))
+    if cache_key in _compiled_maps:
+        return _compiled_maps[cache_key]
+    cache_path = map_cache_path(map_file_path, key_column)
+    compiled = _load_compiled_map(cache_path, source_hash)
+    if compiled is None or not all(name in compiled
+                                   for name in value_columns):
+        compiled = compile_entity_map(map_file_path, key_column,
+                                      value_columns, dtype)
+        _save_compiled_map(compiled, cache_path, source_hash)
+    _compiled_maps[cache_key] = compiled
+    return compiled
+
+
+def lookup_entity_map(compiled, ids, columns):
+    """
+    Look ids up in a compiled map. Returns a dict of column name to an
+    array aligned with ids: nullable Int64 for id columns and object for
+    names, missing where the id is not in the map.
+    """
+    keys = compiled["keys"]
+    ids = pd.to_numeric(pd.Series(ids), errors="coerce").to_numpy(
+        dtype="float64")
+    # position of each id in the map, -1 (the missing value appended to
+    # each column below) where it is not mapped
+    positions = np.full(len(ids), -1)
+    if len(keys):
+        found_at = np.minimum(np.searchsorted(keys, ids), len(keys) - 1)
+        found = ~np.isnan(ids) & (keys[found_at] == ids)
+        positions[found] = found_at[found]
+    result = {}
+    for name in columns:
+        if name + CATEGORIES_SUFFIX in compiled:
+            names = np.append(
+                compiled[name + CATEGORIES_SUFFIX].astype(object), np.nan)
+            codes = np.append(compiled[name], -1)[positions]
+            result[name] = pd.array(names[codes], dtype=object)
+        else:
+            values = np.append(compiled[name], np.nan)[positions]
+            result[name] = pd.array(values, dtype="Float64").astype("Int64")
+    return result
+
+
+def apply_entity_map(df, compiled, id_column, columns):
+    """
+    Add the mapped columns for the ids in df[id_column] to df in place,
+    missing where an id is not mapped
+    """
+    for name, values in lookup_entity_map(compiled, df[id_column],
+                                          columns).items():
+        df[name] = pd.Series(values, index=df.index, name=name)
+    return df
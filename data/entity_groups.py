@@ -0,0 +1,146 @@
+"""
+Entity groups of the cleaned data
+
+Each regulated entity and party is put in a group by the total of a
+measure (EventCount) of its donations per parliamentary sitting, from the
+thresholds in config.THRESHOLDS, so the groups are part of the cleaned
+data artifacts.
+"""
+import pandas as pd
+import streamlit as st
+from utils.logger import logger
+
+
+def entity_measure_totals(df, entity, measure, groupby_column=None):
+    """
+    Total measure per entity (and optionally per groupby_column), with
+    the key columns followed by a "total_measure" column. Totals of
+    separate parts of the data are combined by combine_measure_totals.
+    """
+    if groupby_column and groupby_column in df.columns:
+        entity_totals = df.groupby([entity, groupby_column], as_index=False,
+                                   observed=True)[measure].sum()
+    else:
+        entity_totals = df.groupby(entity, as_index=False,
+                                   observed=True)[measure].sum()
+
+    entity_totals.rename(columns={measure: "total_measure"}, inplace=True)
+    return entity_totals
+
+
+def combine_measure_totals(partials):
+    """
+    Combine entity_measure_totals of separate parts of the data into the
+    totals of the whole, in the same order as for the whole
+    """
+    combined = pd.concat(partials, ignore_index=True)
+    merge_columns = [col for col in combined.columns
+                     if col != "total_measure"]
+    return combined.groupby(merge_columns, as_index=False,
+                            observed=True)["total_measure"].sum()
+
+
+def assign_entity_groups(entity_totals, entity, thresholds_dict,
+                         exception_dict=None):
+    """
+    Add a "group" column to entity totals based on thresholds or
+    (exceptions)
+    """
+    # if exception_dict is provided, use assign_group_with_exceptions
+    # other wise use assign_group
+    if exception_dict:
+        #logger to show exception dict being used
+        logger.debug(f"Group assignment with exceptions: {exception_dict}")
+        entity_totals["group"] = entity_totals.apply(
+            lambda row: assign_group_with_exceptions(
+                row,
+                thresholds_dict,
+                row[entity],
+                exception_dict
+            ), axis=1
+        )
+    else:
+        entity_totals["group"] = entity_totals.apply(
+                                    lambda row: assign_group(row["total_measure"],
+                                                            thresholds_dict,
+                                                            row[entity]), axis=1
+            )
+    return entity_totals
+
+
+def merge_entity_groups(df, entity_totals):
+    """
+    The group of each row of df from entity totals with a "group" column,
+    aligned with df's index
+    """
+    merge_columns = [col for col in entity_totals.columns
+                     if col not in ["total_measure", "group"]]
+    merged = df[merge_columns].merge(entity_totals[merge_columns + ["group"]],
+                                     on=merge_columns, how="left")
+    return pd.Series(merged["group"].to_numpy(), index=df.index,
+                     name="group")
+
+
+def determine_groups_optimized(df, entity, measure, thresholds_dict, exception_dict=None, groupby_column=None):
+    """
+    Optimized version of group determination.
+
+    Parameters:
+        df (pd.DataFrame): DataFrame containing entity and measure columns.
+        entity (str): Column name representing the entity.
+        measure (str): Column name representing the numeric measure.
+        thresholds_dict (dict): Dictionary mapping (low, high)
+        tuples to group labels.
+        exception_dict(dict): Dictionary mapping entity values to exception groups.
+        groupby_column (str): Optional column to group by (e.g., 'parliamentary_sitting')
+                             to calculate thresholds per group instead of lifetime totals.
+    Returns:
+        pd.Series: A Series containing assigned groups for each row.
+    """
+    # Step 1: Compute total measure per entity (and optionally per groupby_column)
+    entity_totals = entity_measure_totals(df, entity, measure, groupby_column)
+
+    # Step 2: Assign groups based on thresholds or (exceptions)
+    entity_totals = assign_entity_groups(entity_totals, entity,
+                                         thresholds_dict, exception_dict)
+
+    # Step 3: Merge back into the original DataFrame
+    groups = merge_entity_groups(df, entity_totals)
+    logger.debug(f"Group assignment: {groups.value_counts()}")
+    logger.debug(f"Group assignment: {entity_totals['group'].value_counts()}")
+
+    # Step 4: Validate row count consistency
+    if len(groups) != len(df):
+        st.error(f"Length mismatch: original {len(df)}, merged {len(groups)}")
+        logger.error(f"Length mismatch: original {len(df)}, merged {len(groups)}")
+        return None
+
+    # Step 5: Return the group column
+    return groups
+
+
+def assign_group(total, thresholds_dict, entity_value):
+    """
+    Assigns a group based on thresholds.
+    If above the max threshold, returns the entity name.
+    """
+    for (low, high), group_name in thresholds_dict.items():
+        if low <= total <= high:
+            return group_name
+    return entity_value  # Assign entity name if above max threshold
+
+def assign_group_with_exceptions(row,
+                                 thresholds_dict,
+                                 entity_value,
+                                 exception_dict):
+    """
+    Assigns a group based on thresholds and exceptions.
+    If entity_value is a key in exception_dict, return the entity name
+    instead of a threshold category (party exception).
+    """
+    # Check if this entity is in the exception dict (exact match)
+    if exception_dict and entity_value in exception_dict:
+        return entity_value
+
+    # Otherwise, use threshold-based grouping
+    return assign_group(row["total_measure"], thresholds_dict, entity_value)
@@ -1,10 +1,34 @@
 import pandas as pd
 import streamlit as st
-from components.calculations import determine_groups_optimized
+from data.entity_groups import determine_groups_optimized
 from utils.logger import (log_function_call,
                           logger,
                           )
+from utils.pipeline_state import pipeline_state
 from data.data_utils import try_to_use_preprocessed_data
+from data.shared_dataset import get_session_frame
+from data.star_schema import join_dimensions
+from data.out_of_core import iter_partitions, out_of_core_enabled
+
+
+def partitioned_value_totals(filepath, group_columns):
+    """
+    Out-of-core version of the value sum, count and mean per group of
+    the cleaned data at filepath, read one partition at a time
+    (data.out_of_core). The sums and counts of each partition are added
+    up, and the mean is taken from them, so the values can differ from
+    the in-memory totals by floating point rounding.
+    """
+    totals = [
+        partition_df.groupby(group_columns, observed=True)["Value"]
+        .agg(["sum", "count"])
+        for partition_df in iter_partitions(
+            "cleaned_data", filepath, group_columns + ["Value"])]
+    if not totals:
+        return None
+    totals_df = pd.concat(totals).groupby(level=group_columns).sum()
+    totals_df["mean"] = totals_df["sum"] / totals_df["count"]
+    return totals_df
 
 
 @log_function_call
@@ -14,31 +38,41 @@ def load_donorList_data(main_file="data_clear",
                         output_csv=False,
                         originaldatafilepath="cleaned_data_fname",
                         cleaneddatafilepath="cleaned_donorlist_fname"):
+    # Out of core the cleaned data is read from its artifact a partition
+    # at a time, rather than from the frame in session state
+    out_of_core = out_of_core_enabled()
     if (
-        st.session_state.get(originaldatafilepath) is None
-        or st.session_state.get(cleaneddatafilepath) is None
-        or st.session_state.get(main_file) is None
+        pipeline_state().get(originaldatafilepath) is None
+        or pipeline_state().get(cleaneddatafilepath) is None
+        or (pipeline_state().get(main_file) is None and not out_of_core)
     ):
         st.error(f"Session state variables not initialized! {__name__}")
         logger.error(f"Session state variables not initialized! {__name__}")
         return None
 
     # Check if we can use cached cleaned data
-    originaldatafilepath = st.session_state.get(originaldatafilepath)
-    cleaneddatafilepath = st.session_state.get(cleaneddatafilepath)
+    originaldatafilepath = pipeline_state().get(originaldatafilepath)
+    cleaneddatafilepath = pipeline_state().get(cleaneddatafilepath)
     # Use function to check if file has been updated and if not,
     # load preprocessed data
     loaddata_df = try_to_use_preprocessed_data(
         originalfilepath=originaldatafilepath,
         savedfilepath=cleaneddatafilepath,
-        timestamp_key="load_donorlist_data_last_modified")
+        artifact="cleaned_donorlist")
     # Check if cached data loaded successfully and return it
     if loaddata_df is not None:
         return loaddata_df
 
     # Load and clean the data
-    if streamlitrun:
-        donorlist_df = st.session_state.get(main_file)
+    if out_of_core:
+        donorlist_df = partitioned_value_totals(originaldatafilepath,
+                                                ["DonorKey"])
+        if donorlist_df is None:
+            logger.error(f"No rows read from {originaldatafilepath}")
+            return None
+    elif streamlitrun:
+        donorlist_df = get_session_frame(main_file,
+                                         columns=["DonorKey", "Value"])
         if donorlist_df is None:
             st.error(f"No data found in session state! {__name__}")
             logger.error(f"No data found in session state! {__name__}")
@@ -50,24 +84,35 @@ def load_donorList_data(main_file="data_clear",
         if donorlist_df is None:
             return None
 
-    donorlist_df = (
-        donorlist_df.groupby(["DonorId", "DonorName"])
-        .agg({"Value": ["sum", "count", "mean"]})
-        .reset_index()
-    )
+    # Group on the integer donor key, then join the ids and names
+    if not out_of_core:
+        donorlist_df = (
+            donorlist_df.groupby("DonorKey")
+            .agg({"Value": ["sum", "count", "mean"]})
+        )
     donorlist_df.columns = [
+        "Donations Value",
+        "Donation Events",
+        "Donation Mean",
+    ]
+    donorlist_df = join_dimensions(
+        donorlist_df.reset_index(),
+        {"dim_donor": get_session_frame("dim_donor")},
+        columns=["DonorId", "DonorName"])
+    donorlist_df = donorlist_df.rename(columns={"DonorName": "Donor Name"})[[
         "DonorId",
         "Donor Name",
         "Donations Value",
         "Donation Events",
         "Donation Mean",
-    ]
+    ]]
 
     if output_csv:
-        from data.data_file_defs import save_dataframe_to_zip, normalize_string_columns_for_streamlit
-        donorlist_df = normalize_string_columns_for_streamlit(donorlist_df)
-        save_dataframe_to_zip(donorlist_df, cleaneddatafilepath, index=False)
-        logger.info(f"Donor data saved to {cleaneddatafilepath.replace('.csv', '.zip')}")
+        from data.data_file_defs import save_dataframe_artifact
+        saved_filepath = save_dataframe_artifact(donorlist_df, cleaneddatafilepath,
+                                                 index=False, artifact="cleaned_donorlist",
+                                                 inputs=[originaldatafilepath])
+        logger.info(f"Donor data saved to {saved_filepath}")
     logger.info("Donor Data summary completed")
     logger.info(f"Data shape: {donorlist_df.shape}")
     return donorlist_df
@@ -82,32 +127,43 @@ def load_regulated_entity_data(
     originaldatafilepath="cleaned_data_fname",
     cleaneddatafilepath="cleaned_regentity_fname",
         ):
+    # Out of core the cleaned data is read from its artifact a partition
+    # at a time, rather than from the frame in session state
+    out_of_core = out_of_core_enabled()
     if (
-        st.session_state.get(main_file) is None
-        or st.session_state.get(originaldatafilepath) is None
-        or st.session_state.get(cleaneddatafilepath) is None
+        (pipeline_state().get(main_file) is None and not out_of_core)
+        or pipeline_state().get(originaldatafilepath) is None
+        or pipeline_state().get(cleaneddatafilepath) is None
     ):
         st.error(f"Session state variables not initialized! {__name__}")
         logger.error(f"Session state variables not initialized! {__name__}")
         return None
 
     # Check if we can use cached cleaned data
-    originaldatafilepath = st.session_state.get(originaldatafilepath)
-    cleaneddatafilepath = st.session_state.get(cleaneddatafilepath)
+    originaldatafilepath = pipeline_state().get(originaldatafilepath)
+    cleaneddatafilepath = pipeline_state().get(cleaneddatafilepath)
     # Use function to check if file has been updated and if not,
     # load preprocessed data
     loaddata_df = try_to_use_preprocessed_data(
         originalfilepath=originaldatafilepath,
         savedfilepath=cleaneddatafilepath,
-        timestamp_key="load_donorlist_data_last_modified")
+        artifact="cleaned_regentity")
     # Check if cached data loaded successfully and return it
     if loaddata_df is not None:
         return loaddata_df
 
     # Load and clean the data
-    if streamlitrun:
+    if out_of_core:
+        regent_df = partitioned_value_totals(
+            originaldatafilepath, ["RegulatedEntityKey", "RegEntity_Group"])
+        if regent_df is None:
+            logger.error(f"No rows read from {originaldatafilepath}")
+            return None
+    elif streamlitrun:
         try:
-            regent_df = st.session_state.get(main_file)
+            regent_df = get_session_frame(
+                main_file,
+                columns=["RegulatedEntityKey", "RegEntity_Group", "Value"])
         except Exception as e:
             logger.error(f"Error loading {main_file} from session state: {e}")
             return None
@@ -118,28 +174,41 @@ def load_regulated_entity_data(
         if regent_df is None:
             return None
 
-    regent_df = (
-        regent_df.groupby(
-            ["RegulatedEntityId", "RegulatedEntityName", "RegEntity_Group"],
-            observed=True,
+    # Group on the integer entity key, then join the ids and names
+    if not out_of_core:
+        regent_df = (
+            regent_df.groupby(
+                ["RegulatedEntityKey", "RegEntity_Group"],
+                observed=True,
+            )
+            .agg({"Value": ["sum", "count", "mean"]})
         )
-        .agg({"Value": ["sum", "count", "mean"]})
-        .reset_index()
-    )
     regent_df.columns = [
+        "Donations Value",
+        "Donation Events",
+        "Donation Mean",
+    ]
+    regent_df = join_dimensions(
+        regent_df.reset_index(),
+        {"dim_regentity": get_session_frame("dim_regentity")},
+        columns=["RegulatedEntityId", "RegulatedEntityName"])
+    regent_df = regent_df.rename(columns={
+        "RegulatedEntityName": "Regulated Entity Name",
+        "RegEntity_Group": "Regulated Entity Group"})[[
         "RegulatedEntityId",
         "Regulated Entity Name",
         "Regulated Entity Group",
         "Donations Value",
         "Donation Events",
         "Donation Mean",
-    ]
+    ]]
 
     if output_csv:
-        from data.data_file_defs import save_dataframe_to_zip, normalize_string_columns_for_streamlit
-        regent_df = normalize_string_columns_for_streamlit(regent_df)
-        save_dataframe_to_zip(regent_df, cleaneddatafilepath, index=False)
-        logger.info(f"Regulated entity data saved to {cleaneddatafilepath.replace('.csv', '.zip')}")
+        from data.data_file_defs import save_dataframe_artifact
+        saved_filepath = save_dataframe_artifact(regent_df, cleaneddatafilepath,
+                                                 index=False, artifact="cleaned_regentity",
+                                                 inputs=[originaldatafilepath])
+        logger.info(f"Regulated entity data saved to {saved_filepath}")
     logger.info("Raw Data cleanup completed")
     logger.info(f"Data shape: {regent_df.shape}")
 
@@ -158,27 +227,27 @@ def load_entity_summary_data(
         cleaneddatafilepath="party_summary_fname"
         ):
     if (
-        st.session_state.get(main_file) is None
-        or st.session_state.get(originaldatafilepath) is None
-        or st.session_state.get(cleaneddatafilepath) is None
+        pipeline_state().get(main_file) is None
+        or pipeline_state().get(originaldatafilepath) is None
+        or pipeline_state().get(cleaneddatafilepath) is None
     ):
         st.error(f"Session state variables not initialized! {__name__}")
         logger.error(f"Session state variables not initialized! {__name__}")
         return None
     # Check if we can use cached cleaned data
-    originaldatafilepath = st.session_state.get(originaldatafilepath)
-    cleaned_data_file = st.session_state.get(cleaneddatafilepath)
+    originaldatafilepath = pipeline_state().get(originaldatafilepath)
+    cleaned_data_file = pipeline_state().get(cleaneddatafilepath)
     # Use function to check if file has been updated and if not,
     # load preprocessed data
     loaddata_df = try_to_use_preprocessed_data(originaldatafilepath,
                                                cleaned_data_file,
-                                               "entity_summary_last_modified")
+                                               "party_summary")
     # Check if cached data loaded successfully and return it
     if loaddata_df is not None:
         return loaddata_df
 
     if streamlitrun:
-        entitysummary_df = st.session_state.get(main_file)
+        entitysummary_df = get_session_frame(main_file)
         if entitysummary_df is None:
             st.error(f"No data found in session state! {__name__}")
             logger.error(f"No data found in session state! {__name__}")
@@ -209,10 +278,10 @@ def load_entity_summary_data(
 
     # generate CSV file of summary data
     if output_csv:
-        from data.data_file_defs import save_dataframe_to_zip, normalize_string_columns_for_streamlit
-        RegulatedEntity_df = normalize_string_columns_for_streamlit(RegulatedEntity_df)
-        save_dataframe_to_zip(RegulatedEntity_df, cleaned_data_file, index=True)
-        logger.info(f"Regulated entity summary saved to {cleaned_data_file.replace('.csv', '.zip')}")
+        from data.data_file_defs import save_dataframe_artifact
+        saved_filepath = save_dataframe_artifact(RegulatedEntity_df, cleaned_data_file, index=True,
+                                                 inputs=[originaldatafilepath])
+        logger.info(f"Regulated entity summary saved to {saved_filepath}")
     logger.info("Raw Data cleanup completed")
     logger.info(f"Data shape: {RegulatedEntity_df.shape}")
 
@@ -0,0 +1,123 @@
+"""
+Memory reports for the pipeline frames.
+
+When an artifact is saved with its registered schema, the memory held by
+each of its columns before and after the compact dtype plan of
+data.schema_registry is written next to the artifact as
+<artifact>.memory.json. The reports, and the memory of the frames held by
+the current session, are shown on the Memory Report admin page.
+"""
+import datetime as dt
+import glob
+import json
+import os
+import pandas as pd
+import config
+from utils.logger import logger
+from utils.pipeline_state import pipeline_state
+
+REPORT_SUFFIX = ".memory.json"
+INDEX_LABEL = "(index)"
+
+
+def column_memory(df):
+    """Bytes and dtype of the index and each column of a frame"""
+    usage = df.memory_usage(index=True, deep=True)
+    memory = {INDEX_LABEL: {"dtype": str(df.index.dtype),
+                            "bytes": int(usage["Index"])}}
+    for col in df.columns:
+        memory[col] = {"dtype": str(df[col].dtype),
+                       "bytes": int(usage[col])}
+    return memory
+
+
+def build_memory_report(artifact, before_df, after_df):
+    """
+    Compare the memory of a frame as built (before_df) with the frame cast
+    to the compact dtypes of its schema (after_df)
+    """
+    before = column_memory(before_df)
+    after = column_memory(after_df)
+    columns = []
+    for col, col_after in after.items():
+        col_before = before.get(col, col_after)
+        columns.append({"column": col,
+                        "dtype_before": col_before["dtype"],
+                        "dtype_after": col_after["dtype"],
+                        "bytes_before": col_before["bytes"],
+                        "bytes_after": col_after["bytes"]})
+    return {"artifact": artifact,
+            "rows": len(after_df),
+            "created_at": dt.datetime.now().isoformat(timespec="seconds"),
+            "bytes_before": sum(c["bytes_before"] for c in columns),
+            "bytes_after": sum(c["bytes_after"] for c in columns),
+            "columns": columns}
+
+
+def memory_report_path(artifact_filepath):
+    """Path of the memory report kept next to an artifact"""
+    return os.path.splitext(artifact_filepath)[0] + REPORT_SUFFIX
+
+
+def write_memory_report(report, artifact_filepath):
+    """Write a memory report next to its artifact, replacing the old one"""
+    report_filepath = memory_report_path(artifact_filepath)
+    tmp_filepath = f"{report_filepath}.{os.getpid()}.tmp"
+    with open(tmp_filepath, "w") as f:
+        json.dump(report, f, indent=4)
+    os.replace(tmp_filepath, report_filepath)
+    logger.info(f"Memory report for {report['artifact']}:"
+                f" {report['bytes_before'] / 1e6:.1f} MB before,"
+                f" {report['bytes_after'] / 1e6:.1f} MB after compact dtypes")
+    return report_filepath
+
+
+def load_memory_reports(directory=None):
+    """Load the memory reports written next to the artifacts"""
+    directory = directory or pipeline_state().get(
+        "output_dir", config.DIRECTORIES["output_dir"])
+    reports = []
+    for report_filepath in sorted(glob.glob(os.path.join(
+            directory, "*" + REPORT_SUFFIX))):
+        try:
+            with open(report_filepath, "r") as f:
+                reports.append(json.load(f))
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Could not read memory report"
+                           f" {report_filepath}: {e}")
+    return reports
+
+
+def memory_report_frame(report):
+    """Per column table of a memory report, largest column first"""
+    report_df = pd.DataFrame(report["columns"])
+    report_df["MB Before"] = report_df["bytes_before"] / 1e6
+    report_df["MB After"] = report_df["bytes_after"] / 1e6
+    report_df["Reduction"] = (report_df["bytes_before"]
+                              / report_df["bytes_after"].clip(lower=1))
+    report_df = report_df.rename(columns={"column": "Column",
+                                          "dtype_before": "Dtype Before",
+                                          "dtype_after": "Dtype After"})
+    return (report_df.drop(columns=["bytes_before", "bytes_after"])
+            .sort_values("MB Before", ascending=False)
+            .reset_index(drop=True))
+
+
+def session_memory_frame(keys):
+    """
+    Rows and memory of the frames the session holds. Shared frames are
+    memory-mapped and their pages are held once for every session.
+    """
+    from data.shared_dataset import _session_frame, is_shared_handle
+    rows = []
+    for key in keys:
+        # as held, without joining the dimensions onto the fact rows
+        df = _session_frame(key)
+        if df is None:
+            continue
+        rows.append({"Frame": key,
+                     "Rows": len(df),
+                     "Columns": len(df.columns),
+                     "MB": df.memory_usage(index=True, deep=True).sum() / 1e6,
+                     "Shared": is_shared_handle(pipeline_state().get(key))})
+    return pd.DataFrame(rows)
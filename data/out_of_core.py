@@ -0,0 +1,138 @@
+"""
+Out-of-core execution over partitioned on-disk data.
+
+When OUT_OF_CORE["enabled"] is set, the build streams the source file
+through the raw cleanup to the cleaned donations artifact
+(data_loader.prepare_raw_artifacts), the cleaning stage
+(clean_and_enhance.load_cleaned_data) writes the cleaned data one
+partition at a time, and the donor and regulated entity lists are summed
+from its partitions. These stages return row counts rather than frames,
+so neither the cleaned donations nor the cleaned data, nor the copies
+and merge outputs made from them, are held whole in memory. The raw data
+is still loaded whole if a dedupe mapping file is missing, as fuzzy
+deduplication needs the whole file, and the analytics store is built from
+the whole cleaned frame. The data date range and the overall summary
+statistics (calculations.partitioned_summary_statistics) are then read
+partition by partition too. The pages still load the whole cleaned frame
+into session state for their filtered views and charts, so only the
+build runs out of core. A partition is a block of
+OUT_OF_CORE["partition_rows"] rows of an artifact, read with
+read_artifact_chunks and cast to its registered schema.
+
+Steps that need the whole dataset (group totals, category codes,
+dimension keys, counts of distinct values) collect partial aggregates from
+each partition, which are combined once every partition has been read, so
+the results are the same as in memory. Partitions a second pass needs are
+spilled to a temporary directory, removed when the pass is finished.
+"""
+import contextlib
+import os
+import shutil
+import tempfile
+import pandas as pd
+import config
+from utils.logger import logger
+from utils.pipeline_state import pipeline_state
+
+
+def out_of_core_settings():
+    return pipeline_state().get("OUT_OF_CORE", config.OUT_OF_CORE)
+
+
+def out_of_core_enabled():
+    """Partitioned execution is only used when switched on in config"""
+    return bool(out_of_core_settings().get("enabled", False))
+
+
+def partition_rows():
+    return (out_of_core_settings().get("partition_rows")
+            or config.INGEST_CHUNKSIZE)
+
+
+def iter_partitions(artifact, filepath, columns=None):
+    """
+    The partitions of an artifact, each cast to its registered schema.
+    columns limits the columns read.
+    """
+    from data.data_file_defs import read_artifact_chunks
+    yield from read_artifact_chunks(artifact, filepath, partition_rows(),
+                                    columns)
+
+
+@contextlib.contextmanager
+def spill_directory():
+    """Temporary directory for spilled partitions, removed after the block"""
+    spill_dir = out_of_core_settings().get("spill_dir")
+    if spill_dir:
+        os.makedirs(spill_dir, exist_ok=True)
+    path = tempfile.mkdtemp(prefix="spill_", dir=spill_dir)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def spill_partition(spill_dir, number, partition_df):
+    """
+    Write a partition to the spill directory, keeping its dtypes and
+    index, and return its path
+    """
+    path = os.path.join(spill_dir, f"partition_{number:05d}.pkl")
+    partition_df.to_pickle(path)
+    logger.debug(f"Spilled partition {number}: {len(partition_df)} rows")
+    return path
+
+
+def load_spilled_partition(path):
+    return pd.read_pickle(path)
+
+
+def column_values(series):
+    """
+    The values of a column that decide its category codes: its
+    categories if it is categorical, otherwise its distinct values
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.categories.to_numpy(dtype=object)
+    return series.dropna().unique()
+
+
+def combine_column_values(partials):
+    """Combine the column_values of separate parts of a column"""
+    values = [pd.Series(partial, dtype=object) for partial in partials]
+    return pd.unique(pd.concat(values, ignore_index=True))
+
+
+def column_categories(values):
+    """
+    Categories astype("category") gives a column holding values, sorted
+    where the values can be sorted
+    """
+    return pd.Series(values, dtype=object).astype("category").cat.categories
+
+
+def fact_partitions(columns=None):
+    """
+    The partitions of the cleaned data the session reads (its pinned
+    snapshot, else the built artifact) with the dimension columns asked
+    for joined on. columns limits the columns read.
+    """
+    from data.shared_dataset import _session_frame
+    from data.snapshots import pinned_version, snapshot_frame_path
+    from data.star_schema import (DIMENSIONS, fact_columns, join_dimensions,
+                                  needed_dimensions)
+    version = pinned_version()
+    filepath = (snapshot_frame_path(version, "data_clean") if version
+                else pipeline_state().get("cleaned_data_fname"))
+    dimensions = {key: _session_frame(key)
+                  for key in needed_dimensions(columns)}
+    if any(dim_df is None for dim_df in dimensions.values()):
+        # the pages have not loaded them, read from their artifacts
+        from data.data_file_defs import read_artifact
+        dimensions = {key: read_artifact(DIMENSIONS[key]["artifact"],
+                                         pipeline_state().get(
+                                             DIMENSIONS[key]["fname"]))
+                      for key in dimensions}
+    for partition_df in iter_partitions("cleaned_data", filepath,
+                                        fact_columns(columns)):
+        yield join_dimensions(partition_df, dimensions, columns)
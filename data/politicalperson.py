@@ -2,17 +2,19 @@ import streamlit as st
 import pandas as pd
 from utils.logger import logger
 from utils.logger import log_function_call  # Import decorator
+from utils.pipeline_state import pipeline_state
+from data.shared_dataset import get_session_frame
 from components.cleanpoliticalparty import get_party_df_from_pdpy
 
 
 @log_function_call
 def map_mp_to_party(loaddata_df):
     # Recollect data from Parliament API
-    if st.session_state.RERUN_MP_PARTY_MEMBERSHIP:
+    if pipeline_state().RERUN_MP_PARTY_MEMBERSHIP:
         # check that pdpy is installed
         try:
-            get_party_df_from_pdpy(from_date=st.session_state.min_date,
-                                   to_date=st.session_state.max_date,
+            get_party_df_from_pdpy(from_date=pipeline_state().min_date,
+                                   to_date=pipeline_state().max_date,
                                    while_mp=False,
                                    collapse=True)
         except ImportError:
@@ -20,12 +22,12 @@ def map_mp_to_party(loaddata_df):
                          " if you wish to use the Parliament API."
                          " Will proceed with last copy of saved data.")
     # Ensure required files exist
-    if st.session_state.politician_party_fname is None:
+    if pipeline_state().politician_party_fname is None:
         logger.critical("ListOfPoliticalPeople_final.csv file is missing")
         st.error("ListOfPoliticalPeople_final.csv file is missing"
                  " Political Party Mataching will not be done")
         return loaddata_df
-    if st.session_state.regentity_map_fname is None:
+    if pipeline_state().regentity_map_fname is None:
         logger.critical("Regulated entity mapping file is missing")
         st.error("Regulated entity mapping file is missing"
                  " Political Party Mataching will not be done")
@@ -41,7 +43,7 @@ def map_mp_to_party(loaddata_df):
     # Load and preprocess the political people dataset
     try:
         politician_party_dict = (
-            pd.read_csv(st.session_state.politician_party_fname))
+            pd.read_csv(pipeline_state().politician_party_fname))
         politician_party_dict.columns = (
             politician_party_dict.columns.str.strip())
     except Exception as e:
@@ -68,7 +70,7 @@ def map_mp_to_party(loaddata_df):
     logger.debug("Loaded politician_party_dict: %s",
                  politician_party_dict.head())
     # Validate PartyParents mapping dictionary
-    PartyUpdate_dict = st.session_state.data_remappings.get("PartyParents", {})
+    PartyUpdate_dict = pipeline_state().data_remappings.get("PartyParents", {})
     if not isinstance(PartyUpdate_dict, dict):
         logger.error("PartyParents mapping is not a valid dictionary")
         st.error("PartyParents mapping is not a valid dictionary"
@@ -88,7 +90,7 @@ def map_mp_to_party(loaddata_df):
     # Load and preprocess the regulated entity mapping file
     try:
         RegulatedEntityNameMatch = (
-            pd.read_csv(st.session_state.regentity_map_fname)
+            pd.read_csv(pipeline_state().regentity_map_fname)
             )
         RegulatedEntityNameMatch.columns = (
             RegulatedEntityNameMatch.columns.str.strip()
@@ -147,25 +149,26 @@ def map_mp_to_party(loaddata_df):
     )
     
     # compare rows in dataset to original data to check for duplicates
-    if len(loaddata_df) != len(st.session_state.raw_data):
+    raw_rows = len(get_session_frame("raw_data"))
+    if len(loaddata_df) != raw_rows:
         logger.error("Number of rows in loaddata_df and raw_data do not match"
                      f" {len(loaddata_df)} !="
-                     f" {len(st.session_state.raw_data)}")
+                     f" {raw_rows}")
         st.error("Number of rows in loaddata_df and raw_data do not match"
-                 f" {len(loaddata_df)} != {len(st.session_state.raw_data)}")
+                 f" {len(loaddata_df)} != {raw_rows}")
         logger.error("Attempting to remove duplicates")
         st.error("Attempting to remove duplicates")
         loaddata_df = loaddata_df.drop_duplicates()
 
         # recompare rows in dataset to original data to check for duplicates
-        if len(loaddata_df) != len(st.session_state.raw_data):
+        if len(loaddata_df) != raw_rows:
             logger.error("Number of rows in loaddata_df and raw_data"
                          " do not match"
                          f" {len(loaddata_df)} !="
-                         f" {len(st.session_state.raw_data)}"
+                         f" {raw_rows}"
                          " Political Party Mataching reversed")
             st.error("Number of rows in loaddata_df and raw_data do not match"
-                     f" {len(loaddata_df)} != {len(st.session_state.raw_data)}"
+                     f" {len(loaddata_df)} != {raw_rows}"
                      " Political Party Mataching will not be done")
             return None
 
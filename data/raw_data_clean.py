@@ -1,12 +1,16 @@
+from contextlib import nullcontext
 import streamlit as st
 import pandas as pd
-from data.data_file_defs import normalize_string_columns_for_streamlit
+from data.data_file_defs import (read_artifact_chunks,
+                                 StreamingArtifactWriter)
 from data.data_utils import try_to_use_preprocessed_data
-from data.data_dedupe import dedupe_entity_file
+from data.data_dedupe import (dedupe_entities, dedupe_entity_file,
+                               entity_map_available, load_entity_map)
 from utils.logger import (
     logger,
     log_function_call,  # Import decorator
     )
+from utils.pipeline_state import pipeline_state
 
 
 @log_function_call
@@ -35,10 +39,10 @@ def raw_data_cleanup(
     """
     logger.info("Cleaning up raw data")
     # Resolve file paths from session state if keys were provided
-    resolved_original = st.session_state.get(
+    resolved_original = pipeline_state().get(
         originaldatafilepath, originaldatafilepath
     )
-    resolved_processed = st.session_state.get(
+    resolved_processed = pipeline_state().get(
         processeddatafilepath, processeddatafilepath
     )
 
@@ -51,17 +55,155 @@ def raw_data_cleanup(
     processeddatafilepath = resolved_processed
     # Use function to check if file has been updated and if not,
     # load preprocessed data
+    map_inputs = dedupe_map_inputs(dedupe_donors, dedupe_regentity)
     preloaddata_df = try_to_use_preprocessed_data(
         originalfilepath=originaldatafilepath,
         savedfilepath=processeddatafilepath,
-        timestamp_key="cleaned_donations_last_modified")
+        artifact="cleaned_donations",
+        extra_inputs=map_inputs)
     # Check if cached data loaded successfully and return it
     if preloaddata_df is not None:
         return preloaddata_df
 
     # Load and clean the raw data
-    loaddata_df
     logger.info(f"Data loaded, shape: {loaddata_df.shape}")
+    loaddata_df = apply_raw_cleanup_transforms(loaddata_df)
+    # Regulated entities and donors are deduped independently
+    entities = []
+    if dedupe_regentity:
+        entities.append(("RegulatedEntity", "regentity_map_fname"))
+    else:
+        if logger.level <= 20:
+            st.info("Deduping of Regulated Entities not selected")
+
+    if dedupe_donors:
+        entities.append(("Donor", "donor_map_fname"))
+    else:
+        if logger.level <= 20:
+            st.info("Deduping of Donors Entities not selected")
+    loaddata_df = dedupe_entities(loaddata_df, entities, output_csv=True)
+
+    # Print progress message
+    logger.info("Raw Data cleanup completed")
+    logger.info(f"Data shape: {loaddata_df.shape}")
+
+    # Save cleaned data if required
+    if output_csv:
+        from data.data_file_defs import save_dataframe_artifact
+        saved_filepath = save_dataframe_artifact(loaddata_df, processeddatafilepath,
+                                                 index=True, artifact="cleaned_donations",
+                                                 inputs=[originaldatafilepath] + map_inputs)
+        logger.info(f"Data saved to {saved_filepath}")
+    # Save the cleaned data to session state
+    logger.info(f"Data cleanup completed, shape: {loaddata_df.shape}")
+
+    return loaddata_df
+
+
+def dedupe_map_inputs(dedupe_donors=True, dedupe_regentity=True):
+    """Mapping files the cleaned donations are built from"""
+    map_filenames = []
+    if dedupe_regentity:
+        map_filenames.append("regentity_map_fname")
+    if dedupe_donors:
+        map_filenames.append("donor_map_fname")
+    return [pipeline_state().get(map_filename)
+            for map_filename in map_filenames]
+
+
+@log_function_call
+def stream_raw_data_cleanup(
+    originaldatafilepath,
+    rawcopyfilepath=None,
+    dedupe_donors=True,
+    dedupe_regentity=True,
+    processeddatafilepath="cleaned_donations_fname",
+    chunksize=None,
+        ):
+    """
+    Streaming version of the raw data import and raw_data_cleanup. The
+    source file is read in blocks of chunksize rows, each block is cleaned
+    and deduped against the mapping files and appended to the cleaned
+    donations artifact, so only one block is held in memory at a time.
+
+    Fuzzy deduplication needs the whole file, so if a mapping file is
+    missing nothing is written and None is returned for the caller to use
+    the in-memory cleanup instead.
+
+    Args:
+        originaldatafilepath (str): path to the source data file
+        rawcopyfilepath (str, optional): if given, the imported raw blocks
+            are also written to this artifact
+        dedupe_donors (bool, optional): trigger to dedupe donors.
+        dedupe_regentity (bool, optional): trigger to dedupe regentity.
+        processeddatafilepath (str): path or session key of the cleaned
+            donations artifact
+        chunksize (int, optional): rows per block, defaults to
+            config.INGEST_CHUNKSIZE
+
+    Returns:
+        tuple: path of the cleaned donations artifact and the number of
+            rows written to it, or None
+    """
+    processeddatafilepath = pipeline_state().get(processeddatafilepath,
+                                                 processeddatafilepath)
+    # Load each mapping file once rather than for every block
+    entity_maps = {}
+    for entity, map_filename, selected in (
+            ("RegulatedEntity", "regentity_map_fname", dedupe_regentity),
+            ("Donor", "donor_map_fname", dedupe_donors)):
+        if not selected:
+            continue
+        if not entity_map_available(map_filename):
+            logger.warning(f"Map file {map_filename} not available,"
+                           " streaming import needs the full file in memory"
+                           " for fuzzy deduplication.")
+            return None
+        entity_maps[entity] = (map_filename, load_entity_map(
+            pipeline_state().get(map_filename), f"{entity}Id"))
+
+    row_offset = 0
+    raw_writer = (StreamingArtifactWriter(rawcopyfilepath,
+                                          artifact="imported_raw")
+                  if rawcopyfilepath else nullcontext())
+    with raw_writer, StreamingArtifactWriter(
+            processeddatafilepath, artifact="cleaned_donations") as writer:
+        for chunk_df in read_artifact_chunks("source", originaldatafilepath,
+                                             chunksize):
+            if rawcopyfilepath:
+                raw_writer.append(chunk_df)
+            chunk_df = apply_raw_cleanup_transforms(chunk_df)
+            for entity, (map_filename, entity_map) in entity_maps.items():
+                chunk_df = dedupe_entity_file(
+                    loaddata_dd_df=chunk_df,
+                    entity=entity,
+                    map_filename=map_filename,
+                    entity_map=entity_map
+                )
+            if entity_maps:
+                # number the rows of each block on from the previous block
+                chunk_df.index = pd.RangeIndex(row_offset,
+                                               row_offset + len(chunk_df))
+            row_offset += len(chunk_df)
+            writer.append(chunk_df)
+            logger.info(f"Streamed {row_offset} rows to cleaned donations")
+    logger.info(f"Streaming raw data cleanup completed, {row_offset} rows")
+    return writer.filepath, row_offset
+
+
+def apply_raw_cleanup_transforms(loaddata_df):
+    """
+    Row-local cleanup of raw donation records: currency parsing, text
+    filling, stripping and title-casing, and placeholder names and IDs.
+    Each row is cleaned independently, so the transforms can be applied
+    to the whole file or to one chunk of it at a time.
+
+    Args:
+        loaddata_df (pd.DataFrame): raw donation records
+
+    Returns:
+        loaddata_df: cleaned donation records
+    """
     # Remove Currency sign of Value and convert to Float
     # Handle "Value" column correctly
     loaddata_df["Value"] = (
@@ -104,8 +246,9 @@ def raw_data_cleanup(
     # label index to index
     loaddata_df.index.name = "index"
     # bulk change all columns to string and replace NaN with empty string
+    # (categorical columns are converted first so "" can be filled in)
     loaddata_df[columns_to_fill] = (
-        loaddata_df[columns_to_fill].fillna("").astype(str))
+        loaddata_df[columns_to_fill].astype("object").fillna("").astype(str))
     # remove leading and trailing spaces from DonorName, RegulatedEntityName
     # remove leading and trailing spaces from DonorID and RegulatedEntityID
     # remove leading and trailing spaces from CampaignName and PurposeOfVisit
@@ -199,39 +342,5 @@ def raw_data_cleanup(
     loaddata_df["DonorStatus"] = loaddata_df["DonorStatus"].replace(
         "", "Unidentified Donor"
     )
-    if dedupe_regentity:
-        loaddata_df = dedupe_entity_file(
-            loaddata_dd_df=loaddata_df,
-            entity="RegulatedEntity",
-            map_filename="regentity_map_fname",
-            output_csv=True
-        )
-    else:
-        if logger.level <= 20:
-            st.info("Deduping of Regulated Entities not selected")
-
-    if dedupe_donors:
-        loaddata_df = dedupe_entity_file(
-            loaddata_dd_df=loaddata_df,
-            entity="Donor",
-            map_filename="donor_map_fname",
-            output_csv=True
-        )
-    else:
-        if logger.level <= 20:
-            st.info("Deduping of Donors Entities not selected")
-
-    # Print progress message
-    logger.info("Raw Data cleanup completed")
-    logger.info(f"Data shape: {loaddata_df.shape}")
-
-    # Save cleaned data if required
-    if output_csv:
-        from data.data_file_defs import save_dataframe_to_zip, normalize_string_columns_for_streamlit
-        loaddata_df = normalize_string_columns_for_streamlit(loaddata_df)
-        save_dataframe_to_zip(loaddata_df, processeddatafilepath, index=True)
-        logger.info(f"Data saved to {processeddatafilepath.replace('.csv', '.zip')}")
-    # Save the cleaned data to session state
-    logger.info(f"Data cleanup completed, shape: {loaddata_df.shape}")
 
     return loaddata_df
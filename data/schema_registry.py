@@ -0,0 +1,418 @@
+"""
+Schema registry for the pipeline artifacts.
+
+Each artifact lists the stage that produces it, the column used as its
+index and, for every column, a logical type, whether nulls are allowed and
+whether the column is low-cardinality and held as a categorical.
+The readers, writers and validators in data.data_file_defs are generated
+from these definitions so the dtypes are declared in one place.
+"""
+import numpy as np
+import pandas as pd
+from utils.logger import logger
+
+
+def column(logical_type, nullable=True, categorical=False, blank=False):
+    """
+    Describe a single artifact column. A blank column holds empty strings
+    rather than missing values (raw_data_cleanup fills them), which
+    coerce_to_schema restores when the artifact is read back.
+    """
+    return {"type": logical_type,
+            "nullable": nullable,
+            "categorical": categorical,
+            "blank": blank}
+
+
+# Text columns are held Arrow-backed, with NaN for missing values (the
+# pandas 3 default "str" dtype), or as object with pandas releases that
+# do not have it. They are converted for Streamlit only when displayed
+# (components.render_adapter).
+try:
+    STRING_DTYPE = pd.StringDtype("pyarrow", na_value=np.nan)
+except (TypeError, ImportError):
+    STRING_DTYPE = "object"
+
+# Logical type: dtype used when parsing CSV and when coercing frames
+LOGICAL_TYPES = {
+    "string": STRING_DTYPE,
+    "float": "float64",
+    "float32": "float32",
+    "int": "int64",
+    "int8": "int8",
+    "int16": "int16",
+    "int32": "int32",
+    "nullable_int": "Int64",
+    "nullable_int32": "Int32",
+    "datetime": "datetime64[ns]",
+}
+
+# Compact plan: codes, flags and ids are held in the narrowest integer
+# type for their range and derived measures as float32. Integers that do
+# not fit their compact type are kept at 64 bits (see coerce_to_schema)
+WIDE_TYPES = {
+    "int8": "int",
+    "int16": "int",
+    "int32": "int",
+    "nullable_int32": "nullable_int",
+    "float32": "float",
+}
+
+# Columns of the Electoral Commission donations export, all held as text
+# until raw_data_cleanup has parsed them
+_SOURCE_COLUMNS = {
+    "ECRef": column("string", nullable=False),
+    "RegulatedEntityName": column("string"),
+    "RegulatedEntityType": column("string", categorical=True),
+    "Value": column("string"),
+    "AcceptedDate": column("string"),
+    "AccountingUnitName": column("string"),
+    "DonorName": column("string"),
+    "AccountingUnitsAsCentralParty": column("string", categorical=True),
+    "IsSponsorship": column("string", categorical=True),
+    "DonorStatus": column("string", categorical=True),
+    "RegulatedDoneeType": column("string", categorical=True),
+    "CompanyRegistrationNumber": column("string"),
+    "Postcode": column("string"),
+    "DonationType": column("string", categorical=True),
+    "NatureOfDonation": column("string", categorical=True),
+    "PurposeOfVisit": column("string"),
+    "DonationAction": column("string", categorical=True),
+    "ReceivedDate": column("string"),
+    "ReportedDate": column("string"),
+    "IsReportedPrePoll": column("string", categorical=True),
+    "ReportingPeriodName": column("string", categorical=True),
+    "IsBequest": column("string", categorical=True),
+    "IsAggregation": column("string", categorical=True),
+    "RegulatedEntityId": column("string"),
+    "AccountingUnitId": column("string"),
+    "DonorId": column("string"),
+    "CampaigningName": column("string", categorical=True),
+    "RegisterName": column("string", categorical=True),
+    "IsIrishSource": column("string", categorical=True),
+}
+
+ARTIFACT_SCHEMAS = {  # "artifact_name": {"stage", "index", "columns"}
+    "source": {
+        "stage": "Electoral Commission export",
+        "index": 0,
+        "columns": _SOURCE_COLUMNS,
+    },
+    "imported_raw": {
+        "stage": "load_raw_data",
+        "index": 0,
+        "columns": _SOURCE_COLUMNS,
+    },
+    "improved_raw": {
+        "stage": "load_raw_data",
+        "index": 0,
+        "columns": {
+            **_SOURCE_COLUMNS,
+            "Value": column("float"),
+            "RegulatedEntityId": column("int32", nullable=False),
+            "DonorId": column("int32", nullable=False),
+        },
+    },
+    "cleaned_donations": {
+        "stage": "raw_data_cleanup",
+        "index": 0,
+        "columns": {
+            "ECRef": column("string", nullable=False),
+            "OriginalRegulatedEntityName": column("string"),
+            "RegulatedEntityType": column("string", categorical=True),
+            "Value": column("float"),
+            "AcceptedDate": column("string"),
+            "AccountingUnitName": column("string", blank=True),
+            "OriginalDonorName": column("string"),
+            "AccountingUnitsAsCentralParty": column("string",
+                                                    categorical=True),
+            "IsSponsorship": column("string", categorical=True, blank=True),
+            "DonorStatus": column("string", categorical=True, blank=True),
+            "RegulatedDoneeType": column("string", categorical=True,
+                                         blank=True),
+            "CompanyRegistrationNumber": column("string", blank=True),
+            "Postcode": column("string", blank=True),
+            "DonationType": column("string", categorical=True, blank=True),
+            "NatureOfDonation": column("string", categorical=True, blank=True),
+            "PurposeOfVisit": column("string", blank=True),
+            "DonationAction": column("string", categorical=True, blank=True),
+            "ReceivedDate": column("string"),
+            "ReportedDate": column("string"),
+            "IsReportedPrePoll": column("string", categorical=True),
+            "ReportingPeriodName": column("string", categorical=True,
+                                          blank=True),
+            "IsBequest": column("string", categorical=True, blank=True),
+            "IsAggregation": column("string", categorical=True, blank=True),
+            "OriginalRegulatedEntityId": column("nullable_int32"),
+            "AccountingUnitId": column("string", blank=True),
+            "OriginalDonorId": column("nullable_int32"),
+            "CampaigningName": column("string", categorical=True, blank=True),
+            "RegisterName": column("string", categorical=True, blank=True),
+            "IsIrishSource": column("string", categorical=True, blank=True),
+            "CleanedRegulatedEntityName": column("string"),
+            "CleanedRegulatedEntityId": column("nullable_int32"),
+            "RegulatedEntityId": column("nullable_int32", nullable=False),
+            "RegulatedEntityName": column("string", nullable=False),
+            "CleanedDonorName": column("string"),
+            "CleanedDonorId": column("nullable_int32"),
+            "DonorId": column("nullable_int32", nullable=False),
+            "DonorName": column("string", nullable=False),
+        },
+    },
+    "cleaned_data": {
+        "stage": "load_cleaned_data",
+        "index": 0,
+        "columns": {
+            "ECRef": column("string", nullable=False),
+            "RegulatedEntityType": column("string", categorical=True),
+            "Value": column("float"),
+            "IsSponsorship": column("string", categorical=True),
+            "DonorStatus": column("string", categorical=True),
+            "RegulatedDoneeType": column("string", categorical=True),
+            "DonationType": column("string", categorical=True),
+            "NatureOfDonation": column("string", categorical=True),
+            "PurposeOfVisit": column("string"),
+            "DonationAction": column("string", categorical=True),
+            "ReceivedDate": column("datetime", nullable=False),
+            "ReportingPeriodName": column("string", categorical=True),
+            "IsBequest": column("string", categorical=True),
+            "IsAggregation": column("string", categorical=True),
+            "RegisterName": column("string", categorical=True),
+            "RegulatedEntityId": column("int32", nullable=False),
+            "DonorId": column("int32", nullable=False),
+            "EventCount": column("int8", nullable=False),
+            "YearReceived": column("int16", nullable=False),
+            "MonthReceived": column("int8", nullable=False),
+            "YearMonthReceived": column("int32", nullable=False),
+            "PartyId": column("int32", nullable=False),
+            "DubiousDonor": column("int8", nullable=False),
+            "DubiousData": column("int8", nullable=False),
+            "parliamentary_sitting": column("int16", nullable=False),
+            "RegEntity_Group": column("string", categorical=True),
+            "Party_Group": column("string", categorical=True),
+            "DonationTypeInt": column("int8", nullable=False),
+            "RegulatedEntityNameInt": column("int16", nullable=False),
+            "DonorNameInt": column("int32", nullable=False),
+            "DonationActionInt": column("int8", nullable=False),
+            "DonorStatusInt": column("int8", nullable=False),
+            "PurposeOfVisitInt": column("int16", nullable=False),
+            "RegulatedDoneeTypeInt": column("int8", nullable=False),
+            "IsBequestInt": column("int8", nullable=False),
+            "IsAggregationInt": column("int8", nullable=False),
+            "IsSponsorshipInt": column("int8", nullable=False),
+            "NatureOfDonationInt": column("int8", nullable=False),
+            "RegisterNameInt": column("int8", nullable=False),
+            "PartyNameInt": column("int16", nullable=False),
+            "PartyGroupInt": column("int8", nullable=False),
+            "RegEntityGrou[Int": column("int8", nullable=False),
+            "PublicFundsInt": column("int8", nullable=False),
+            "DaysTillNextElection": column("int16", nullable=False),
+            "DaysSinceLastElection": column("int16", nullable=False),
+            "ElectoralCyclePhase": column("string", categorical=True),
+            "WksTillNextElection": column("float32"),
+            "WksSinceLastElection": column("float32"),
+            "QtrsTillNextElection": column("float32"),
+            "QtrsSinceLastElection": column("float32"),
+            "YrsTillNextElection": column("float32"),
+            "YrsSinceLastElection": column("float32"),
+            # surrogate keys into the dimension tables (data.star_schema)
+            "DonorKey": column("int32", nullable=False),
+            "RegulatedEntityKey": column("int32", nullable=False),
+            "PartyKey": column("int32", nullable=False),
+        },
+    },
+    # row hashes of the cleaned donations each cleaned_data row was built
+    # from, for incremental cleaning
+    "cleaned_data_rows": {
+        "stage": "load_cleaned_data",
+        "index": None,
+        "columns": {
+            "ECRef": column("string", nullable=False),
+            "RowHash": column("int", nullable=False),
+        },
+    },
+    "dim_donor": {
+        "stage": "load_cleaned_data",
+        "index": 0,
+        "columns": {
+            "DonorId": column("int32", nullable=False),
+            "DonorName": column("string", nullable=False, categorical=True),
+        },
+    },
+    "dim_regentity": {
+        "stage": "load_cleaned_data",
+        "index": 0,
+        "columns": {
+            "RegulatedEntityId": column("int32", nullable=False),
+            "RegulatedEntityName": column("string", nullable=False,
+                                          categorical=True),
+        },
+    },
+    "dim_party": {
+        "stage": "load_cleaned_data",
+        "index": 0,
+        "columns": {
+            "PartyId": column("int32", nullable=False),
+            "PartyName": column("string", nullable=False, categorical=True),
+            "Political Leaning": column("string", categorical=True),
+            "Special Interest": column("string", categorical=True),
+        },
+    },
+    "cleaned_donorlist": {
+        "stage": "load_donorList_data",
+        "index": None,
+        "columns": {
+            "DonorId": column("int32", nullable=False),
+            "Donor Name": column("string", nullable=False),
+            "Donations Value": column("float"),
+            "Donation Events": column("int32", nullable=False),
+            "Donation Mean": column("float"),
+        },
+    },
+    "cleaned_regentity": {
+        "stage": "load_regulated_entity_data",
+        "index": None,
+        "columns": {
+            "RegulatedEntityId": column("int32", nullable=False),
+            "Regulated Entity Name": column("string", nullable=False),
+            "Regulated Entity Group": column("string", categorical=True),
+            "Donations Value": column("float"),
+            "Donation Events": column("int32", nullable=False),
+            "Donation Mean": column("float"),
+        },
+    },
+}
+
+
+def get_schema(artifact):
+    """Return the registered schema for an artifact"""
+    if artifact not in ARTIFACT_SCHEMAS:
+        logger.error(f"Artifact {artifact} not found in schema registry")
+        raise ValueError(f"Artifact {artifact} not found in schema registry")
+    return ARTIFACT_SCHEMAS[artifact]
+
+
+def get_artifact_columns(artifact):
+    """Return the column names registered for an artifact"""
+    return list(get_schema(artifact)["columns"].keys())
+
+
+def get_blank_columns(artifact):
+    """Return the columns of an artifact that hold empty strings"""
+    return [name for name, spec in get_schema(artifact)["columns"].items()
+            if spec["blank"]]
+
+
+def get_read_csv_kwargs(artifact, columns=None):
+    """
+    Build the pd.read_csv arguments for an artifact: per-column dtypes
+    (categoricals parsed directly as "category"), the date columns to parse
+    and the index column. When columns are given only those columns are
+    described. The default C engine is used.
+    """
+    schema = get_schema(artifact)
+    dtypes = {}
+    parse_dates = []
+    for name, spec in schema["columns"].items():
+        if columns is not None and name not in columns:
+            continue
+        if spec["type"] == "datetime":
+            parse_dates.append(name)
+        elif spec["categorical"]:
+            dtypes[name] = "category"
+        else:
+            # compact integers are narrowed by coerce_to_schema once
+            # their range is known
+            dtypes[name] = LOGICAL_TYPES[WIDE_TYPES.get(spec["type"],
+                                                        spec["type"])]
+    # low_memory=False parses the file as one block so every categorical
+    # column gets a single consistent set of categories
+    read_kwargs = {"dtype": dtypes,
+                   "index_col": schema["index"],
+                   "low_memory": False}
+    if parse_dates:
+        read_kwargs["parse_dates"] = parse_dates
+    return read_kwargs
+
+
+def _compact_type_fits(series, logical_type):
+    """True if the values of a column fit its compact integer type"""
+    target = str(LOGICAL_TYPES[logical_type]).lower()
+    if not target.startswith("int") or target == "int64":
+        return True
+    values = pd.to_numeric(series, errors="coerce")
+    if values.isna().all():
+        return True
+    limits = np.iinfo(target)
+    return limits.min <= values.min() and values.max() <= limits.max
+
+
+def coerce_to_schema(df, artifact):
+    """
+    Cast the registered columns of a frame to their schema dtypes so they
+    are stored typed. Columns that cannot be cast are left unchanged and
+    logged, and integers outside the range of their compact type are
+    kept at 64 bits. Missing values of blank columns are filled with
+    empty strings, as the raw cleanup left them, whichever format the
+    artifact was read from.
+    """
+    for name, spec in get_schema(artifact)["columns"].items():
+        if name not in df.columns:
+            continue
+        target = ("category" if spec["categorical"]
+                  else LOGICAL_TYPES[spec["type"]])
+        if str(df[name].dtype) == str(target):
+            continue
+        if not _compact_type_fits(df[name], spec["type"]):
+            logger.warning(f"{artifact}: {name} does not fit {target},"
+                           " kept at 64 bits")
+            target = LOGICAL_TYPES[WIDE_TYPES[spec["type"]]]
+        try:
+            if spec["type"] == "datetime":
+                df[name] = pd.to_datetime(df[name])
+            elif spec["type"] == "string" and not spec["categorical"]:
+                values = df[name].where(df[name].isna(),
+                                        df[name].astype(str))
+                # a categorical column keeps its categories
+                if not isinstance(values.dtype, pd.CategoricalDtype):
+                    values = values.astype(target)
+                df[name] = values
+            else:
+                df[name] = df[name].astype(target)
+        except (TypeError, ValueError) as e:
+            logger.warning(f"{artifact}: could not cast {name}"
+                           f" to {target}: {e}")
+    return _fill_blanks(df, artifact)
+
+
+def _fill_blanks(df, artifact):
+    """Fill the missing values of the artifact's blank columns with ''"""
+    for name in get_blank_columns(artifact):
+        if name not in df.columns or not df[name].isna().any():
+            continue
+        values = df[name]
+        if (isinstance(values.dtype, pd.CategoricalDtype)
+                and "" not in values.cat.categories):
+            values = values.cat.add_categories([""])
+        df[name] = values.fillna("")
+    return df
+
+
+def validate_dataframe(df, artifact, columns=None):
+    """
+    Check a frame against its registered schema, or only the given
+    columns of it. Returns a list of issues (missing columns, nulls in
+    non-nullable columns), each also logged.
+    """
+    issues = []
+    for name, spec in get_schema(artifact)["columns"].items():
+        if columns is not None and name not in columns:
+            continue
+        if name not in df.columns:
+            issues.append(f"missing column {name}")
+        elif not spec["nullable"] and df[name].isna().any():
+            issues.append(f"{df[name].isna().sum()} null values"
+                          f" in non-nullable column {name}")
+    for issue in issues:
+        logger.warning(f"Schema check {artifact}: {issue}")
+    return issues
@@ -0,0 +1,251 @@
+"""
+Shared, read-only dataset for every session and process on a host.
+
+Each frame loaded by firstload is published once as an uncompressed Arrow
+IPC file in the shared directory. Processes memory-map the file, so its
+pages are held once in the OS page cache and shared between replica
+processes, and within a process each column is converted to pandas once
+and shared by all sessions through st.cache_resource. Session state
+holds only a small handle dict, resolved to the frame (or to the columns
+a page asks for) by get_session_frame.
+"""
+import os
+import pandas as pd
+import streamlit as st
+import config
+from utils.logger import logger, log_function_call
+from utils.pipeline_state import pipeline_state
+
+# session state data key: (registered artifact, session key of its file)
+SHARED_FRAMES = {
+    "raw_data": ("cleaned_donations", "cleaned_donations_fname"),
+    "data_clean": ("cleaned_data", "cleaned_data_fname"),
+    "data_donor": ("cleaned_donorlist", "cleaned_donorlist_fname"),
+    "data_regentity": ("cleaned_regentity", "cleaned_regentity_fname"),
+    "dim_donor": ("dim_donor", "dim_donor_fname"),
+    "dim_regentity": ("dim_regentity", "dim_regentity_fname"),
+    "dim_party": ("dim_party", "dim_party_fname"),
+}
+
+
+def shared_dataset_enabled():
+    """Shared frames need pyarrow and can be switched off in config"""
+    if not pipeline_state().get("SHARED_DATASET", config.SHARED_DATASET):
+        return False
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        logger.warning("pyarrow not installed, frames held per session.")
+        return False
+    return True
+
+
+def shared_frame_path(key):
+    """Path of the Arrow IPC file holding a shared frame"""
+    shared_dir = pipeline_state().get("shared_dir",
+                                      config.DIRECTORIES["shared_dir"])
+    return os.path.join(shared_dir, f"{key}.arrow")
+
+
+def is_shared_handle(value):
+    return isinstance(value, dict) and "shared_dataset" in value
+
+
+def make_handle(key, path, rows=None):
+    """Handle stored in session state in place of the frame"""
+    return {"shared_dataset": key,
+            "path": path,
+            "version": os.stat(path).st_mtime_ns,
+            "rows": rows}
+
+
+# Arrow schema metadata key recording the content hash of the artifact a
+# published frame was loaded from
+ARTIFACT_HASH_KEY = b"artifact_output_hash"
+
+
+def _artifact_hash(key):
+    """
+    Content hash of the artifact a shared frame is loaded from, as
+    recorded in the artifact manifest, None if it is not recorded
+    """
+    from data.artifact_manifest import get_manifest_entry
+    if key not in SHARED_FRAMES:
+        return None
+    entry = get_manifest_entry(pipeline_state().get(SHARED_FRAMES[key][1],
+                                                    ""))
+    return entry.get("output_hash") if entry else None
+
+
+def _published_artifact_hash(path):
+    """Artifact hash recorded in a published file, None if there is none"""
+    import pyarrow as pa
+    with pa.memory_map(path, "r") as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+    return metadata.get(ARTIFACT_HASH_KEY, b"").decode() or None
+
+
+def _published_file_is_current(key, path):
+    """
+    The published file can be reused by another process if it was
+    published from the current content of the artifact the frame was
+    loaded from.
+    """
+    if not os.path.exists(path):
+        return False
+    artifact_hash = _artifact_hash(key)
+    if artifact_hash is None:
+        return False
+    return _published_artifact_hash(path) == artifact_hash
+
+
+@log_function_call
+def publish_frame(key, df, path=None):
+    """
+    Write a frame to the shared dataset as an Arrow IPC file and return
+    its handle. Frames of registered artifacts are cast to their schema
+    so the shared copy keeps compact dtypes. The file is written under a
+    temporary name and renamed into place, so processes that have the
+    previous version mapped keep reading it undisturbed. A path given
+    for the frame (in an immutable snapshot) is reused if it exists.
+    """
+    import pyarrow as pa
+    from data import schema_registry
+    from data.data_file_defs import _prepare_for_parquet
+    if path is not None and os.path.exists(path):
+        logger.info(f"Shared frame {key} already published at {path}")
+        return make_handle(key, path, len(df))
+    path = path or shared_frame_path(key)
+    if _published_file_is_current(key, path):
+        logger.info(f"Shared frame {key} already published at {path}")
+        return make_handle(key, path, len(df))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df = df.copy(deep=False)
+    artifact = SHARED_FRAMES[key][0] if key in SHARED_FRAMES else None
+    if artifact is not None:
+        df = schema_registry.coerce_to_schema(df, artifact)
+    table = pa.Table.from_pandas(_prepare_for_parquet(df, artifact),
+                                 preserve_index=True)
+    artifact_hash = _artifact_hash(key)
+    if artifact_hash is not None:
+        table = table.replace_schema_metadata(
+            {**(table.schema.metadata or {}),
+             ARTIFACT_HASH_KEY: artifact_hash.encode()})
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+    logger.info(f"Shared frame {key} published to {path},"
+                f" {table.nbytes / 1e6:.1f} MB")
+    return make_handle(key, path, len(df))
+
+
+@st.cache_resource(max_entries=2 * len(SHARED_FRAMES))
+def _open_shared_table(path, version):
+    """
+    Memory-map a published frame once per process. Columns are paged in
+    from the file only when they are converted to pandas, so columns no
+    page asks for are never read. version is part of the cache key so a
+    republished file is mapped afresh.
+    """
+    import pyarrow as pa
+    logger.info(f"Mapping shared frame {path} (version {version})")
+    return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+
+
+@st.cache_resource(max_entries=2 * len(SHARED_FRAMES))
+def _shared_frame_index(path, version):
+    table = _open_shared_table(path, version)
+    index_columns = [name for name in
+                     table.schema.pandas_metadata["index_columns"]
+                     if isinstance(name, str)]
+    return table.select(index_columns).to_pandas().index
+
+
+# one entry per column of each published frame, for two versions
+@st.cache_resource(max_entries=256)
+def _shared_frame_column(path, version, column):
+    """
+    Convert one column of a mapped frame to pandas, once per process.
+    Numeric columns without nulls are zero-copy, read-only views of the
+    mapped file. Each column is converted once however many projections
+    include it.
+    """
+    table = _open_shared_table(path, version)
+    series = table.select([column]).to_pandas(split_blocks=True)[column]
+    series.index = _shared_frame_index(path, version)
+    return series
+
+
+def _shared_frame_columns(path, version):
+    table = _open_shared_table(path, version)
+    index_columns = table.schema.pandas_metadata["index_columns"]
+    return [name for name in table.column_names
+            if name not in index_columns]
+
+
+def open_shared_frame(handle, columns=None):
+    """
+    Resolve a shared frame handle to the frame, or to only the given
+    columns of it (columns the frame does not have are skipped)
+    """
+    if not os.path.exists(handle["path"]):
+        logger.error(f"Shared frame {handle['path']} does not exist.")
+        return None
+    path, version = handle["path"], handle["version"]
+    available = _shared_frame_columns(path, version)
+    if columns is not None:
+        wanted = set(columns)
+        available = [name for name in available if name in wanted]
+    return pd.DataFrame(
+        {name: _shared_frame_column(path, version, name)
+         for name in available},
+        index=_shared_frame_index(path, version),
+        copy=False)
+
+
+def get_session_frame(key, columns=None):
+    """
+    Return a data frame held in session state, resolving a shared
+    dataset handle to the shared read-only frame. When columns are given
+    only those columns are returned, and for a shared frame only those
+    columns are read from the mapped file. For the fact table of the star
+    schema (data_clean) the dimension columns asked for, all of them when
+    columns is None, are joined onto the fact rows, which keep the keys
+    they were joined on.
+    """
+    from data import star_schema
+    if key in star_schema.FACT_FRAMES:
+        fact_df = _session_frame(key, star_schema.fact_columns(columns))
+        if fact_df is None:
+            return None
+        dimensions = {dim_key: _session_frame(dim_key) for dim_key in
+                      star_schema.needed_dimensions(columns)}
+        return star_schema.join_dimensions(fact_df, dimensions, columns)
+    return _session_frame(key, columns)
+
+
+def _session_frame(key, columns=None):
+    value = pipeline_state().get(key)
+    if is_shared_handle(value):
+        return open_shared_frame(value, columns)
+    if value is not None and columns is not None:
+        wanted = set(columns)
+        return value[[name for name in value.columns if name in wanted]]
+    return value
+
+
+def session_frame_rows(key):
+    """
+    Number of rows of a frame held in session state, taken from the
+    handle of a shared frame so none of its columns are read
+    """
+    value = pipeline_state().get(key)
+    if value is None:
+        return None
+    if is_shared_handle(value):
+        if value["rows"] is None:
+            return len(open_shared_frame(value, columns=[]))
+        return value["rows"]
+    return len(value)
@@ -0,0 +1,213 @@
+"""
+Immutable, versioned snapshots of the dataset the pages read.
+
+After a build the artifacts of the page frames are published as a
+snapshot: a directory in DIRECTORIES["snapshots_dir"] named by the
+version id, holding hard links to (or copies of) the artifact files and a
+snapshot_manifest.json listing each file with its content hash and rows.
+The version id is derived from the content hashes, so the same data gives
+the same version on every restart and replica, and a snapshot is never
+changed once written. The CURRENT file names the current version.
+
+Each session pins the version current when it first loaded and reads its
+frames from that snapshot, through caches keyed by the version id, so a
+rebuild by another session never changes the frames a session is shown.
+"""
+import datetime as dt
+import hashlib
+import json
+import os
+import shutil
+import config
+from data.shared_dataset import SHARED_FRAMES
+from utils.logger import logger, log_function_call
+from utils.pipeline_state import pipeline_state
+
+SNAPSHOT_MANIFEST = "snapshot_manifest.json"
+CURRENT_POINTER = "CURRENT"
+SHARED_SUBDIR = "shared"
+
+# Frames published in a snapshot, those the pages read
+SNAPSHOT_FRAMES = [key for key in SHARED_FRAMES if key != "raw_data"]
+
+
+def snapshots_dir():
+    return pipeline_state().get("snapshots_dir",
+                                config.DIRECTORIES["snapshots_dir"])
+
+
+def snapshot_dir(version):
+    return os.path.join(snapshots_dir(), version)
+
+
+def snapshot_frame_path(version, key):
+    """Artifact file of a frame in a snapshot, None if it has none"""
+    entry = load_snapshot_manifest(version)["frames"].get(key)
+    return entry and os.path.join(snapshot_dir(version), entry["file"])
+
+
+def snapshot_shared_path(version, key):
+    """Arrow IPC file of a frame in a snapshot, for the shared dataset"""
+    return os.path.join(snapshot_dir(version), SHARED_SUBDIR,
+                        f"{key}.arrow")
+
+
+def current_version():
+    """Version id the CURRENT pointer names, None before the first build"""
+    pointer = os.path.join(snapshots_dir(), CURRENT_POINTER)
+    try:
+        with open(pointer, "r") as f:
+            version = f.read().strip()
+    except OSError:
+        return None
+    if not os.path.exists(os.path.join(snapshot_dir(version),
+                                       SNAPSHOT_MANIFEST)):
+        logger.warning(f"Current snapshot {version} not found.")
+        return None
+    return version
+
+
+def set_current_version(version):
+    """Point CURRENT at a version, replacing the pointer in one step"""
+    pointer = os.path.join(snapshots_dir(), CURRENT_POINTER)
+    tmp_pointer = f"{pointer}.{os.getpid()}.tmp"
+    with open(tmp_pointer, "w") as f:
+        f.write(version)
+    os.replace(tmp_pointer, pointer)
+    logger.info(f"Current snapshot is {version}")
+
+
+def load_snapshot_manifest(version):
+    with open(os.path.join(snapshot_dir(version), SNAPSHOT_MANIFEST),
+              "r") as f:
+        return json.load(f)
+
+
+def _artifact_entries():
+    """Manifest entry of the artifact of each snapshot frame"""
+    from data.artifact_manifest import get_manifest_entry
+    return {key: get_manifest_entry(
+                pipeline_state().get(SHARED_FRAMES[key][1]))
+            for key in SNAPSHOT_FRAMES}
+
+
+def version_id(entries):
+    """Version id of a set of artifacts, from their content hashes"""
+    content = json.dumps({key: entry["output_hash"]
+                          for key, entry in entries.items()},
+                         sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()[:16]
+
+
+def snapshot_is_current(version):
+    """
+    True if the snapshot holds the artifacts as the manifest records
+    them now, and they are up to date with their inputs
+    """
+    from data.data_loader import cleaned_data_is_current
+    try:
+        frames = load_snapshot_manifest(version)["frames"]
+    except (OSError, ValueError, KeyError):
+        return False
+    for key, entry in _artifact_entries().items():
+        if entry is None or frames.get(key, {}).get(
+                "output_hash") != entry["output_hash"]:
+            logger.info(f"Snapshot {version} does not hold the current {key}")
+            return False
+    return cleaned_data_is_current()
+
+
+def _link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+@log_function_call
+def publish_snapshot():
+    """
+    Publish the current artifacts of the snapshot frames as a snapshot and
+    point CURRENT at it. A snapshot of the same content is reused. The
+    snapshot is written to a temporary directory and renamed into place.
+    Returns the version id, None if an artifact is missing.
+    """
+    from data.artifact_manifest import code_version
+    from data.data_file_defs import resolve_artifact_path
+    entries = _artifact_entries()
+    missing = [key for key, entry in entries.items() if entry is None]
+    if missing:
+        logger.error(f"Snapshot not published, no artifact for {missing}.")
+        return None
+    version = version_id(entries)
+    target_dir = snapshot_dir(version)
+    if not os.path.exists(os.path.join(target_dir, SNAPSHOT_MANIFEST)):
+        tmp_dir = f"{target_dir}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        frames = {}
+        for key, entry in entries.items():
+            artifact, fname_key = SHARED_FRAMES[key]
+            source = resolve_artifact_path(pipeline_state().get(fname_key))
+            _link_or_copy(source, os.path.join(tmp_dir, entry["path"]))
+            frames[key] = {"artifact": artifact,
+                           "file": entry["path"],
+                           "output_hash": entry["output_hash"],
+                           "rows": entry["rows"]}
+        snapshot = {"version": version,
+                    "created_at": dt.datetime.now().isoformat(
+                        timespec="seconds"),
+                    "previous_version": current_version(),
+                    "code_version": code_version(),
+                    "frames": frames}
+        with open(os.path.join(tmp_dir, SNAPSHOT_MANIFEST), "w") as f:
+            json.dump(snapshot, f, indent=4)
+        try:
+            os.rename(tmp_dir, target_dir)
+            logger.info(f"Snapshot {version} published to {target_dir}")
+        except OSError:
+            # published by another process in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    set_current_version(version)
+    prune_snapshots()
+    return version
+
+
+def list_snapshots():
+    """Manifests of the published snapshots, newest first"""
+    snapshots = []
+    if not os.path.isdir(snapshots_dir()):
+        return snapshots
+    for version in os.listdir(snapshots_dir()):
+        try:
+            snapshots.append(load_snapshot_manifest(version))
+        except (OSError, ValueError):
+            continue
+    return sorted(snapshots, key=lambda s: s["created_at"], reverse=True)
+
+
+def prune_snapshots(keep=None):
+    """
+    Remove all but the newest keep snapshots, never the current one.
+    Sessions pinned to a removed snapshot keep the frames they hold.
+    """
+    keep = keep or config.SNAPSHOTS["keep"]
+    current = current_version()
+    for snapshot in list_snapshots()[keep:]:
+        if snapshot["version"] == current:
+            continue
+        shutil.rmtree(snapshot_dir(snapshot["version"]), ignore_errors=True)
+        logger.info(f"Snapshot {snapshot['version']} removed")
+
+
+def pinned_version():
+    """Version the session pinned when it first loaded, if any"""
+    return pipeline_state().get("dataset_version")
+
+
+def pin_version(version):
+    """Pin the session to a version unless it is already pinned"""
+    if pinned_version() is None:
+        pipeline_state()["dataset_version"] = version
+        logger.info(f"Session pinned to snapshot {version}")
+    return pinned_version()
@@ -0,0 +1,200 @@
+"""
+Content-addressed backups of the partitioned source store.
+
+Each partition of the store is split into chunks of
+SOURCE_STORE["backup_chunk_rows"] register positions. A record keeps its
+position when it is replaced, so an append changes only the chunks
+holding the records it inserts or replaces. Chunks are stored once,
+gzipped and named by the hash of their content, in the chunks directory
+of the backup directory. A backup is a JSON file listing the chunks of
+every partition and the store manifest at the time, so it adds only the
+chunks no earlier backup holds. Partitions unchanged since the previous
+backup are not read again.
+
+A backup can be restored over the store: partitions that differ from the
+backup are rewritten from its chunks and the ECRef index is rebuilt.
+"""
+import datetime as dt
+import gzip
+import hashlib
+import json
+import os
+import pandas as pd
+import config
+from data.source_store import (EXPORT_LINE_TERMINATOR, ROW_COLUMN,
+                               _index_entries, _partition_path,
+                               _read_partition, _save_ecref_index,
+                               _save_store_manifest, _write_partition,
+                               load_store_manifest, partition_keys, store_dir)
+from utils.logger import logger
+
+CHUNKS_SUBDIR = "chunks"
+BACKUP_SUFFIX = ".json"
+
+
+def backup_dir(dirpath):
+    return os.path.join(dirpath, config.SOURCE_STORE["backup_dir"])
+
+
+def _chunk_path(dirpath, digest):
+    return os.path.join(backup_dir(dirpath), CHUNKS_SUBDIR, digest[:2],
+                        f"{digest}.csv.gz")
+
+
+def _write_chunk(dirpath, chunk_df):
+    """
+    Store a chunk of records unless a chunk with the same content is
+    stored already. Returns its hash and the bytes written (0 if stored).
+    """
+    content = chunk_df.to_csv(
+        lineterminator=EXPORT_LINE_TERMINATOR).encode("utf-8")
+    digest = hashlib.sha256(content).hexdigest()
+    filepath = _chunk_path(dirpath, digest)
+    if os.path.exists(filepath):
+        return digest, 0
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    tmp_filepath = f"{filepath}.{os.getpid()}.tmp"
+    with gzip.open(tmp_filepath, "wb") as f:
+        f.write(content)
+    os.replace(tmp_filepath, filepath)
+    return digest, os.path.getsize(filepath)
+
+
+def _read_chunk(dirpath, digest):
+    df = pd.read_csv(_chunk_path(dirpath, digest), dtype=str,
+                     compression="gzip", index_col=0)
+    df.index = df.index.astype("int64").rename(ROW_COLUMN)
+    return df
+
+
+def _chunk_partition(dirpath, partition_df):
+    """Store the chunks of a partition, returning their hashes and bytes"""
+    chunk_rows = config.SOURCE_STORE["backup_chunk_rows"]
+    digests = []
+    new_bytes = 0
+    for _, chunk_df in partition_df.sort_index().groupby(
+            partition_df.index // chunk_rows, sort=True):
+        digest, written = _write_chunk(dirpath, chunk_df)
+        digests.append(digest)
+        new_bytes += written
+    return digests, new_bytes
+
+
+def list_backups(source_filepath):
+    """Backups of the store for a source file, oldest first"""
+    directory = backup_dir(store_dir(source_filepath))
+    if not os.path.isdir(directory):
+        return []
+    backups = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(BACKUP_SUFFIX):
+            continue
+        with open(os.path.join(directory, name), "r") as f:
+            backups.append(json.load(f))
+    return backups
+
+
+def load_backup(source_filepath, backup_id):
+    filepath = os.path.join(backup_dir(store_dir(source_filepath)),
+                            backup_id + BACKUP_SUFFIX)
+    if not os.path.exists(filepath):
+        raise FileNotFoundError(f"Backup {backup_id} not found")
+    with open(filepath, "r") as f:
+        return json.load(f)
+
+
+def backup_store(source_filepath, note=None):
+    """
+    Back up the store as it is now, storing only the chunks that no
+    earlier backup holds. Returns the backup's record.
+    """
+    dirpath = store_dir(source_filepath)
+    store_manifest = load_store_manifest(dirpath)
+    if store_manifest is None:
+        raise FileNotFoundError(f"Source store {dirpath} does not exist")
+    backups = list_backups(source_filepath)
+    previous = backups[-1]["partitions"] if backups else {}
+    partitions = {}
+    new_bytes = 0
+    for partition, entry in sorted(store_manifest["partitions"].items()):
+        if previous.get(partition, {}).get("sha256") == entry["sha256"]:
+            chunks = previous[partition]["chunks"]
+        else:
+            chunks, written = _chunk_partition(
+                dirpath, _read_partition(dirpath, partition))
+            new_bytes += written
+        partitions[partition] = {**entry, "chunks": chunks}
+
+    now = dt.datetime.now()
+    backup_id = now.strftime("%Y%m%d_%H%M%S")
+    existing = {backup["backup_id"] for backup in backups}
+    n = 1
+    while backup_id in existing:
+        backup_id = f"{now.strftime('%Y%m%d_%H%M%S')}_{n}"
+        n += 1
+    backup = {"backup_id": backup_id,
+              "created_at": now.isoformat(timespec="seconds"),
+              "note": note,
+              "rows": store_manifest["rows"],
+              "new_bytes": new_bytes,
+              "store_manifest": store_manifest,
+              "partitions": partitions}
+    filepath = os.path.join(backup_dir(dirpath), backup_id + BACKUP_SUFFIX)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    tmp_filepath = f"{filepath}.{os.getpid()}.tmp"
+    with open(tmp_filepath, "w") as f:
+        json.dump(backup, f, indent=4, sort_keys=True)
+    os.replace(tmp_filepath, filepath)
+    logger.info(f"Source store backed up as {backup_id},"
+                f" {new_bytes / 1e6:.2f} MB of new chunks")
+    return backup
+
+
+def restore_backup(source_filepath, backup_id):
+    """
+    Restore the store to a backup. The current store is backed up first,
+    partitions that differ from the backup are rewritten from its chunks,
+    partitions the backup does not hold are removed and the ECRef index
+    is rebuilt. Returns the partitions rewritten.
+    """
+    dirpath = store_dir(source_filepath)
+    backup = load_backup(source_filepath, backup_id)
+    backup_store(source_filepath, note=f"before restoring {backup_id}")
+    store_manifest = load_store_manifest(dirpath)
+    columns = backup["store_manifest"]["columns"]
+
+    rewritten = []
+    partition_entries = {}
+    partition_dfs = []
+    for partition, entry in sorted(backup["partitions"].items()):
+        current = store_manifest["partitions"].get(partition, {})
+        if (current.get("sha256") == entry["sha256"]
+                and os.path.exists(_partition_path(dirpath, partition))):
+            partition_df = _read_partition(dirpath, partition)
+            partition_entries[partition] = current
+        else:
+            partition_df = pd.concat([_read_chunk(dirpath, digest)
+                                      for digest in entry["chunks"]])
+            partition_entries[partition] = _write_partition(
+                dirpath, partition, partition_df)
+            rewritten.append(partition)
+        partition_dfs.append(partition_df)
+    for partition in set(store_manifest["partitions"]) - set(
+            backup["partitions"]):
+        os.remove(_partition_path(dirpath, partition))
+        rewritten.append(partition)
+
+    source_df = pd.concat(partition_dfs).reindex(columns=columns)
+    _save_ecref_index(dirpath, _index_entries(source_df,
+                                              partition_keys(source_df),
+                                              columns))
+    # the manifest is written last, as in append_export
+    _save_store_manifest(dirpath, {
+        **backup["store_manifest"],
+        "partitions": partition_entries,
+        "updated_at": dt.datetime.now().isoformat(timespec="seconds"),
+        "restored_from": backup_id,
+    })
+    logger.info(f"Source store restored to {backup_id},"
+                f" partitions rewritten: {sorted(rewritten)}")
+    return sorted(rewritten)
@@ -0,0 +1,318 @@
+"""
+Partitioned store of the Electoral Commission source records.
+
+The records are held as one CSV-in-ZIP partition per year received, next
+to an ECRef index recording, for every donation, the partition holding
+it, its position in the register and a hash of its fields. Appending an
+export looks each ECRef up in the index and rewrites only the partitions
+that receive new or changed records, instead of reading, deduplicating
+and rewriting the whole register.
+
+The store manifest lists the partitions with their row counts and
+content hashes. It is written last, so it changes whenever the stored
+records do, and the artifact manifest hashes it as the source input.
+When a store exists for the source file it is read in place of the file.
+"""
+import datetime as dt
+import json
+import os
+import numpy as np
+import pandas as pd
+import config
+from data import schema_registry
+from data.data_file_defs import (_read_csv_from_zip_or_csv,
+                                 save_dataframe_to_zip)
+from utils.logger import logger
+
+# Date columns tried in turn to place a record in a partition
+PARTITION_DATE_COLUMNS = ["ReceivedDate", "AcceptedDate", "ReportedDate"]
+PARTITION_DATE_FORMAT = "%d/%m/%Y"
+UNDATED_PARTITION = "undated"
+# Line ending of the Electoral Commission export. Some text fields hold
+# bare carriage returns, which only read back as part of the field when
+# the lines end in CRLF.
+EXPORT_LINE_TERMINATOR = "\r\n"
+# Name of the column holding each record's position in the register
+ROW_COLUMN = "index"
+
+
+def store_dir(source_filepath):
+    """Directory of the store kept for a source file"""
+    base = os.path.splitext(os.fspath(source_filepath).strip())[0]
+    return base + config.SOURCE_STORE["suffix"]
+
+
+def _store_file(dirpath, key):
+    return os.path.join(dirpath, config.SOURCE_STORE[key])
+
+
+def _partition_path(dirpath, partition):
+    return os.path.join(dirpath, f"{partition}.zip")
+
+
+def store_exists(source_filepath):
+    if not source_filepath:
+        return False
+    return os.path.exists(_store_file(store_dir(source_filepath),
+                                      "manifest_file"))
+
+
+def store_input_path(source_filepath):
+    """
+    File whose content hash stands for the source data: the store
+    manifest when a store exists, otherwise the source file itself
+    """
+    if store_exists(source_filepath):
+        return _store_file(store_dir(source_filepath), "manifest_file")
+    return source_filepath
+
+
+def load_store_manifest(dirpath):
+    """Load the store manifest, None if there is no store"""
+    try:
+        with open(_store_file(dirpath, "manifest_file"), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _save_store_manifest(dirpath, store_manifest):
+    filepath = _store_file(dirpath, "manifest_file")
+    tmp_filepath = f"{filepath}.{os.getpid()}.tmp"
+    with open(tmp_filepath, "w") as f:
+        json.dump(store_manifest, f, indent=4, sort_keys=True)
+    os.replace(tmp_filepath, filepath)
+
+
+def _load_ecref_index(dirpath):
+    return pd.read_parquet(_store_file(dirpath, "index_file"))
+
+
+def _save_ecref_index(dirpath, ecref_index):
+    filepath = _store_file(dirpath, "index_file")
+    tmp_filepath = f"{filepath}.{os.getpid()}.tmp"
+    ecref_index.to_parquet(tmp_filepath, index=False)
+    os.replace(tmp_filepath, filepath)
+
+
+def partition_keys(df):
+    """
+    Partition of each record: the year of the first of its received,
+    accepted or reported dates that parses, else "undated"
+    """
+    dates = pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+    for col in PARTITION_DATE_COLUMNS:
+        if col in df.columns:
+            dates = dates.fillna(pd.to_datetime(df[col],
+                                                format=PARTITION_DATE_FORMAT,
+                                                errors="coerce"))
+    years = dates.dt.year
+    return years.map(lambda year: UNDATED_PARTITION if pd.isna(year)
+                     else str(int(year)))
+
+
+def row_hashes(df, columns):
+    """Hash of each record's fields as stored, to detect changed records"""
+    return pd.util.hash_pandas_object(
+        df.reindex(columns=columns).fillna(""), index=False).to_numpy()
+
+
+def _read_text(filepath):
+    """
+    Read a CSV or CSV-in-ZIP of source records as text, so records are
+    stored exactly as exported. A leading index column is kept as the
+    register position. Returns the frame and whether it had one.
+    """
+    df = pd.read_csv(_read_csv_from_zip_or_csv(filepath), dtype=str)
+    first_column = df.columns[0]
+    if first_column in (ROW_COLUMN, "Unnamed: 0"):
+        df = df.set_index(first_column)
+        df.index = df.index.astype("int64").rename(ROW_COLUMN)
+        return df, True
+    return df, False
+
+
+def _read_partition(dirpath, partition):
+    return _read_text(_partition_path(dirpath, partition))[0]
+
+
+def _write_partition(dirpath, partition, df):
+    """Write a partition in register order, returning its manifest entry"""
+    from data.artifact_manifest import file_hash
+    filepath = save_dataframe_to_zip(df.sort_index(),
+                                     _partition_path(dirpath, partition),
+                                     index=True,
+                                     lineterminator=EXPORT_LINE_TERMINATOR)
+    return {"rows": int(len(df)), "sha256": file_hash(filepath)}
+
+
+def _index_entries(df, partitions, columns):
+    return pd.DataFrame({"ECRef": df["ECRef"].to_numpy(),
+                         "partition": partitions.to_numpy(),
+                         "row": df.index.to_numpy(dtype="int64"),
+                         "row_hash": row_hashes(df, columns)})
+
+
+def build_store(source_filepath, from_filepath=None):
+    """
+    Create the store for a source file from the records in from_filepath
+    (the source file itself by default), keeping the first record of
+    each ECRef. Returns the number of records stored.
+    """
+    dirpath = store_dir(source_filepath)
+    if load_store_manifest(dirpath) is not None:
+        raise FileExistsError(f"Source store {dirpath} already exists")
+    source_df, has_rows = _read_text(from_filepath or source_filepath)
+    source_df = source_df.dropna(subset=["ECRef"]).drop_duplicates(
+        subset=["ECRef"], keep="first")
+    if not has_rows:
+        source_df.index = pd.RangeIndex(len(source_df), name=ROW_COLUMN)
+    columns = source_df.columns.tolist()
+    partitions = partition_keys(source_df)
+    os.makedirs(dirpath, exist_ok=True)
+    partition_entries = {}
+    for partition, partition_df in source_df.groupby(partitions, sort=True):
+        partition_entries[partition] = _write_partition(dirpath, partition,
+                                                        partition_df)
+    _save_ecref_index(dirpath, _index_entries(source_df, partitions, columns))
+    _save_store_manifest(dirpath, {
+        "columns": columns,
+        "partitions": partition_entries,
+        "next_row": int(source_df.index.max()) + 1 if len(source_df) else 0,
+        "rows": int(len(source_df)),
+        "updated_at": dt.datetime.now().isoformat(timespec="seconds"),
+    })
+    logger.info(f"Source store {dirpath} created with {len(source_df)}"
+                f" records in {len(partition_entries)} partitions")
+    return len(source_df)
+
+
+def append_export(source_filepath, export_filepath, backup=True):
+    """
+    Add the records of an export to the store. Records whose ECRef is
+    not in the index are inserted, records whose fields differ from the
+    stored version replace it in place, and records identical to the
+    stored version (or repeated within the export) are duplicates. Only
+    the partitions holding inserted or replaced records are rewritten.
+
+    Returns:
+        dict: counts of received, inserted, updated, duplicate and
+            rejected (no ECRef) records and the partitions rewritten
+    """
+    dirpath = store_dir(source_filepath)
+    store_manifest = load_store_manifest(dirpath)
+    if store_manifest is None:
+        raise FileNotFoundError(f"Source store {dirpath} does not exist")
+    columns = store_manifest["columns"]
+    export_df, _ = _read_text(export_filepath)
+    received = len(export_df)
+    export_df = export_df.reset_index(drop=True).reindex(columns=columns)
+    has_ecref = export_df["ECRef"].notna()
+    rejected = int((~has_ecref).sum())
+    export_df = export_df[has_ecref].drop_duplicates(subset=["ECRef"],
+                                                     keep="first")
+    repeated = received - rejected - len(export_df)
+
+    ecref_index = _load_ecref_index(dirpath).set_index("ECRef")
+    hashes = row_hashes(export_df, columns)
+    stored = ecref_index.reindex(export_df["ECRef"])
+    known = stored["row"].notna().to_numpy()
+    unchanged = known & (stored["row_hash"].to_numpy() == hashes)
+    changed = known & ~unchanged
+    inserted = ~known
+    counts = {"received": received,
+              "inserted": int(inserted.sum()),
+              "updated": int(changed.sum()),
+              "duplicates": int(unchanged.sum()) + repeated,
+              "rejected": rejected,
+              "partitions": []}
+    if not (inserted.any() or changed.any()):
+        logger.info(f"No new or changed records in {export_filepath}")
+        return counts
+
+    # Replaced records keep their position in the register, new records
+    # are numbered on from the last one
+    next_row = store_manifest["next_row"]
+    rows = np.empty(len(export_df), dtype="int64")
+    rows[changed] = stored["row"].to_numpy()[changed]
+    rows[inserted] = np.arange(next_row, next_row + inserted.sum())
+    export_df.index = pd.Index(rows, name=ROW_COLUMN)
+    export_df = export_df[changed | inserted]
+    partitions = partition_keys(export_df)
+    replaced = export_df["ECRef"][changed[changed | inserted]]
+    old_partitions = ecref_index.loc[replaced, "partition"]
+    touched = sorted(set(partitions) | set(old_partitions))
+    if backup:
+        # only the chunks no earlier backup holds are written
+        from data.source_backup import backup_store
+        backup_store(source_filepath,
+                     note=f"before {os.path.basename(export_filepath)}")
+
+    for partition in touched:
+        if partition in store_manifest["partitions"]:
+            partition_df = _read_partition(dirpath, partition)
+            partition_df = partition_df[~partition_df["ECRef"].isin(replaced)]
+        else:
+            partition_df = export_df.iloc[0:0]
+        partition_df = pd.concat([partition_df,
+                                  export_df[partitions == partition]])
+        store_manifest["partitions"][partition] = _write_partition(
+            dirpath, partition, partition_df)
+        logger.info(f"Partition {partition} rewritten,"
+                    f" {len(partition_df)} records")
+
+    ecref_index = pd.concat([
+        ecref_index.drop(index=replaced).reset_index(),
+        _index_entries(export_df, partitions, columns)],
+        ignore_index=True)
+    _save_ecref_index(dirpath, ecref_index)
+    counts["partitions"] = touched
+    store_manifest.update({
+        "next_row": int(next_row + inserted.sum()),
+        "rows": int(len(ecref_index)),
+        "updated_at": dt.datetime.now().isoformat(timespec="seconds"),
+        "last_append": {"export": os.path.basename(export_filepath),
+                        **counts},
+    })
+    # the manifest is written last, so an interrupted append leaves the
+    # store hash unchanged and is repeated in full when run again
+    _save_store_manifest(dirpath, store_manifest)
+    logger.info(f"Appended {export_filepath}: {counts}")
+    return counts
+
+
+def _read_partition_artifact(dirpath, partition, artifact):
+    read_kwargs = schema_registry.get_read_csv_kwargs(artifact)
+    return pd.read_csv(
+        _read_csv_from_zip_or_csv(_partition_path(dirpath, partition)),
+        **read_kwargs)
+
+
+def read_store(source_filepath, artifact="source"):
+    """
+    Read every partition of the store into one frame in register order,
+    cast to the registered schema of the artifact
+    """
+    dirpath = store_dir(source_filepath)
+    store_manifest = load_store_manifest(dirpath)
+    source_df = pd.concat(
+        [_read_partition_artifact(dirpath, partition, artifact)
+         for partition in sorted(store_manifest["partitions"])])
+    # categories differ between partitions, so cast once after combining
+    source_df = schema_registry.coerce_to_schema(source_df.sort_index(),
+                                                 artifact)
+    schema_registry.validate_dataframe(source_df, artifact)
+    return source_df
+
+
+def iter_store_chunks(source_filepath, artifact="source"):
+    """
+    Yield the store one partition at a time (a year of records), each in
+    register order and cast to the registered schema of the artifact
+    """
+    dirpath = store_dir(source_filepath)
+    store_manifest = load_store_manifest(dirpath)
+    for partition in sorted(store_manifest["partitions"]):
+        chunk_df = _read_partition_artifact(dirpath, partition, artifact)
+        yield schema_registry.coerce_to_schema(chunk_df.sort_index(),
+                                               artifact)
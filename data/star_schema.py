@@ -0,0 +1,179 @@
+"""
+Star schema for the cleaned donations.
+
+cleaned_data is stored as a narrow fact table: every donation row holds
+integer keys into dimension tables for the donor, the regulated entity
+and the party, which hold their names and attributes once. After
+deduplication a DonorId or PartyId can still carry more than one name, so
+each dimension is keyed by a surrogate key over its distinct rows,
+numbered in (id, name) order. The ids themselves stay on the fact rows
+so counts and groupings run on integers, and names are joined back onto
+a frame only for the columns a page asks for.
+"""
+import pandas as pd
+from utils.logger import logger
+from utils.pipeline_state import pipeline_state
+
+# dimension session key: artifact, session key of its file, surrogate key
+# column on the fact rows and the columns the dimension holds
+DIMENSIONS = {
+    "dim_donor": {
+        "artifact": "dim_donor",
+        "fname": "dim_donor_fname",
+        "key": "DonorKey",
+        "columns": ["DonorId", "DonorName"],
+    },
+    "dim_regentity": {
+        "artifact": "dim_regentity",
+        "fname": "dim_regentity_fname",
+        "key": "RegulatedEntityKey",
+        "columns": ["RegulatedEntityId", "RegulatedEntityName"],
+    },
+    "dim_party": {
+        "artifact": "dim_party",
+        "fname": "dim_party_fname",
+        "key": "PartyKey",
+        "columns": ["PartyId", "PartyName", "Political Leaning",
+                    "Special Interest"],
+    },
+}
+
+# fact frame session key: the dimensions its rows are keyed into
+FACT_FRAMES = {"data_clean": list(DIMENSIONS)}
+
+# ids kept on the fact rows as well as in their dimension
+FACT_IDS = ["DonorId", "RegulatedEntityId", "PartyId"]
+
+
+def dimension_columns(dim_key):
+    """Columns held only by a dimension and joined onto the fact rows"""
+    return [name for name in DIMENSIONS[dim_key]["columns"]
+            if name not in FACT_IDS]
+
+
+def distinct_dimension_rows(df):
+    """
+    The distinct rows of each dimension's columns in a frame. Distinct
+    rows of separate parts of the data are combined by
+    combine_dimension_rows.
+    """
+    return {dim_key: df[dim["columns"]].drop_duplicates()
+            for dim_key, dim in DIMENSIONS.items()}
+
+
+def combine_dimension_rows(partials):
+    """Combine the distinct_dimension_rows of separate parts of the data"""
+    return {dim_key: pd.concat([partial[dim_key] for partial in partials],
+                               ignore_index=True).drop_duplicates()
+            for dim_key in DIMENSIONS}
+
+
+def build_dimensions(dimension_rows):
+    """
+    Dimension tables from the distinct rows of each dimension: a dict of
+    dimension session key to the dimension frame indexed by its surrogate
+    key, numbered in the sorted order of the rows
+    """
+    dimensions = {}
+    for dim_key, dim in DIMENSIONS.items():
+        rows = dimension_rows[dim_key]
+        keys = rows.groupby(dim["columns"], observed=True, dropna=False,
+                            sort=True).ngroup().astype("int32")
+        dimensions[dim_key] = (rows.assign(**{dim["key"]: keys})
+                               .set_index(dim["key"])
+                               .sort_index())
+        logger.info(f"Dimension {dim_key}: {len(dimensions[dim_key])} rows")
+    return dimensions
+
+
+def key_fact_rows(df, dimensions):
+    """
+    The fact rows of a frame: a surrogate key column per dimension, looked
+    up in dimensions, in place of the dimension's name columns
+    """
+    fact_df = df.copy(deep=False)
+    for dim_key, dim in DIMENSIONS.items():
+        dim_rows = dimensions[dim_key].reset_index()
+        keys = df[dim["columns"]].merge(dim_rows, on=dim["columns"],
+                                        how="left")[dim["key"]]
+        fact_df[dim["key"]] = keys.to_numpy(dtype="int32")
+        fact_df = fact_df.drop(columns=dimension_columns(dim_key))
+    return fact_df
+
+
+def split_star_schema(df):
+    """
+    Split the cleaned data into the fact table and its dimension tables.
+    Returns the fact frame, with a surrogate key column per dimension in
+    place of the dimension's name columns, and a dict of dimension session
+    key to the dimension frame indexed by its key.
+    """
+    dimensions = build_dimensions(distinct_dimension_rows(df))
+    return key_fact_rows(df, dimensions), dimensions
+
+
+def fact_columns(columns):
+    """
+    Columns to read from the fact frame for the given page columns: the
+    dimension columns are replaced by the keys they are joined on
+    """
+    if columns is None:
+        return None
+    wanted = list(columns)
+    for dim_key in needed_dimensions(columns):
+        wanted.append(DIMENSIONS[dim_key]["key"])
+    return wanted
+
+
+def needed_dimensions(columns):
+    """Dimensions holding any of the given columns, all if None"""
+    return [dim_key for dim_key in DIMENSIONS
+            if columns is None
+            or any(name in columns for name in dimension_columns(dim_key))]
+
+
+def join_dimensions(df, dimensions, columns=None):
+    """
+    Add the dimension columns asked for (all of them if columns is None)
+    to a frame holding the dimensions' keys, e.g. the fact rows or a
+    summary grouped by key. dimensions maps a dimension session key to
+    its frame. Columns the frame already has are left as they are, and
+    existing columns are not copied.
+    """
+    if df is None:
+        return None
+    joined = {name: df[name] for name in df.columns}
+    for dim_key, dim in DIMENSIONS.items():
+        wanted = [name for name in dim["columns"]
+                  if (columns is None or name in columns)
+                  and name not in joined]
+        if not wanted or dim["key"] not in df.columns:
+            continue
+        dim_df = dimensions.get(dim_key)
+        if dim_df is None:
+            logger.error(f"Dimension {dim_key} not loaded, columns"
+                         f" {wanted} not joined.")
+            continue
+        positions = dim_df.index.get_indexer(df[dim["key"]])
+        for name in wanted:
+            joined[name] = pd.Series(
+                dim_df[name].array.take(positions, allow_fill=True),
+                index=df.index, name=name)
+    return pd.DataFrame(joined, index=df.index, copy=False)
+
+
+def dimension_artifacts_exist():
+    """True if every dimension table has been saved"""
+    from data.data_file_defs import resolve_artifact_path
+    return all(resolve_artifact_path(pipeline_state().get(dim["fname"]))
+               for dim in DIMENSIONS.values())
+
+
+def save_dimensions(dimensions, inputs):
+    """Save the dimension tables as artifacts built from inputs"""
+    from data.data_file_defs import save_dataframe_artifact
+    for dim_key, dim_df in dimensions.items():
+        dim = DIMENSIONS[dim_key]
+        save_dataframe_artifact(dim_df, pipeline_state().get(dim["fname"]),
+                                index=True, artifact=dim["artifact"],
+                                inputs=inputs)
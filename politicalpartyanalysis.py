@@ -27,6 +27,7 @@ def pagesetup():
     )
     from app_pages.donor_loyalty_analysis import mod_donor_loyalty
     from app_pages.donor_type_analysis import mod_donor_type
+    from app_pages.memory_report import mod_memory_report
 
     # Create an instance of the MultiPage class
     app = MultiPage(app_name="UK Political Donations")  # Create an instance
@@ -53,6 +54,7 @@ def pagesetup():
     app.add_page("Donor Loyalty Analysis", mod_donor_loyalty)
     app.add_page("Donor Type Analysis", mod_donor_type)
     app.add_page("Notes on Data and Manipulations", notesondataprep_body)
+    app.add_page("Memory Report", mod_memory_report)
     app.add_page("Logout", logoutpage)
 
     # app.add_page("Regulated Entities", regulatedentitypage_body)
@@ -0,0 +1,107 @@
+import json
+import os
+import zipfile
+import pandas as pd
+import pytest
+import config
+from data.build import HeadlessSessionState
+from data.data_file_defs import (StreamingArtifactWriter, read_artifact,
+                                 resolve_artifact_path,
+                                 save_dataframe_artifact,
+                                 save_dataframe_to_zip)
+from utils.pipeline_state import use_pipeline_state
+
+
+def donations_with_carriage_returns():
+    return pd.DataFrame({
+        "ECRef": ["C0001", "C0002", "C0003"],
+        "DonorName": ["Smith\rJones", "Brown", "Line one\r\rLine two"],
+        "Value": [100.0, 250.5, 12.0],
+    })
+
+
+def test_zip_artifact_round_trips_bare_carriage_returns(tmp_path):
+    df = donations_with_carriage_returns()
+    filepath = save_dataframe_to_zip(df, tmp_path / "donations.zip",
+                                     index=False)
+    loaded_df = read_artifact("donations", filepath)
+    pd.testing.assert_frame_equal(loaded_df.reset_index(), df)
+
+
+def test_streamed_zip_artifact_round_trips_bare_carriage_returns(tmp_path):
+    df = donations_with_carriage_returns()
+    with StreamingArtifactWriter(tmp_path / "donations.zip", index=False,
+                                 artifact_format="zip") as writer:
+        writer.append(df.iloc[:2])
+        writer.append(df.iloc[2:])
+    loaded_df = read_artifact("donations", writer.filepath)
+    pd.testing.assert_frame_equal(loaded_df.reset_index(), df)
+
+
+def test_unparseable_zip_artifact_is_marked_stale(tmp_path):
+    filepath = tmp_path / "donations.zip"
+    with zipfile.ZipFile(filepath, "w") as zip_ref:
+        zip_ref.writestr("donations.csv",
+                         'ECRef,DonorName\nC0001,"unclosed\n' + "x" * 100)
+    manifest_path = tmp_path / "artifact_manifest.json"
+    manifest_path.write_text(json.dumps({"donations": {"rows": 1}}))
+    state = HeadlessSessionState(ARTIFACT_MANIFEST=str(manifest_path))
+    with use_pipeline_state(state):
+        assert read_artifact("donations", str(filepath)) is None
+    assert json.loads(manifest_path.read_text()) == {}
+
+
+def cleaned_donations_with_blanks():
+    # raw_data_cleanup fills the missing text fields with ""
+    return pd.DataFrame({
+        "ECRef": ["C0001", "C0002", "C0003"],
+        "RegulatedEntityType": ["Political Party", "Regulated Donee",
+                                "Political Party"],
+        "RegulatedDoneeType": ["", "MP - Member of Parliament", ""],
+        "PurposeOfVisit": ["", "Conference", ""],
+        "Postcode": ["SW1A 1AA", "", ""],
+        "Value": [100.0, 250.5, 12.0],
+    }, index=pd.RangeIndex(3, name="index"))
+
+
+@pytest.mark.parametrize("artifact_format", ["parquet", "zip"])
+def test_blank_columns_read_back_as_empty_strings(tmp_path, monkeypatch,
+                                                  artifact_format):
+    monkeypatch.setattr(config, "ARTIFACT_FORMAT", artifact_format)
+    df = cleaned_donations_with_blanks()
+    filepath = save_dataframe_artifact(df, tmp_path / "cleaned_donations",
+                                       artifact="cleaned_donations")
+    loaded_df = read_artifact("cleaned_donations", filepath)
+    for name in ["RegulatedDoneeType", "PurposeOfVisit", "Postcode"]:
+        assert loaded_df[name].astype(object).tolist() == df[name].tolist()
+
+
+def test_blank_columns_match_between_parquet_and_csv(tmp_path, monkeypatch):
+    df = cleaned_donations_with_blanks()
+    loaded = {}
+    for artifact_format in ["parquet", "zip"]:
+        monkeypatch.setattr(config, "ARTIFACT_FORMAT", artifact_format)
+        filepath = save_dataframe_artifact(
+            df, tmp_path / artifact_format / "cleaned_donations",
+            artifact="cleaned_donations")
+        loaded[artifact_format] = read_artifact("cleaned_donations",
+                                                filepath)
+    columns = ["RegulatedDoneeType", "RegulatedEntityType", "PurposeOfVisit"]
+    pd.testing.assert_frame_equal(
+        loaded["parquet"][columns].astype(object),
+        loaded["zip"][columns].astype(object))
+
+
+def test_parquet_artifact_keeps_shipped_zip_version(tmp_path, monkeypatch):
+    df = donations_with_carriage_returns()
+    zip_filepath = save_dataframe_to_zip(df, tmp_path / "donations.zip",
+                                         index=False)
+    monkeypatch.setattr(config, "ARTIFACT_FORMAT", "parquet")
+    parquet_filepath = save_dataframe_artifact(df, zip_filepath,
+                                               index=False)
+    assert os.path.exists(zip_filepath)
+    assert resolve_artifact_path(zip_filepath) == parquet_filepath
+    monkeypatch.setattr(config, "ARTIFACT_FORMAT", "zip")
+    save_dataframe_artifact(df, zip_filepath, index=False)
+    assert not os.path.exists(parquet_filepath)
+    assert resolve_artifact_path(parquet_filepath) == zip_filepath
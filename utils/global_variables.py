@@ -1,10 +1,10 @@
 # all globel variables and constants are defined here  #
-import streamlit as st
 from pathlib import Path
 from utils.logger import (log_function_call,
                           logger,
                           init_state_var)
 import config as config  # Import the config file
+from utils.pipeline_state import pipeline_state
 import os
 
 """
@@ -35,9 +35,15 @@ def initialize_session_state():
     init_state_var("thresholds", config.THRESHOLDS)
     init_state_var("data_remappings", config.DATA_REMAPPINGS)
     init_state_var("filter_def", config.FILTER_DEF)
+    init_state_var("derived_column_rules", config.DERIVED_COLUMN_RULES)
     init_state_var("security", config.SECURITY)
     init_state_var("perc_target", config.perc_target)
     init_state_var("RERUN_MP_PARTY_MEMBERSHIP", config.RERUN_MP_PARTY_MEMBERSHIP)
+    init_state_var("STREAMING_INGEST", config.STREAMING_INGEST)
+    init_state_var("OUT_OF_CORE", config.OUT_OF_CORE)
+    init_state_var("INCREMENTAL_CLEANING", config.INCREMENTAL_CLEANING)
+    init_state_var("SHARED_DATASET", config.SHARED_DATASET)
+    init_state_var("ANALYTICS_STORE", config.ANALYTICS_STORE)
     # Initialize directories
     init_state_var("directories", config.DIRECTORIES)
     init_state_var("electoral_cycle_rules", config.ELECTORAL_CYCLE_RULES)
@@ -55,6 +61,9 @@ def initialize_session_state():
         "components_dir",
         "app_pages_dir",
         "utils_dir",
+        "shared_dir",
+        "map_cache_dir",
+        "snapshots_dir",
             ]:
         init_state_var(dir_key, config.DIRECTORIES.get(dir_key))
 
@@ -72,7 +81,7 @@ def initialize_session_state():
 
     # write session state as list to log
     logger.info("Session_state variables initialized")
-    for key, value in st.session_state.items():
+    for key, value in pipeline_state().items():
         logger.debug(f"{key}: {value}")
 
     return logger.info("Session state Setup complete")
@@ -4,6 +4,7 @@ import sys
 import time
 import functools
 import streamlit as st
+from utils.pipeline_state import pipeline_state
 from functools import wraps
 
 # Allow dynamic control of log level via environment variable or a default
@@ -47,10 +48,10 @@ def log_function_call(func):
             return result
         except Exception as e:
             # check if error is already logged at a higher level
-            if not hasattr(st.session_state, "error_logged"):
+            if not hasattr(pipeline_state(), "error_logged"):
                 logger.error(f"Error in {func.__name__}:"
                              f" {e}", exc_info=True)
-                st.session_state.error_logged = True
+                pipeline_state().error_logged = True
                 st.error(f"Error in {func.__name__}: {e}")
             raise
     return wrapper
@@ -60,8 +61,8 @@ logger.info(f"Logging is set up correctly! Current log level: {LOG_LEVEL}")
 
 
 def init_state_var(var_name, config_value):
-    if var_name not in st.session_state:
-        st.session_state[var_name] = config_value
+    if var_name not in pipeline_state():
+        pipeline_state()[var_name] = config_value
         return logger.debug(f"Initialised {var_name} with value: {config_value}")
     else:
         return logger.debug(f"{var_name} already exists in session state")
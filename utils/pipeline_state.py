@@ -0,0 +1,31 @@
+"""
+Session state of the data pipeline
+
+The pipeline functions read their file paths and settings from
+pipeline_state(): the browser session's st.session_state in the app, or
+the state set with use_pipeline_state for a headless build. The state is
+held in a context variable, so a headless build leaves st.session_state
+and any other thread in the process untouched; threads the pipeline
+starts run in a copy of the context that started them.
+"""
+import contextlib
+import contextvars
+import streamlit as st
+
+_pipeline_state = contextvars.ContextVar("pipeline_state", default=None)
+
+
+def pipeline_state():
+    """The state the pipeline runs in, st.session_state if none is set"""
+    state = _pipeline_state.get()
+    return st.session_state if state is None else state
+
+
+@contextlib.contextmanager
+def use_pipeline_state(state):
+    """Run the pipeline in the current context with state"""
+    token = _pipeline_state.set(state)
+    try:
+        yield state
+    finally:
+        _pipeline_state.reset(token)